@@ -0,0 +1,144 @@
+"""市場をまたぐ終値の日付揃え
+
+日足の時刻は取得元が市場の現地時刻の0時（タイムゾーン付き）で返すため、東証と米国の
+銘柄を時刻のまま結合するとほとんど重ならない。各市場の現地の取引日に直してから
+次のいずれかの方法で揃える。
+
+- inner: 両方に終値がある取引日だけを使う（片方の休場日は落とす）
+- ffill: 片方が休場の日は直前の終値で埋める（max_stale 日より古い終値では埋めない）
+- offset: 基準銘柄（先頭の列）の各終値に、その時刻（各市場の大引けをUTCに直したもの）
+  までに確定していた他の銘柄の最新の終値を対応させる。東証の t 日には米国の t-1 日、
+  米国の t 日には東証の t 日の終値が対応する（max_stale 日より古いものは使わない）
+
+揃えた表は取引日（タイムゾーンなし）×銘柄で、使えない値はNaNのまま残す
+（相関はペアごとに両方の値がある日だけで計算する）。
+"""
+
+import numpy as np
+import pandas as pd
+
+# 日付の揃え方（表示名: 内部名）
+ALIGN_POLICIES = {
+    "共通の取引日のみ": "inner",
+    "直前の終値で補完": "ffill",
+    "大引けの時差で対応": "offset",
+}
+# 補完・対応に使う終値の古さの上限（暦日）の既定値
+DEFAULT_MAX_STALE = 4
+
+# 取引セッション（現地時刻）。バーの開始時刻が [開始, 終了) に入るものを使う
+MARKET_SESSIONS = {
+    "TSE": ("Asia/Tokyo", (("09:00", "11:30"), ("12:30", "15:30"))),
+    "US": ("America/New_York", (("09:30", "16:00"),)),
+}
+
+
+def market_of(ticker):
+    """証券コードから市場を推定する（".T" は東証、接尾辞なしは米国、その他はNone）"""
+    if ticker.upper().endswith(".T"):
+        return "TSE"
+    if "." not in ticker:
+        return "US"
+    return None
+
+
+def trading_dates(index):
+    """DatetimeIndex をタイムゾーンを外した取引日にする（現地時刻の日付）"""
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    # normalize() は頻度の推定に時間がかかるため、整数で日単位に切り捨てる
+    day = 24 * 3600 * 10**9
+    return pd.DatetimeIndex(index.as_unit("ns").asi8 // day * day, dtype="M8[ns]")
+
+
+def close_times(dates, market):
+    """取引日の大引けの時刻（UTCのエポックナノ秒）。市場が不明なら日付の0時（UTC）"""
+    dates = pd.DatetimeIndex(dates)
+    if market not in MARKET_SESSIONS:
+        return dates.as_unit("ns").asi8
+    tz, sessions = MARKET_SESSIONS[market]
+    close = pd.Timedelta(f"{sessions[-1][1]}:00")
+    return (dates + close).tz_localize(tz).tz_convert("UTC").as_unit("ns").asi8
+
+
+def _by_trading_date(closes):
+    """{銘柄: 終値Series} または DataFrame を、取引日×銘柄のDataFrameにする
+
+    銘柄ごとに取引日の整数の配列を作り、全銘柄の和集合の行に配置する
+    （Series の結合より速い）。同じ取引日が重複したら後の値を使う。
+    """
+    if isinstance(closes, pd.DataFrame):
+        closes = dict(closes.items())
+    dates, values = [], []
+    for close in closes.values():
+        close = close.dropna()
+        dates.append(trading_dates(close.index).asi8)
+        values.append(close.to_numpy(dtype=np.float64))
+    union = np.unique(np.concatenate(dates)) if dates else np.array([], np.int64)
+    table = np.full((len(union), len(dates)), np.nan)
+    for column, (day, value) in enumerate(zip(dates, values)):
+        table[np.searchsorted(union, day), column] = value
+    index = pd.DatetimeIndex(union, dtype="M8[ns]", name="Date")
+    return pd.DataFrame(table, index=index, columns=list(closes))
+
+
+def _forward_fill(frame, max_stale):
+    """直前の終値で埋める（max_stale 日より古い終値では埋めない）"""
+    values = frame.to_numpy(dtype=np.float64)
+    rows = np.arange(len(frame))[:, None]
+    last = np.maximum.accumulate(np.where(np.isfinite(values), rows, -1), axis=0)
+    filled = np.take_along_axis(values, np.maximum(last, 0), axis=0)
+    dates = frame.index.as_unit("ns").asi8
+    age = dates[:, None] - dates[np.maximum(last, 0)]
+    filled[(last < 0) | (age > pd.Timedelta(days=max_stale).value)] = np.nan
+    return pd.DataFrame(filled, index=frame.index, columns=frame.columns)
+
+
+def _offset(frame, markets, max_stale):
+    """基準銘柄（先頭の列）の大引けの時刻までに確定していた各銘柄の最新の終値を対応させる"""
+    values = frame.to_numpy()
+    valid = np.isfinite(values)
+    # 大引けの時刻は市場ごとに全取引日の分を1回だけ求める
+    times = {
+        market: close_times(frame.index, market)
+        for market in {markets[ticker] for ticker in frame.columns}
+    }
+    rows = valid[:, 0]
+    reference_times = times[markets[frame.columns[0]]][rows]
+    limit = pd.Timedelta(days=max_stale).value
+
+    aligned = np.full((rows.sum(), len(frame.columns)), np.nan)
+    if not rows.any():
+        # 基準銘柄に終値が無ければ対応させる日も無い
+        return pd.DataFrame(aligned, index=frame.index[rows], columns=frame.columns)
+    aligned[:, 0] = values[rows, 0]
+    for column, ticker in enumerate(frame.columns[1:], start=1):
+        if not valid[:, column].any():
+            # 上場前・売買停止中などで終値の無い銘柄は NaN のままにする
+            continue
+        ticker_times = times[markets[ticker]][valid[:, column]]
+        position = np.searchsorted(ticker_times, reference_times, side="right") - 1
+        found = np.maximum(position, 0)
+        usable = (position >= 0) & (reference_times - ticker_times[found] <= limit)
+        aligned[usable, column] = values[valid[:, column], column][found[usable]]
+    return pd.DataFrame(aligned, index=frame.index[rows], columns=frame.columns)
+
+
+def align_panel(closes, policy="inner", max_stale=DEFAULT_MAX_STALE, markets=None):
+    """終値を取引日×銘柄の表に揃える
+
+    closes は {銘柄: 終値Series} か DataFrame。markets は {銘柄: 市場}
+    （省略時は証券コードから推定）で、offset の大引けの時刻に使う。
+    """
+    frame = _by_trading_date(closes)
+    if policy == "ffill":
+        frame = _forward_fill(frame, max_stale)
+    elif policy == "offset":
+        if markets is None:
+            markets = {ticker: market_of(ticker) for ticker in frame.columns}
+        frame = _offset(frame, markets, max_stale)
+    elif policy != "inner":
+        raise ValueError(f"未対応の日付の揃え方です: {policy}")
+    frame.index.name = "Date"
+    return frame.dropna(how="all")
@@ -0,0 +1,288 @@
+"""相関分析の計算処理
+
+Streamlitに依存しない計算部分をまとめたモジュール。
+"""
+
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from alignment import DEFAULT_MAX_STALE, align_panel
+from estimators import DEFAULT_HALFLIFE, correlation
+from leadlag import MAX_LAG, cross_correlation, peak_lag
+from rolling import RollingPairStats
+
+# ペア指標で集計する移動窓（日数）
+PAIR_WINDOWS = (20, 60, 120)
+
+# リターンの種類（対数リターンは大きな値動きの影響が単純リターンより小さい）
+RETURN_KINDS = {"単純リターン": "simple", "対数リターン": "log"}
+
+# 相関係数の強さの区分（ゲージ・ヒートマップ共通）
+CORRELATION_BANDS = [
+    (-1.0, -0.7),
+    (-0.7, -0.4),
+    (-0.4, 0.4),
+    (0.4, 0.7),
+    (0.7, 1.0),
+]
+
+
+def to_returns(prices, kind="simple"):
+    """終値から1期間のリターンを作る（kind は "simple" か "log"。先頭行はNaN）"""
+    if kind == "log":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.log(prices).diff()
+    return prices.pct_change(fill_method=None)
+
+
+def build_returns_panel(closes, kind="simple"):
+    """{銘柄: 終値Series} から日付で揃えた日次リターンの表を作る
+
+    欠損日は落とさずNaNのまま残す（相関はペアごとに有効な日だけで計算する）。
+    """
+    prices = pd.DataFrame(closes).sort_index()
+    prices = prices.dropna(how="all")
+    return to_returns(prices, kind).iloc[1:]
+
+
+def align_closes(
+    close1, close2, ticker1, ticker2, policy="inner", max_stale=DEFAULT_MAX_STALE
+):
+    """2銘柄の終値を取引日で揃え、両方の値がある日だけを残す（policy は alignment 参照）"""
+    return align_panel({ticker1: close1, ticker2: close2}, policy, max_stale).dropna()
+
+
+def pair_returns(prices, kind="simple"):
+    """揃えた終値から日次リターンを作る（先頭行は落とす）"""
+    return to_returns(prices, kind).dropna()
+
+
+def pair_metrics(close1, close2, windows=PAIR_WINDOWS):
+    """2銘柄の相関・ベータ・移動相関・リードラグの要約を辞書で返す（バッチ処理用）
+
+    ベータ・アルファは銘柄2のリターンを銘柄1のリターンに回帰した傾きと切片。
+    移動相関・移動ベータは窓ごとに直近値と全期間の平均・最小・最大を出す。
+    lead_lag は ±MAX_LAG 日で相関の絶対値が最大の時差（正なら銘柄1が先行）。
+    """
+    prices = align_closes(close1, close2, "x", "y")
+    values = prices.to_numpy(dtype=np.float64)
+    # pair_returns と同じ日次リターン（Seriesを作らずに配列で計算する）
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = values[1:] / values[:-1] - 1.0
+    dates = prices.index[1:]
+    metrics = {
+        "observations": len(returns),
+        # 市場ごとにタイムゾーンが異なるため日付だけを残す
+        "start": dates[0].date() if len(dates) else None,
+        "end": dates[-1].date() if len(dates) else None,
+    }
+    if len(returns) < 3:
+        return metrics
+
+    stats = RollingPairStats(
+        pd.Series(returns[:, 0], index=dates), pd.Series(returns[:, 1], index=dates)
+    )
+    fit = stats.regression()
+    metrics.update(
+        {
+            "correlation": np.sign(fit["slope"]) * np.sqrt(fit["r_squared"]),
+            "beta": fit["slope"],
+            "beta_se": fit["slope_se"],
+            "alpha": fit["intercept"],
+            "r_squared": fit["r_squared"],
+        }
+    )
+    lead_lag, lead_lag_corr = peak_lag(
+        *cross_correlation(returns[:, 0], returns[:, 1], MAX_LAG)
+    )
+    metrics.update({"lead_lag": lead_lag, "lead_lag_corr": lead_lag_corr})
+    corr = stats.correlation_surface(windows)
+    beta = stats.beta_surface(windows)
+    for i, window in enumerate(windows):
+        if window > len(returns):
+            continue
+        rolling_corr = corr[i, window - 1 :]
+        metrics.update(
+            {
+                f"corr_{window}_last": rolling_corr[-1],
+                f"corr_{window}_mean": rolling_corr.mean(),
+                f"corr_{window}_min": rolling_corr.min(),
+                f"corr_{window}_max": rolling_corr.max(),
+                f"beta_{window}_last": beta[i, -1],
+            }
+        )
+    return metrics
+
+
+def _prepare(returns):
+    """中心化済みの値（欠損は0）と有効フラグを返す"""
+    values = returns.to_numpy(dtype=np.float64)
+    mask = np.isfinite(values)
+    # 桁落ちを避けるため、各列を自身の平均で中心化してから積和をとる
+    centered = np.where(mask, values - np.nanmean(values, axis=0), 0.0)
+    return centered, mask.astype(np.float64)
+
+
+def _pairwise_block(x, x_valid, y, y_valid):
+    """列ブロックxとyの全組み合わせについて、欠損をペアごとに除外した相関と観測数を返す"""
+    if x_valid.all() and y_valid.all():
+        # 欠損が無ければ中心化済みの値の内積1回で済む
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = (x.T @ y) / np.sqrt(np.outer((x**2).sum(axis=0), (y**2).sum(axis=0)))
+        np.clip(corr, -1.0, 1.0, out=corr)
+        return corr, np.full(corr.shape, float(len(x)))
+
+    count = x_valid.T @ y_valid
+    sum_x = x.T @ y_valid  # sum_x[i, j]: xiとyjが両方有効な日のxiの和
+    sum_y = x_valid.T @ y
+    sum_xx = (x**2).T @ y_valid
+    sum_yy = x_valid.T @ (y**2)
+    sum_xy = x.T @ y
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sum_xy - sum_x * sum_y / count
+        var_x = sum_xx - sum_x**2 / count
+        var_y = sum_yy - sum_y**2 / count
+        corr = cov / np.sqrt(var_x * var_y)
+
+    np.clip(corr, -1.0, 1.0, out=corr)
+    return corr, count
+
+
+def correlation_matrix(
+    returns, min_periods=2, method="pearson", halflife=DEFAULT_HALFLIFE
+):
+    """欠損をペアごとに除外した相関行列を行列積だけで計算する
+
+    各ペア (i, j) について、両方の値がある日だけを使ったピアソン相関を返す。
+    DataFrame.corr() と同じ結果を、銘柄数kに対して k×k のループなしで求める。
+    method に "spearman" / "kendall" / "ewma" を指定すると estimators の推定方法を使う
+    （スピアマンは各列を順位に付け替えてから同じ行列積で、ほかは全ペアをまとめて計算する）。
+    """
+    if method in ("kendall", "ewma"):
+        return _pairwise_matrix(returns, min_periods, method, halflife)
+    if method == "spearman":
+        # 順位は列ごとに付ける（欠損の無い期間ではペアごとに付けた場合と一致する）
+        returns = returns.rank()
+    centered, valid = _prepare(returns)
+    corr, count = _pairwise_block(centered, valid, centered, valid)
+
+    min_periods = max(min_periods, 2)
+    corr[count < min_periods] = np.nan
+    corr[np.diag_indices_from(corr)] = np.where(
+        np.diag(count) >= min_periods, 1.0, np.nan
+    )
+
+    return pd.DataFrame(corr, index=returns.columns, columns=returns.columns)
+
+
+def _pairwise_matrix(returns, min_periods, method, halflife, block_size=4096):
+    # 上三角のペアを block_size 組ずつ (日数, ペア数) の配列にして一度に計算する
+    values = returns.to_numpy(dtype=np.float64)
+    valid = np.isfinite(values)
+    n = values.shape[1]
+    rows, cols = np.triu_indices(n, k=1)
+    corr = np.full((n, n), np.nan)
+    for begin in range(0, len(rows), block_size):
+        i = rows[begin : begin + block_size]
+        j = cols[begin : begin + block_size]
+        block = np.atleast_1d(
+            correlation(values[:, i], values[:, j], method, halflife=halflife)
+        )
+        count = (valid[:, i] & valid[:, j]).sum(axis=0)
+        block[count < max(min_periods, 2)] = np.nan
+        corr[i, j] = corr[j, i] = block
+    corr[np.diag_indices(n)] = np.where(
+        valid.sum(axis=0) >= max(min_periods, 2), 1.0, np.nan
+    )
+    return pd.DataFrame(corr, index=returns.columns, columns=returns.columns)
+
+
+def top_correlated_pairs(returns, k=10, min_periods=20, block_size=512):
+    """相関が最も強いk組と最も弱い（負に強い）k組のペアを返す
+
+    相関行列全体は作らず、block_size列ずつのブロックで上三角だけを計算し、
+    各ブロックの候補をヒープに流して上位k件だけを保持する。
+    メモリ使用量はブロックサイズの2乗に比例し、銘柄数には依存しない。
+    戻り値は (正の相関の上位, 負の相関の上位) のDataFrame。
+    """
+    centered, valid = _prepare(returns)
+    tickers = list(returns.columns)
+    n = len(tickers)
+    min_periods = max(min_periods, 2)
+
+    # ヒープの要素は (キー, i, j, 相関, 観測数)。キーが小さいものから捨てる
+    top_heap = []
+    bottom_heap = []
+
+    for start_i in range(0, n, block_size):
+        stop_i = min(start_i + block_size, n)
+        x, x_valid = centered[:, start_i:stop_i], valid[:, start_i:stop_i]
+
+        for start_j in range(start_i, n, block_size):
+            stop_j = min(start_j + block_size, n)
+            corr, count = _pairwise_block(
+                x, x_valid, centered[:, start_j:stop_j], valid[:, start_j:stop_j]
+            )
+
+            rows, cols = np.indices(corr.shape)
+            usable = np.isfinite(corr) & (count >= min_periods)
+            if start_i == start_j:
+                # 対角ブロックは上三角（i < j）のみ
+                usable &= rows < cols
+            flat = np.flatnonzero(usable)
+            if flat.size == 0:
+                continue
+            values = corr.ravel()[flat]
+
+            for heap, sign in ((top_heap, 1.0), (bottom_heap, -1.0)):
+                # ブロック内の上位k件だけをヒープ候補にする
+                keys = sign * values
+                if keys.size > k:
+                    candidates = np.argpartition(keys, -k)[-k:]
+                else:
+                    candidates = np.arange(keys.size)
+                for c in candidates:
+                    index = flat[c]
+                    item = (
+                        keys[c],
+                        start_i + rows.ravel()[index],
+                        start_j + cols.ravel()[index],
+                        values[c],
+                        count.ravel()[index],
+                    )
+                    if len(heap) < k:
+                        heapq.heappush(heap, item)
+                    elif item[0] > heap[0][0]:
+                        heapq.heapreplace(heap, item)
+
+    def to_frame(heap):
+        items = sorted(heap, reverse=True)
+        return pd.DataFrame(
+            {
+                "ticker1": [tickers[item[1]] for item in items],
+                "ticker2": [tickers[item[2]] for item in items],
+                "correlation": [float(item[3]) for item in items],
+                "observations": [int(item[4]) for item in items],
+            }
+        )
+
+    return to_frame(top_heap), to_frame(bottom_heap)
+
+
+def cluster_order(corr):
+    """相関の近い銘柄が隣り合うように並べ替えた順序（階層クラスタリング）を返す"""
+    if len(corr) < 3:
+        return list(corr.index)
+
+    from scipy.cluster.hierarchy import leaves_list, linkage
+    from scipy.spatial.distance import squareform
+
+    distance = 1.0 - np.nan_to_num(corr.to_numpy(), nan=0.0)
+    distance = (distance + distance.T) / 2
+    np.fill_diagonal(distance, 0.0)
+    np.clip(distance, 0.0, 2.0, out=distance)
+    order = leaves_list(linkage(squareform(distance, checks=False), method="average"))
+    return list(corr.index[order])
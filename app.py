@@ -1,34 +1,101 @@
-import matplotlib as mpl
-import matplotlib.pyplot as plt
+import os
+import re
+
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
-import yfinance as yf
 from plotly.subplots import make_subplots
 
-# 日本語フォント設定
-plt.rcParams["font.family"] = "IPAexGothic"
-
-# 黒とミントグリーンを基調としたスタイル設定
-mint_green = "#3EB489"
-dark_bg = "#121212"
-light_mint = "#8ED3B5"
-text_color = "#FFFFFF"
-
-# Matplotlibのスタイル設定
-plt.style.use("dark_background")
-mpl.rcParams["figure.facecolor"] = dark_bg
-mpl.rcParams["axes.facecolor"] = dark_bg
-mpl.rcParams["axes.edgecolor"] = text_color
-mpl.rcParams["axes.labelcolor"] = text_color
-mpl.rcParams["text.color"] = text_color
-mpl.rcParams["xtick.color"] = text_color
-mpl.rcParams["ytick.color"] = text_color
-mpl.rcParams["grid.color"] = "#333333"
-mpl.rcParams["axes.prop_cycle"] = plt.cycler(
-    "color", [mint_green, light_mint, "#FFD700", "#FF6B6B", "#4682B4"]
+from alignment import ALIGN_POLICIES, DEFAULT_MAX_STALE, align_panel, market_of
+from analytics import (
+    CORRELATION_BANDS,
+    RETURN_KINDS,
+    build_returns_panel,
+    cluster_order,
+    correlation_matrix,
+    pair_returns,
+    top_correlated_pairs,
+)
+from cache import shared_cache
+from confidence import (
+    BOOTSTRAP_WORKERS,
+    CONFIDENCE_LEVEL,
+    INTERVAL_METHODS,
+    ROLLING_RESAMPLES,
+    bootstrap_interval,
+    ewma_effective_n,
+    fisher_interval,
+    rolling_bootstrap_interval,
+)
+from downsample import (
+    DENSITY_THRESHOLD,
+    MAX_POINTS,
+    density_grid,
+    downsample_series,
+    scatter_trace,
+)
+
+# ゲージの節で相関係数の値を変数 correlation に入れるため、関数は別名で読み込む
+from estimators import DEFAULT_HALFLIFE, ESTIMATORS, rolling_correlation
+from estimators import correlation as pair_correlation
+from fetcher import fetch_all, fetch_names
+from instrumentation import (
+    begin_rerun,
+    end_rerun,
+    span,
+    start_metrics_server,
+    timings,
+)
+from intraday import (
+    INTERVAL_OPTIONS,
+    IntradayStore,
+    align_intraday,
+    intraday_periods,
+    intraday_returns,
 )
+from leadlag import (
+    MAX_LAG,
+    MAX_LAG_LIMIT,
+    cross_correlation,
+    lead_lag_pairs,
+    peak_lag,
+    rolling_cross_correlation,
+)
+from live import LIVE_WINDOW, POLL_INTERVALS, LivePair
+from panel import open_panel
+from portfolio import (
+    WEIGHT_SCHEMES,
+    complete_returns,
+    diversification_ratio,
+    ledoit_wolf,
+    portfolio_table,
+    portfolio_weights,
+)
+from prewarm import (
+    DEFAULT_JITTER,
+    DEFAULT_RATE,
+    DEFAULT_TIMES,
+    Prewarmer,
+    parse_pairs,
+    parse_times,
+)
+from price_store import PriceStore
+from providers import provider_from_env
+from regression import fit_line
+from rolling import SURFACE_WINDOWS, RollingPairStats
+from tables import EXPORTS, page, page_count, to_arrow
+from theme import (
+    CORRELATION_BAND_COLORS,
+    CUSTOM_CSS,
+    LIGHT_MINT,
+    MINT_GREEN,
+    TEXT_COLOR,
+    THEME_COLORS,
+)
+
+# 再実行ごとの処理時間の計測を開始
+begin_rerun()
 
 # ページ設定
 st.set_page_config(
@@ -38,169 +105,8 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
-# モダンなデザインのカスタムCSS - 黒とミントグリーンのテーマに変更
-st.markdown(
-    """
-<style>
-    /* 全体のテーマカラー - 黒とミントグリーン */
-    :root {
-        --primary: #3EB489;
-        --secondary: #2D8E6E;
-        --accent: #8ED3B5;
-        --background: #121212;
-        --text: #FFFFFF;
-        --light-text: #AAAAAA;
-        --card-bg: #1E1E1E;
-        --positive: #4CAF50;
-        --negative: #F44336;
-        --neutral: #8ED3B5;
-    }
-    
-    /* 全体の背景色を黒に */
-    .stApp {
-        background-color: var(--background);
-    }
-    
-    /* メインヘッダー */
-    .main-header {
-        font-size: 2.8rem;
-        font-weight: 700;
-        color: var(--primary);
-        text-align: center;
-        margin-bottom: 1rem;
-        background: linear-gradient(90deg, var(--primary), var(--accent));
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        padding: 1.5rem 0;
-    }
-    
-    /* サブヘッダー */
-    .sub-header {
-        font-size: 1.8rem;
-        font-weight: 600;
-        color: var(--secondary);
-        margin: 1.5rem 0 1rem 0;
-        border-left: 5px solid var(--accent);
-        padding-left: 0.8rem;
-    }
-    
-    /* カードスタイル */
-    .card {
-        padding: 1.8rem;
-        border-radius: 12px;
-        background-color: var(--card-bg);
-        box-shadow: 0 6px 16px rgba(0,0,0,0.3);
-        margin-bottom: 1.8rem;
-        border: 1px solid rgba(255,255,255,0.1);
-        transition: transform 0.3s ease, box-shadow 0.3s ease;
-    }
-    
-    .card:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 12px 20px rgba(0,0,0,0.4);
-    }
-    
-    /* 相関ガイド */
-    .correlation-guide {
-        background-color: rgba(62, 180, 137, 0.1);
-        padding: 1.2rem;
-        border-radius: 10px;
-        margin-top: 1rem;
-        border-left: 4px solid var(--accent);
-    }
-    
-    /* 免責事項 */
-    .disclaimer {
-        font-size: 0.8rem;
-        color: var(--light-text);
-        font-style: italic;
-        text-align: center;
-        margin-top: 2rem;
-        padding: 1rem;
-        background-color: rgba(30, 30, 30, 0.7);
-        border-radius: 8px;
-    }
-    
-    /* ボタンスタイル */
-    .stButton>button {
-        background-color: var(--primary);
-        color: white;
-        border-radius: 8px;
-        border: none;
-        padding: 0.5rem 1rem;
-        transition: all 0.3s ease;
-    }
-    
-    .stButton>button:hover {
-        background-color: var(--secondary);
-        transform: translateY(-2px);
-        box-shadow: 0 4px 8px rgba(0,0,0,0.2);
-    }
-    
-    /* タブスタイル */
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 10px;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        border-radius: 6px 6px 0px 0px;
-        padding: 10px 16px;
-        background-color: #2A2A2A;
-        color: var(--text);
-    }
-    
-    .stTabs [aria-selected="true"] {
-        background-color: var(--accent) !important;
-        color: black !important;
-    }
-    
-    /* テキストインプットスタイル */
-    .stTextInput input {
-        border-radius: 8px;
-        border: 1px solid #444444;
-        padding: 10px;
-        background-color: #2A2A2A;
-        color: var(--text);
-    }
-    
-    .stTextInput input:focus {
-        border-color: var(--primary);
-        box-shadow: 0 0 0 2px rgba(62, 180, 137, 0.3);
-    }
-    
-    /* リスト項目と目安の表示改善 */
-    .correlation-scale {
-        display: flex;
-        align-items: center;
-        margin-bottom: 0.5rem;
-        color: var(--text);
-    }
-    
-    .scale-indicator {
-        width: 12px;
-        height: 12px;
-        border-radius: 50%;
-        margin-right: 8px;
-    }
-    
-    /* Streamlit要素のテキスト色調整 */
-    .stMarkdown, h1, h2, h3, h4, h5, p, span, label {
-        color: var(--text) !important;
-    }
-    
-    /* レスポンシブ調整 */
-    @media only screen and (max-width: 768px) {
-        .main-header {
-            font-size: 2rem;
-        }
-        .sub-header {
-            font-size: 1.5rem;
-        }
-    }
-</style>
-""",
-    unsafe_allow_html=True,
-)
+# カスタムCSS（文字列はtheme.pyでプロセスごとに1回だけ作る）
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 # アプリのヘッダーとイントロダクション
 st.markdown(
@@ -216,21 +122,75 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+# 相関行列・ポートフォリオで扱う最大銘柄数（行列を丸ごと作り、描画するため）
+MAX_MATRIX_TICKERS = 500
+# ペアスクリーナーで扱う最大銘柄数（相関はブロックごとに計算し、行列全体は作らない）
+MAX_SCREENER_TICKERS = 5000
+# ポートフォリオの配分のチャートに表示する最大銘柄数
+PORTFOLIO_CHART_TICKERS = 50
+# 散布図の回帰直線（表示名: regression.fit_line の手法名）
+REGRESSION_METHODS = {
+    "最小二乗法": "ols",
+    "Huber": "huber",
+    "Theil-Sen": "theil_sen",
+}
+
+
+def parse_ticker_list(text):
+    # カンマ・読点・空白・改行で区切り、重複を除いて入力順に並べる
+    tickers = [t.strip() for t in re.split(r"[\s,、]+", text) if t.strip()]
+    return list(dict.fromkeys(tickers))
+
+
 # 入力フォーム（モダンなカードデザイン）
 with st.container():
-    col1, col2 = st.columns(2)
-    with col1:
-        ticker1 = st.text_input(
-            "証券コード1（例: 7203.T）",
-            value="7203.T",
-            help="日本株の場合、コードの後に '.T' を付けてください",
+    # スクリーナーから選んだペアを開けるよう、入力欄の値はセッション状態で持つ
+    st.session_state.setdefault("ticker1", "7203.T")
+    st.session_state.setdefault("ticker2", "6758.T")
+
+    analysis_mode = st.radio(
+        "分析モード",
+        ["2銘柄比較", "複数銘柄（相関行列）", "ペアスクリーナー", "ポートフォリオ構築"],
+        horizontal=True,
+        key="analysis_mode",
+    )
+
+    if analysis_mode == "2銘柄比較":
+        col1, col2 = st.columns(2)
+        with col1:
+            ticker1 = st.text_input(
+                "証券コード1（例: 7203.T）",
+                key="ticker1",
+                help="日本株の場合、コードの後に '.T' を付けてください",
+            )
+        with col2:
+            ticker2 = st.text_input(
+                "証券コード2（例: 6758.T）",
+                key="ticker2",
+                help="日本株の場合、コードの後に '.T' を付けてください",
+            )
+    else:
+        max_tickers = (
+            MAX_SCREENER_TICKERS
+            if analysis_mode == "ペアスクリーナー"
+            else MAX_MATRIX_TICKERS
         )
-    with col2:
-        ticker2 = st.text_input(
-            "証券コード2（例: 6758.T）",
-            value="6758.T",
-            help="日本株の場合、コードの後に '.T' を付けてください",
+        ticker_list_text = st.text_area(
+            "証券コード一覧（カンマ・スペース・改行区切り）",
+            value="7203.T, 7267.T, 7201.T, 6758.T, 6752.T, 6501.T, 8306.T, 8316.T, 8411.T",
+            help=(
+                f"相関行列・ポートフォリオは最大{MAX_MATRIX_TICKERS}銘柄、"
+                f"ペアスクリーナーは最大{MAX_SCREENER_TICKERS:,}銘柄まで指定できます"
+            ),
         )
+        matrix_tickers = parse_ticker_list(ticker_list_text)
+        if len(matrix_tickers) > max_tickers:
+            st.warning(
+                f"{len(matrix_tickers):,}銘柄が入力されました。"
+                f"このモードでは先頭の{max_tickers:,}銘柄だけを使います。"
+            )
+            matrix_tickers = matrix_tickers[:max_tickers]
+        ticker1 = ticker2 = ""
 
     # 期間選択
     period_options = {
@@ -243,83 +203,1586 @@ with st.container():
         "最大": "max",
     }
 
+    # 足の間隔（日中足は2銘柄比較のみ。取得できる期間は間隔ごとに短くなる）
+    interval = "1d"
+    if analysis_mode == "2銘柄比較":
+        interval_label = st.selectbox(
+            "足の間隔", list(INTERVAL_OPTIONS), key="interval_label"
+        )
+        interval = INTERVAL_OPTIONS[interval_label]
+    if interval != "1d":
+        period_options = intraday_periods(interval)
+
+    # ライブ更新（日中足のみ。新しいバーだけを一定間隔で取り込む）
+    live_mode = False
+    live_poll = POLL_INTERVALS[-1]
+    if interval != "1d":
+        live_mode = st.toggle("ライブ更新", key="live_mode")
+        if live_mode:
+            live_poll = st.select_slider(
+                "更新間隔（秒）", options=POLL_INTERVALS, value=10, key="live_poll"
+            )
+
+    default_period = "1年" if "1年" in period_options else list(period_options)[-1]
     selected_period = st.select_slider(
-        "分析期間を選択", options=list(period_options.keys()), value="1年"
+        "分析期間を選択", options=list(period_options.keys()), value=default_period
     )
 
+    # リターンの種類と相関の推定方法（ゲージ・移動相関・相関行列に共通。
+    # スクリーナーはピアソンのみ、ポートフォリオは縮小推定の共分散を使う）
+    col_kind, col_estimator = st.columns(2)
+    with col_kind:
+        return_kind_label = st.radio(
+            "リターンの種類", list(RETURN_KINDS), horizontal=True, key="return_kind"
+        )
+    estimator_label = "ピアソン"
+    if analysis_mode in ("2銘柄比較", "複数銘柄（相関行列）"):
+        with col_estimator:
+            estimator_label = st.selectbox(
+                "相関の推定方法", list(ESTIMATORS), key="estimator"
+            )
+    return_kind = RETURN_KINDS[return_kind_label]
+    estimator = ESTIMATORS[estimator_label]
+    halflife = DEFAULT_HALFLIFE
+    if estimator == "ewma":
+        halflife = st.slider(
+            f"EWMAの半減期（{'本' if interval != '1d' else '日'}数）",
+            5,
+            120,
+            DEFAULT_HALFLIFE,
+            5,
+            key="ewma_halflife",
+        )
+    # 相関係数の信頼区間（ゲージと移動相関のチャートに帯で表示。2銘柄比較のみ）
+    ci_label = "なし"
+    if analysis_mode == "2銘柄比較":
+        ci_label = st.radio(
+            f"信頼区間（{CONFIDENCE_LEVEL:.0%}）",
+            list(INTERVAL_METHODS),
+            horizontal=True,
+            key="ci_method",
+        )
+    interval_method = INTERVAL_METHODS[ci_label]
+
+    # 日足の日付の揃え方（東証と米国など、休場日・時差の異なる銘柄を組み合わせるとき）
+    align_policy = "inner"
+    max_stale = DEFAULT_MAX_STALE
+    if interval == "1d":
+        align_label = st.selectbox(
+            "日付の揃え方",
+            list(ALIGN_POLICIES),
+            key="align_policy",
+            help="補完・時差対応では、指定した日数より古い終値は使いません。",
+        )
+        align_policy = ALIGN_POLICIES[align_label]
+        if align_policy != "inner":
+            max_stale = st.slider(
+                "使う終値の古さの上限（日）", 1, 10, DEFAULT_MAX_STALE, key="max_stale"
+            )
+
+    # 日付の揃え方で行が変わるため、2銘柄比較の計算のキャッシュのキーに含める
+    align_key = (align_policy, max_stale)
+
     theme = "グリーン"
 
     period = period_options[selected_period]
 
+# 日足と日中足で変わる表示の単位
+is_intraday = interval != "1d"
+bar_unit = "本" if is_intraday else "日"
+return_label = ("" if is_intraday else "日次") + (
+    "対数リターン" if return_kind == "log" else "リターン"
+)
+
 # テーマ設定
-theme_colors = {
-    "ブルー": {
-        "primary": "#4361ee",
-        "secondary": "#3f37c9",
-        "accent": "#4895ef",
-        "divergent": "RdBu",
-    },
-    "グリーン": {
-        "primary": "#2D936C",
-        "secondary": "#1F6E54",
-        "accent": "#38B09D",
-        "divergent": "BrBG",
-    },
-    "レッド": {
-        "primary": "#FF5A5F",
-        "secondary": "#C73E42",
-        "accent": "#FF8A8E",
-        "divergent": "RdGy",
-    },
-    "ダーク": {
-        "primary": "#374151",
-        "secondary": "#1F2937",
-        "accent": "#4B5563",
-        "divergent": "inferno",
-    },
-}
+current_theme = THEME_COLORS[theme]
+
+
+@st.cache_resource
+def get_data_provider():
+    # 株価データの取得元（環境変数 DATA_PROVIDER で切り替え、プロセス内で共有）
+    return provider_from_env()
+
+
+@st.cache_resource
+def get_history_loader():
+    # ネットワーク越しの取得元にはローカル株価ストアを挟む
+    provider = get_data_provider()
+    if provider.remote:
+        return PriceStore(provider.history).history
+    return provider.history
+
+
+@st.cache_resource
+def get_intraday_store():
+    # 日中足は銘柄×間隔ごとのリングバッファに保持し、最新バーだけを追加で取得する
+    return IntradayStore(get_data_provider().history)
+
+
+@st.cache_resource
+def get_price_panel():
+    # PRICE_PANEL_DIR を指定すると、複数銘柄モードは株価パネルから直接切り出す
+    root = os.environ.get("PRICE_PANEL_DIR")
+    return open_panel(root) if root else None
+
+
+data_provider = get_data_provider()
+load_history = get_history_loader()
+intraday_store = get_intraday_store()
+price_panel = get_price_panel()
+
+# 共有キャッシュの状況（監視用）
+with st.sidebar.expander("📦 キャッシュ統計"):
+    st.json(shared_cache.stats())
+    st.json({"intraday": intraday_store.stats()})
+
+# METRICS_PORT を指定すると、集計した処理時間を /metrics で公開する
+if os.environ.get("METRICS_PORT"):
+    start_metrics_server(
+        int(os.environ["METRICS_PORT"]),
+        extra_counters=lambda: {
+            f"cache_{name}": value for name, value in shared_cache.stats().items()
+        },
+    )
+
+# 処理時間パネルは DEBUG_TIMINGS=1 または URLの ?debug=1 で表示する
+show_timings = (
+    os.environ.get("DEBUG_TIMINGS") == "1" or st.query_params.get("debug") == "1"
+)
+
+
+def show_chart(name, fig):
+    # 図のシリアライズとブラウザへの送信にかかる時間も計測する
+    with span(f"render.{name}"):
+        st.plotly_chart(fig, use_container_width=True)
+
+
+def render_timing_panel(trace):
+    # 今回の再実行のウォーターフォールと、プロセス全体のステージ別集計
+    with st.sidebar.expander("⏱ 処理時間", expanded=True):
+        st.caption(f"再実行全体: {trace.total * 1000:.1f} ms")
+
+        spans = sorted(trace.spans, key=lambda s: s["start"])
+        labels = [
+            f"{i + 1:02d} {'  ' * s['depth']}{s['name']}" for i, s in enumerate(spans)
+        ]
+        fig_waterfall = go.Figure(
+            go.Bar(
+                y=labels,
+                x=[s["duration"] * 1000 for s in spans],
+                base=[s["start"] * 1000 for s in spans],
+                orientation="h",
+                marker_color=current_theme["primary"],
+                hovertemplate="%{y}<br>開始 %{base:.1f} ms<br>所要 %{x:.1f} ms<extra></extra>",
+            )
+        )
+        fig_waterfall.update_layout(
+            xaxis_title="経過時間 (ms)",
+            yaxis=dict(autorange="reversed"),
+            template="plotly_white",
+            height=max(200, 22 * len(spans) + 60),
+            margin=dict(l=10, r=10, t=10, b=30),
+        )
+        st.plotly_chart(fig_waterfall, use_container_width=True)
+
+        summary = pd.DataFrame.from_dict(timings.summary(), orient="index")
+        st.dataframe(
+            summary[["count", "p50", "p95"]] * [1, 1000, 1000],
+            use_container_width=True,
+            column_config={
+                "count": st.column_config.NumberColumn("回数", format="%d"),
+                "p50": st.column_config.NumberColumn("p50 (ms)", format="%.1f"),
+                "p95": st.column_config.NumberColumn("p95 (ms)", format="%.1f"),
+            },
+        )
+
+
+def finish_rerun():
+    # 計測を締めて、必要なら処理時間パネルを表示する
+    trace = end_rerun()
+    if trace is not None and show_timings:
+        render_timing_panel(trace)
+
+
+def fetch_pair(ticker1, ticker2, period, interval):
+    # 株価履歴を取得し、終値を時刻で揃える（銘柄情報も並列に取得して共有キャッシュに
+    # 入れておく。会社名はメモ化せず fetch_names で毎回キャッシュから引く）
+    # （日足はローカルストア、日中足はリングバッファに無い分だけ上流から取得）
+    if interval == "1d":
+        history_fn = load_history
+    else:
+
+        def history_fn(ticker, period):
+            return intraday_store.history(ticker, period, interval)
+
+    with span("fetch"):
+        histories, _ = fetch_all(
+            [ticker1, ticker2],
+            period,
+            history_fn,
+            info_fn=data_provider.info,
+            interval=interval,
+        )
+    data1 = histories[ticker1]
+    data2 = histories[ticker2]
+    if data1.empty or data2.empty:
+        return None
+
+    # データ整形 - それぞれから終値のみ抽出
+    if interval == "1d":
+        # 日足は日付の揃え方を選べるため、終値のまま返して get_aligned_panel で揃える
+        return {ticker1: data1["Close"], ticker2: data2["Close"]}
+    with span("align"):
+        return align_intraday(data1["Close"], data2["Close"], ticker1, ticker2)
+
+
+@st.cache_data(ttl=600, max_entries=256, show_spinner=False)
+def load_pair(ticker1, ticker2, period):
+    # 日足のペアの終値はメモ化する
+    return fetch_pair(ticker1, ticker2, period, "1d")
+
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def load_intraday_pair(ticker1, ticker2, period, interval):
+    # 日中足は更新が速いため短い期間だけメモ化する
+    return fetch_pair(ticker1, ticker2, period, interval)
+
+
+@st.cache_data(ttl=600, max_entries=64, show_spinner=False)
+def get_aligned_panel(tickers, period, policy, max_stale, last_bars, _closes):
+    # 取引日で揃えた終値。銘柄・期間・揃え方・各銘柄の最終バーが同じなら
+    # 再実行やモードの切り替えをまたいで使い回す
+    return align_panel(_closes, policy, max_stale)
+
+
+def last_bars_of(closes):
+    # 揃えた終値のキャッシュのキー（各銘柄の最終バー）
+    return tuple(
+        (ticker, close.index[-1] if len(close) else None)
+        for ticker, close in closes.items()
+    )
+
+
+def aligned_closes(closes, period):
+    # {銘柄: 終値} をサイドバーで選んだ方法で揃える（キャッシュ経由）
+    last_bars = last_bars_of(closes)
+    with span("align"):
+        return get_aligned_panel(
+            tuple(closes), period, align_policy, max_stale, last_bars, closes
+        )
+
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_rolling_stats(
+    ticker1, ticker2, period, policy, last_date, return_kind, _returns
+):
+    # ペアごとの累積和を保持し、移動窓を変えても全体を再走査しない
+    return RollingPairStats(_returns[ticker1], _returns[ticker2])
+
+
+def correlation_colorscale():
+    # 相関係数の強さ区分をそのまま色の境界にした離散カラースケール
+    colorscale = []
+    for (low, high), color in zip(CORRELATION_BANDS, CORRELATION_BAND_COLORS):
+        colorscale.append([(low + 1) / 2, color])
+        colorscale.append([(high + 1) / 2, color])
+    return colorscale
+
+
+def load_universe_returns(tickers, period, label, timeout):
+    # 株価パネルに全銘柄があれば、銘柄ごとのDataFrameを作らずにパネルから切り出す
+    if price_panel is not None and all(t in price_panel for t in tickers):
+        with span("panel"):
+            if align_policy == "inner":
+                return price_panel.period_returns(period, tickers, return_kind)
+            closes = price_panel.closes(price_panel.period_start(period), None, tickers)
+        closes = dict(closes.items())
+    else:
+        with st.spinner(f"{len(tickers)}銘柄のデータを取得中..."), span("fetch"):
+            histories, _ = fetch_all(
+                tickers, period, load_history, history_timeout=timeout
+            )
+        closes = {t: histories[t]["Close"] for t in tickers if not histories[t].empty}
+        missing = [t for t in tickers if t not in closes]
+        if missing:
+            st.warning(
+                f"次の証券コードのデータを取得できませんでした: {', '.join(missing)}"
+            )
+        if len(closes) < 2:
+            st.error(f"{label}には、データを取得できた銘柄が2つ以上必要です。")
+            return None
+
+    prices = aligned_closes(closes, period)
+    with span("returns"):
+        return build_returns_panel(prices, return_kind)
+
+
+def render_correlation_matrix(tickers, period, selected_period):
+    # 複数銘柄の相関行列をクラスタリング順のヒートマップで表示
+    if len(tickers) < 2:
+        st.info("2つ以上の証券コードを入力してください。")
+        return
+
+    returns = load_universe_returns(tickers, period, "相関行列の計算", 120)
+    if returns is None:
+        return
+
+    with span("correlation_matrix"):
+        corr = correlation_matrix(
+            returns, min_periods=10, method=estimator, halflife=halflife
+        )
+        order = cluster_order(corr)
+    corr = corr.loc[order, order]
+
+    start_date = returns.index.min().strftime("%Y年%m月%d日")
+    end_date = returns.index.max().strftime("%Y年%m月%d日")
+    st.markdown(
+        """
+    <div style="background-color: rgba(62, 180, 137, 0.1); padding: 1rem; border-radius: 10px; margin-bottom: 1rem; border-left: 4px solid var(--accent);">
+        <p style="margin-top: 0; color: var(--primary);">📅 分析期間</p>
+        <p style="margin-bottom: 0; color: var(--text);"><strong>{start}</strong> 〜 <strong>{end}</strong> の {count} 銘柄を分析</p>
+    </div>
+    """.format(start=start_date, end=end_date, count=len(order)),
+        unsafe_allow_html=True,
+    )
+
+    st.markdown(
+        '<h3 class="sub-header">相関行列</h3>',
+        unsafe_allow_html=True,
+    )
+
+    with span("figure.matrix"):
+        fig_matrix = go.Figure(
+            go.Heatmap(
+                z=corr.to_numpy(),
+                x=order,
+                y=order,
+                zmin=-1,
+                zmax=1,
+                colorscale=correlation_colorscale(),
+                colorbar=dict(
+                    title="相関係数", tickvals=[-1, -0.7, -0.4, 0, 0.4, 0.7, 1]
+                ),
+                hovertemplate="%{y} × %{x}<br>相関係数: %{z:.4f}<extra></extra>",
+            )
+        )
+        fig_matrix.update_layout(
+            title=f"{return_label}の相関行列（{estimator_label}, {selected_period}）",
+            template="plotly_white",
+            height=min(max(500, 18 * len(order)), 1400),
+            margin=dict(l=10, r=10, t=70, b=30),
+            yaxis=dict(autorange="reversed"),
+        )
+    show_chart("matrix", fig_matrix)
+
+    with st.expander("相関行列データを表示"):
+        with span("table.matrix"):
+            st.dataframe(corr.round(4), use_container_width=True, height=400)
+
+
+def open_selected_pair(table_key, pairs):
+    # スクリーナーで選択された行のペアを2銘柄比較で開く
+    rows = st.session_state[table_key].selection.rows
+    if not rows:
+        return
+    pair = pairs.iloc[rows[0]]
+    st.session_state["ticker1"] = pair["ticker1"]
+    st.session_state["ticker2"] = pair["ticker2"]
+    st.session_state["analysis_mode"] = "2銘柄比較"
+
+
+def render_pair_table(title, pairs, table_key):
+    st.markdown(f"#### {title}")
+    with span(f"table.{table_key}"):
+        st.dataframe(
+            pairs,
+            key=table_key,
+            on_select=lambda: open_selected_pair(table_key, pairs),
+            selection_mode="single-row",
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "ticker1": "証券コード1",
+                "ticker2": "証券コード2",
+                "correlation": st.column_config.NumberColumn("相関係数", format="%.4f"),
+                "observations": st.column_config.NumberColumn("観測日数", format="%d"),
+                "lead_lag": st.column_config.NumberColumn(
+                    f"最大相関の時差（{bar_unit}）",
+                    help="正の値は証券コード1が先行",
+                    format="%+d",
+                ),
+                "lead_lag_correlation": st.column_config.NumberColumn(
+                    "時差相関", format="%.4f"
+                ),
+            },
+        )
+
+
+def render_pair_screener(tickers, period, selected_period):
+    # ユニバース内の全ペアから相関の強いペア・負に強いペアを抽出
+    if len(tickers) < 2:
+        st.info("2つ以上の証券コードを入力してください。")
+        return
+
+    top_k = st.slider("表示するペア数", 5, 50, 10, 5)
+
+    returns = load_universe_returns(tickers, period, "スクリーニング", 600)
+    if returns is None:
+        return
+
+    count = returns.shape[1]
+    with st.spinner(f"{count * (count - 1) // 2:,}ペアの相関を計算中..."), span(
+        "screener"
+    ):
+        top_pairs, bottom_pairs = top_correlated_pairs(
+            returns, k=top_k, min_periods=min(20, max(len(returns) // 2, 2))
+        )
+        # 抽出したペアのリードラグ（全ペアを1回のFFTでまとめて計算）
+        top_pairs, bottom_pairs = (
+            lead_lag_pairs(returns, pairs, MAX_LAG).drop(columns="lag0_correlation")
+            for pairs in (top_pairs, bottom_pairs)
+        )
+
+    st.markdown(
+        '<h3 class="sub-header">ペアスクリーナー</h3>',
+        unsafe_allow_html=True,
+    )
+    st.caption(
+        f"{selected_period}の{return_label}のピアソン相関で計算。"
+        f"時差は±{MAX_LAG}{bar_unit}で相関の絶対値が最大のもの。"
+        "行を選択すると2銘柄比較で開きます。"
+    )
+
+    col1, col2 = st.columns(2)
+    with col1:
+        render_pair_table("📈 正の相関が強いペア", top_pairs, "screener_top")
+    with col2:
+        render_pair_table("📉 負の相関が強いペア", bottom_pairs, "screener_bottom")
+
+
+@st.cache_data(ttl=600, max_entries=32)
+def get_shrunk_covariance(tickers, period, return_kind, policy, last_date, _returns):
+    # 全銘柄の値がそろう日のリターンから縮小推定の共分散を求める
+    # （配分の方法を変えてもデータの取得・共分散の推定はやり直さない）
+    complete, dropped = complete_returns(_returns)
+    covariance, shrinkage = ledoit_wolf(complete.to_numpy())
+    covariance = pd.DataFrame(
+        covariance, index=complete.columns, columns=complete.columns
+    )
+    return covariance, shrinkage, len(complete), dropped
+
+
+@st.cache_data(ttl=600, max_entries=64)
+def get_portfolio_weights(
+    tickers, period, return_kind, policy, last_date, scheme, long_only, _covariance
+):
+    return portfolio_weights(_covariance.to_numpy(), scheme, long_only)
+
+
+def render_portfolio(tickers, period, selected_period):
+    # 銘柄バスケットの縮小推定の共分散から、最小分散・リスクパリティの配分を求める
+    if len(tickers) < 2:
+        st.info("2つ以上の証券コードを入力してください。")
+        return
+
+    returns = load_universe_returns(tickers, period, "ポートフォリオの構築", 600)
+    if returns is None:
+        return
+
+    with span("covariance"):
+        covariance, shrinkage, observations, dropped = get_shrunk_covariance(
+            tuple(returns.columns),
+            period,
+            return_kind,
+            align_key,
+            returns.index[-1],
+            returns,
+        )
+    if dropped:
+        st.warning(
+            f"観測のある日が少ないため次の銘柄を除きました: {', '.join(dropped)}"
+        )
+    if len(covariance) < 2 or observations < 2:
+        st.error("共分散の推定には、値のそろう日が2日以上ある銘柄が2つ以上必要です。")
+        return
+
+    st.markdown(
+        '<h3 class="sub-header">ポートフォリオ構築</h3>',
+        unsafe_allow_html=True,
+    )
+    st.caption(
+        f"{selected_period}のうち全銘柄の値がそろう{observations:,}日の{return_label}から、"
+        f"Ledoit-Wolf の縮小推定（縮小強度 {shrinkage:.3f}）で共分散を求めています。"
+    )
+    render_portfolio_weights(covariance, period, returns.index[-1])
+
+
+@st.fragment
+def render_portfolio_weights(covariance, period, last_date):
+    # 配分の方法の切り替えはこのセクションだけを再実行する
+    col_scheme, col_short = st.columns(2)
+    with col_scheme:
+        scheme_label = st.radio(
+            "配分の方法", list(WEIGHT_SCHEMES), horizontal=True, key="weight_scheme"
+        )
+    scheme = WEIGHT_SCHEMES[scheme_label]
+    long_only = True
+    if scheme == "min_variance":
+        with col_short:
+            long_only = not st.toggle("空売りを認める", key="allow_short")
+
+    tickers = tuple(covariance.columns)
+    with span("portfolio"):
+        weights = get_portfolio_weights(
+            tickers,
+            period,
+            return_kind,
+            align_key,
+            last_date,
+            scheme,
+            long_only,
+            covariance,
+        )
+        values = covariance.to_numpy()
+        table = portfolio_table(tickers, weights, values)
+        equal = portfolio_weights(values, "equal")
+
+    volatility = np.sqrt(weights @ values @ weights * 252)
+    equal_volatility = np.sqrt(equal @ values @ equal * 252)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric(
+        "年率ボラティリティ",
+        f"{volatility:.2%}",
+        f"{volatility - equal_volatility:+.2%}（等ウェイト比）",
+        delta_color="inverse",
+    )
+    col2.metric("分散比率", f"{diversification_ratio(weights, values):.2f}")
+    col3.metric("実効銘柄数", f"{1 / np.sum(weights**2):.1f}")
+    col4.metric("組み入れ銘柄数", f"{int(np.sum(weights > 1e-6))} / {len(weights)}")
+    st.caption(
+        "分散比率は各銘柄のボラティリティの加重和とポートフォリオのボラティリティの比"
+        "（1なら分散効果なし）。実効銘柄数は配分の二乗和の逆数です。"
+    )
+
+    with span("figure.portfolio"):
+        # 銘柄が多いときは配分の絶対値の大きい銘柄だけを表示する
+        shown = table.reindex(
+            table["weight"].abs().sort_values(ascending=False).index
+        ).head(PORTFOLIO_CHART_TICKERS)
+        fig_weights = go.Figure(
+            [
+                go.Bar(
+                    x=shown["ticker"],
+                    y=shown["weight"],
+                    name="配分",
+                    marker_color=current_theme["primary"],
+                    hovertemplate="%{x}<br>配分: %{y:.2%}<extra></extra>",
+                ),
+                go.Bar(
+                    x=shown["ticker"],
+                    y=shown["risk_contribution"],
+                    name="リスク寄与",
+                    marker_color="rgba(128, 128, 128, 0.6)",
+                    hovertemplate="%{x}<br>リスク寄与: %{y:.2%}<extra></extra>",
+                ),
+            ]
+        )
+        fig_weights.update_layout(
+            title=f"{scheme_label}の配分とリスク寄与"
+            + (
+                f"（上位{PORTFOLIO_CHART_TICKERS}銘柄）"
+                if len(table) > PORTFOLIO_CHART_TICKERS
+                else ""
+            ),
+            barmode="group",
+            yaxis=dict(tickformat=".0%"),
+            template="plotly_white",
+            height=400,
+            margin=dict(l=10, r=10, t=50, b=30),
+            legend=dict(orientation="h", y=-0.2),
+        )
+    show_chart("portfolio", fig_weights)
+
+    with st.expander("配分データを表示"):
+        with span("table.portfolio"):
+            st.dataframe(
+                table,
+                hide_index=True,
+                use_container_width=True,
+                height=400,
+                column_config={
+                    "ticker": "証券コード",
+                    "weight": st.column_config.NumberColumn("配分", format="%.4f"),
+                    "risk_contribution": st.column_config.NumberColumn(
+                        "リスク寄与", format="%.4f"
+                    ),
+                    "volatility": st.column_config.NumberColumn(
+                        "年率ボラティリティ", format="%.4f"
+                    ),
+                },
+            )
+
+
+# 以下のセクションはフラグメントとして描画し、セクション内の操作（スライダー等）では
+# ページ全体ではなくそのセクションだけを再実行する
+@st.cache_data(ttl=600, max_entries=64)
+def get_robust_fit(
+    ticker1, ticker2, period, policy, last_date, return_kind, method, _returns
+):
+    # ロバスト回帰は反復計算が必要なので、ペア・期間・手法ごとに結果を保持する
+    return fit_line(_returns[ticker1], _returns[ticker2], method)
+
+
+@st.cache_data(ttl=600, max_entries=64, show_spinner=False)
+def get_correlation(
+    ticker1, ticker2, period, policy, last_date, return_kind, method, halflife, _returns
+):
+    # 全期間の相関係数（EWMAは最終時点の値）
+    return pair_correlation(
+        _returns[ticker1].to_numpy(), _returns[ticker2].to_numpy(), method, halflife
+    )
+
+
+@st.cache_data(ttl=600, max_entries=64)
+def get_rolling_estimate(
+    ticker1,
+    ticker2,
+    period,
+    policy,
+    last_date,
+    return_kind,
+    method,
+    window,
+    halflife,
+    _returns,
+):
+    # ピアソン以外の移動相関（順位の計算が必要なため、ペア・条件ごとに結果を保持する）
+    values = rolling_correlation(
+        _returns[ticker1].to_numpy(),
+        _returns[ticker2].to_numpy(),
+        method,
+        window=window,
+        halflife=halflife,
+    )
+    return pd.Series(values, index=_returns.index, name=window).dropna()
+
+
+@st.cache_data(ttl=600, max_entries=64)
+def get_correlation_interval(
+    ticker1,
+    ticker2,
+    period,
+    policy,
+    last_date,
+    return_kind,
+    method,
+    halflife,
+    interval_method,
+    _returns,
+):
+    # 全期間の相関係数の信頼区間 (下限, 上限)。ブートストラップは乱数の種を固定し、
+    # 同じ条件なら同じ区間になるようにする
+    pair = _returns[[ticker1, ticker2]].dropna()
+    x, y = pair[ticker1].to_numpy(), pair[ticker2].to_numpy()
+    if interval_method == "bootstrap":
+        return bootstrap_interval(
+            x, y, method, halflife=halflife, seed=0, workers=BOOTSTRAP_WORKERS
+        )
+    n = ewma_effective_n(len(x), halflife) if method == "ewma" else len(x)
+    low, high = fisher_interval(pair_correlation(x, y, method, halflife), n, method)
+    return float(low), float(high)
+
+
+@st.cache_data(ttl=600, max_entries=32)
+def get_rolling_interval(
+    ticker1,
+    ticker2,
+    period,
+    policy,
+    last_date,
+    return_kind,
+    method,
+    window,
+    halflife,
+    interval_method,
+    _returns,
+    _rolling,
+):
+    # 移動相関の各時点の信頼区間（列 lower, upper）。EWMAは窓がないため、
+    # 各時点までの重みの有効サンプル数による Fisher z の区間にする
+    x = _returns[ticker1].to_numpy()
+    y = _returns[ticker2].to_numpy()
+    if interval_method == "bootstrap" and method != "ewma":
+        low, high = rolling_bootstrap_interval(
+            x, y, window, method, seed=0, workers=BOOTSTRAP_WORKERS
+        )
+    else:
+        if method == "ewma":
+            n = ewma_effective_n(np.cumsum(np.isfinite(x) & np.isfinite(y)), halflife)
+        else:
+            n = window
+        r = _rolling.reindex(_returns.index).to_numpy()
+        low, high = fisher_interval(r, n, method)
+    band = pd.DataFrame({"lower": low, "upper": high}, index=_returns.index)
+    return band.dropna()
+
+
+@st.cache_data(ttl=600, max_entries=64)
+def get_cross_correlation(
+    ticker1, ticker2, period, policy, last_date, return_kind, max_lag, _returns
+):
+    # 時差 -max_lag..max_lag の相関（FFTで一度に計算）
+    return cross_correlation(
+        _returns[ticker1].to_numpy(), _returns[ticker2].to_numpy(), max_lag
+    )
+
+
+@st.cache_data(ttl=600, max_entries=32)
+def get_rolling_cross_correlation(
+    ticker1, ticker2, period, policy, last_date, return_kind, max_lag, window, _returns
+):
+    # 移動窓ごとの時差相関（時点 × 時差）
+    lags, corr = rolling_cross_correlation(
+        _returns[ticker1].to_numpy(), _returns[ticker2].to_numpy(), window, max_lag
+    )
+    frame = pd.DataFrame(corr, index=_returns.index, columns=lags)
+    return frame.iloc[window - 1 :]
+
+
+@st.fragment
+def render_return_scatter(returns, ticker1, ticker2, company1, company2, period):
+    method_label = st.radio(
+        "回帰直線",
+        list(REGRESSION_METHODS),
+        horizontal=True,
+        key="regression_method",
+    )
+    method = REGRESSION_METHODS[method_label]
+
+    # 回帰直線（最小二乗法は相関係数と同じ累積和から閉形式で求める）
+    with span("regression"):
+        if method == "ols":
+            fit = get_rolling_stats(
+                ticker1,
+                ticker2,
+                period,
+                align_key,
+                returns.index[-1],
+                return_kind,
+                returns,
+            ).regression()
+        else:
+            fit = get_robust_fit(
+                ticker1,
+                ticker2,
+                period,
+                align_key,
+                returns.index[-1],
+                return_kind,
+                method,
+                returns,
+            )
+
+    # 散布図で相関関係を可視化（点数が多いときは密度で描画）
+    with span("figure.scatter"):
+        x, y = returns[ticker1], returns[ticker2]
+        if len(returns) > DENSITY_THRESHOLD:
+            x_centers, y_centers, counts = density_grid(x, y)
+            points = go.Heatmap(
+                x=x_centers,
+                y=y_centers,
+                z=counts,
+                colorscale="Greens",
+                colorbar=dict(title="件数"),
+                hovertemplate="x: %{x:.4f}<br>y: %{y:.4f}<br>件数: %{z}<extra></extra>",
+                name="密度",
+            )
+        else:
+            points = go.Scatter(
+                x=x,
+                y=y,
+                mode="markers",
+                marker=dict(color=current_theme["primary"], opacity=0.7),
+                name=return_label,
+            )
+
+        x_range = np.array([x.min(), x.max()])
+        fig_scatter = go.Figure(
+            [
+                points,
+                go.Scatter(
+                    x=x_range,
+                    y=fit["intercept"] + fit["slope"] * x_range,
+                    mode="lines",
+                    line=dict(color=current_theme["secondary"], width=2),
+                    name=method_label,
+                    hovertemplate=(
+                        f"y = {fit['intercept']:.5f} + {fit['slope']:.4f} x"
+                        f"<br>R² = {fit['r_squared']:.4f}<extra></extra>"
+                    ),
+                ),
+            ]
+        )
+
+        fig_scatter.update_layout(
+            title="リターン相関散布図",
+            xaxis_title=f"{company1} {return_label}",
+            yaxis_title=f"{company2} {return_label}",
+            showlegend=False,
+            height=300,
+            template="plotly_white",
+            margin=dict(l=10, r=10, t=60, b=10),
+        )
+
+    show_chart("scatter", fig_scatter)
+    st.caption(regression_summary(fit))
+
+
+def regression_summary(fit):
+    # 傾き（ベータ）・切片・決定係数。標準誤差は求められる手法のときだけ表示
+    def with_se(value, se, digits):
+        text = f"{value:.{digits}f}"
+        if se is not None:
+            text += f" ± {se:.{digits}f}"
+        return text
+
+    return (
+        f"ベータ（傾き）: {with_se(fit['slope'], fit['slope_se'], 4)} / "
+        f"切片: {with_se(fit['intercept'], fit['intercept_se'], 5)} / "
+        f"R²: {fit['r_squared']:.4f} / {bar_unit}数: {fit['n']:,}"
+    )
+
+
+def select_visible_range(data, key):
+    # 長期データでは表示期間を選べるようにし、選んだ範囲を細かく描画し直す
+    # （plotlyのズーム操作はサーバーに届かないため、スライダーで範囲を指定する）
+    if len(data) <= MAX_POINTS:
+        return data
+    first, last = data.index[0].date(), data.index[-1].date()
+    start, end = st.slider(
+        "表示期間",
+        min_value=first,
+        max_value=last,
+        value=(first, last),
+        format="YYYY/MM/DD",
+        key=key,
+    )
+    return data.loc[start.isoformat() : end.isoformat()]
+
+
+def point_count_caption(shown, total):
+    if shown < total:
+        st.caption(f"表示点数: {shown:,} 点（元データ {total:,} 点を間引いて表示）")
+
+
+@st.fragment
+def render_price_chart(df, ticker1, ticker2, company1, company2, selected_period):
+    visible = select_visible_range(df, "price_range")
+
+    # Plotlyで株価チャート作成
+    with span("figure.price"):
+        series1 = downsample_series(visible[ticker1])
+        series2 = downsample_series(visible[ticker2])
+        total_points = len(series1) + len(series2)
+
+        fig = make_subplots(specs=[[{"secondary_y": True}]])
+
+        fig.add_trace(
+            scatter_trace(
+                total_points,
+                x=series1.index,
+                y=series1,
+                name=company1,
+                line=dict(color=current_theme["primary"], width=2),
+            ),
+            secondary_y=False,
+        )
+
+        fig.add_trace(
+            scatter_trace(
+                total_points,
+                x=series2.index,
+                y=series2,
+                name=company2,
+                line=dict(color=current_theme["secondary"], width=2),
+            ),
+            secondary_y=True,
+        )
+
+        # 軸ラベル設定
+        fig.update_layout(
+            title=f"{company1} と {company2} の株価推移 ({selected_period})",
+            title_font_size=20,
+            hovermode="x unified",
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+            ),
+            template="plotly_white",
+            height=500,
+            margin=dict(l=10, r=10, t=70, b=30),
+        )
+
+        # レンジスライダーは全データを複製して送るため、短い期間のときだけ表示
+        fig.update_xaxes(title_text="日付", rangeslider_visible=len(df) <= MAX_POINTS)
+        fig.update_yaxes(title_text=f"{company1} (円)", secondary_y=False)
+        fig.update_yaxes(title_text=f"{company2} (円)", secondary_y=True)
+
+    show_chart("price", fig)
+    point_count_caption(total_points, 2 * len(visible))
+
+
+def get_live_pair(df, ticker1, ticker2, period):
+    # ライブ更新の状態はセッションごとに保持し、ペア・間隔・期間が変わったら作り直す
+    key = (ticker1, ticker2, interval, period, return_kind)
+    saved = st.session_state.get("live_pair")
+    if saved is None or saved[0] != key:
+        saved = (
+            key,
+            LivePair(df, ticker1, ticker2, market_of(ticker1), interval, return_kind),
+        )
+        st.session_state["live_pair"] = saved
+    return saved[1]
+
+
+def render_live_panel(live, company1, company2, poll):
+    # 保持している最終バー以降だけを取得し、統計量とチャートの末尾に追加する
+    with span("live.update"):
+        new1 = intraday_store.bars_since(
+            live.ticker1, interval, live.last_timestamp, max_age=poll
+        )
+        new2 = intraday_store.bars_since(
+            live.ticker2, interval, live.last_timestamp, max_age=poll
+        )
+        live.update(new1, new2)
+
+    times, close1, close2, rolling = live.chart_data()
+    col_time, col_corr, col_rolling, col_new = st.columns(4)
+    col_time.metric("最新バー", times[-1].strftime("%m/%d %H:%M"))
+    col_corr.metric("相関係数（全期間）", f"{live.stats.overall_correlation():.3f}")
+    latest = rolling[-1]
+    col_rolling.metric(
+        f"移動相関（{LIVE_WINDOW}本）",
+        f"{latest:.3f}" if np.isfinite(latest) else "-",
+    )
+    col_new.metric("今回の新しいバー", f"{live.last_update_bars} 本")
+
+    # チャートは直近の一定本数だけを送る（履歴全体の図は作り直さない）
+    with span("figure.live"):
+        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.6, 0.4])
+        for close, name, color in (
+            (close1, company1, current_theme["primary"]),
+            (close2, company2, current_theme["secondary"]),
+        ):
+            fig.add_trace(
+                go.Scatter(
+                    x=times,
+                    y=close / close[0] * 100,
+                    name=name,
+                    line=dict(color=color, width=2),
+                ),
+                row=1,
+                col=1,
+            )
+        fig.add_trace(
+            go.Scatter(
+                x=times,
+                y=rolling,
+                name=f"移動相関（{LIVE_WINDOW}本）",
+                line=dict(color=MINT_GREEN, width=2),
+            ),
+            row=2,
+            col=1,
+        )
+        fig.update_yaxes(title_text="株価（先頭=100）", row=1, col=1)
+        fig.update_yaxes(title_text="相関係数", range=[-1, 1], row=2, col=1)
+        fig.update_layout(
+            hovermode="x unified",
+            template="plotly_white",
+            height=450,
+            margin=dict(l=10, r=10, t=30, b=30),
+            uirevision="live",
+        )
+
+    show_chart("live", fig)
+    st.caption(f"直近 {len(times):,} 本を {poll} 秒ごとに更新")
+
+
+@st.fragment
+def render_returns_chart(returns, ticker1, ticker2):
+    visible = select_visible_range(returns, "returns_range")
+
+    # リターンチャートの表示
+    with span("figure.returns"):
+        series = [downsample_series(visible[t]) for t in (ticker1, ticker2)]
+        total_points = sum(len(s) for s in series)
+
+        fig_returns = go.Figure(
+            [
+                scatter_trace(total_points, x=s.index, y=s, mode="lines", name=s.name)
+                for s in series
+            ]
+        )
+
+        fig_returns.update_layout(
+            title=f"{return_label}比較",
+            xaxis_title="日付",
+            yaxis_title=f"{return_label} (%)",
+            hovermode="x unified",
+            legend_title_text="",
+            template="plotly_white",
+            height=400,
+        )
+
+    show_chart("returns", fig_returns)
+    point_count_caption(total_points, 2 * len(visible))
+
+
+@st.fragment
+def render_rolling_correlation(returns, ticker1, ticker2, period):
+    # ヒートマップで相関の時間変化を可視化
+    st.markdown("#### 相関係数の時間変化")
+
+    window_days = st.slider(
+        f"移動窓サイズ（{bar_unit}数）", 20, 120, 60, 5, key="rolling_window"
+    )
+
+    # 移動相関係数を計算（ピアソンは累積和から窓幅分の差をとるだけ）
+    with span("rolling"):
+        rolling_stats = get_rolling_stats(
+            ticker1, ticker2, period, align_key, returns.index[-1], return_kind, returns
+        )
+        if estimator == "pearson":
+            rolling_corr = rolling_stats.correlation(window_days)
+        else:
+            rolling_corr = get_rolling_estimate(
+                ticker1,
+                ticker2,
+                period,
+                align_key,
+                returns.index[-1],
+                return_kind,
+                estimator,
+                window_days,
+                halflife,
+                returns,
+            )
+    if estimator == "ewma":
+        rolling_title = f"EWMA相関係数（半減期{halflife}{bar_unit}）"
+    else:
+        rolling_title = f"{window_days}{bar_unit}移動相関係数（{estimator_label}）"
+
+    band = None
+    if interval_method is not None:
+        with span("rolling.interval"):
+            band = get_rolling_interval(
+                ticker1,
+                ticker2,
+                period,
+                align_key,
+                returns.index[-1],
+                return_kind,
+                estimator,
+                window_days,
+                halflife,
+                interval_method,
+                returns,
+                rolling_corr,
+            )
+
+    with span("figure.rolling"):
+        shown_corr = downsample_series(rolling_corr)
+        fig_rolling = go.Figure()
+        if band is not None:
+            # 信頼区間の帯（下限の線の上に、上限の線から塗りつぶす）
+            shown_band = band.reindex(shown_corr.index)
+            fig_rolling.add_trace(
+                scatter_trace(
+                    len(shown_band),
+                    x=shown_band.index,
+                    y=shown_band["lower"],
+                    mode="lines",
+                    line=dict(width=0),
+                    hoverinfo="skip",
+                    showlegend=False,
+                )
+            )
+            fig_rolling.add_trace(
+                scatter_trace(
+                    len(shown_band),
+                    x=shown_band.index,
+                    y=shown_band["upper"],
+                    mode="lines",
+                    line=dict(width=0),
+                    fill="tonexty",
+                    fillcolor="rgba(128, 128, 128, 0.3)",
+                    hoverinfo="skip",
+                    showlegend=False,
+                )
+            )
+        fig_rolling.add_trace(
+            scatter_trace(
+                len(shown_corr),
+                x=shown_corr.index,
+                y=shown_corr,
+                mode="lines",
+                line=dict(color=current_theme["primary"], width=2),
+                fill="tozeroy",
+                fillcolor=f"rgba({int(current_theme['primary'][1:3], 16)}, {int(current_theme['primary'][3:5], 16)}, {int(current_theme['primary'][5:7], 16)}, 0.2)",
+                showlegend=False,
+            )
+        )
+
+        fig_rolling.update_layout(
+            title=rolling_title,
+            xaxis_title="日付",
+            yaxis_title="相関係数",
+            yaxis=dict(range=[-1, 1]),
+            hovermode="x unified",
+            template="plotly_white",
+            height=300,
+        )
+
+        # ゼロラインを追加
+        fig_rolling.add_hline(y=0, line_dash="dash", line_color="gray")
+
+        # 相関係数の強さを示す背景色を追加
+        fig_rolling.add_hrect(
+            y0=0.7,
+            y1=1,
+            line_width=0,
+            fillcolor="rgba(76, 175, 80, 0.1)",
+        )
+        fig_rolling.add_hrect(
+            y0=0.4,
+            y1=0.7,
+            line_width=0,
+            fillcolor="rgba(255, 152, 0, 0.1)",
+        )
+        fig_rolling.add_hrect(
+            y0=-0.4,
+            y1=0.4,
+            line_width=0,
+            fillcolor="rgba(33, 150, 243, 0.1)",
+        )
+        fig_rolling.add_hrect(
+            y0=-0.7,
+            y1=-0.4,
+            line_width=0,
+            fillcolor="rgba(255, 152, 0, 0.1)",
+        )
+        fig_rolling.add_hrect(
+            y0=-1,
+            y1=-0.7,
+            line_width=0,
+            fillcolor="rgba(244, 67, 54, 0.1)",
+        )
+
+    show_chart("rolling", fig_rolling)
+    if band is not None:
+        if interval_method == "bootstrap" and estimator != "ewma":
+            band_note = f"ブロックブートストラップ（各時点{ROLLING_RESAMPLES}回）"
+        else:
+            band_note = "Fisher z"
+        st.caption(f"灰色の帯: {CONFIDENCE_LEVEL:.0%}信頼区間（{band_note}）")
+
+    # 窓幅ごとの移動相関をまとめたサーフェス
+    st.markdown("#### 相関サーフェス（窓幅 × 日付、ピアソン）")
+
+    with span("figure.surface"):
+        fig_surface = go.Figure(
+            go.Heatmap(
+                z=rolling_stats.correlation_surface(SURFACE_WINDOWS),
+                x=rolling_stats.index,
+                y=list(SURFACE_WINDOWS),
+                zmin=-1,
+                zmax=1,
+                colorscale=correlation_colorscale(),
+                colorbar=dict(
+                    title="相関係数",
+                    tickvals=[-1, -0.7, -0.4, 0, 0.4, 0.7, 1],
+                ),
+                hovertemplate="%{x|%Y-%m-%d}<br>窓幅 %{y}日<br>相関係数: %{z:.4f}<extra></extra>",
+            )
+        )
+
+        fig_surface.update_layout(
+            xaxis_title="日付",
+            yaxis_title=f"窓幅（{bar_unit}数）",
+            template="plotly_white",
+            height=320,
+            margin=dict(l=10, r=10, t=30, b=30),
+        )
+
+        # 現在の移動窓サイズを示す線
+        fig_surface.add_hline(y=window_days, line_dash="dash", line_color="gray")
+
+    show_chart("surface", fig_surface)
+
+
+@st.fragment
+def render_lead_lag(returns, ticker1, ticker2, company1, company2, period):
+    # 時差をずらした相関で、どちらの銘柄が先に動くかを見る
+    st.markdown("#### リードラグ（時差相関）")
+
+    col_lag, col_window = st.columns(2)
+    with col_lag:
+        max_lag = st.slider(
+            f"最大時差（{bar_unit}数）", 1, MAX_LAG_LIMIT, MAX_LAG, key="lead_lag_max"
+        )
+    with col_window:
+        window = st.slider(
+            f"移動窓サイズ（{bar_unit}数）",
+            40,
+            250,
+            120,
+            10,
+            key="lead_lag_window",
+        )
+
+    with span("lead_lag"):
+        lags, corr = get_cross_correlation(
+            ticker1,
+            ticker2,
+            period,
+            align_key,
+            returns.index[-1],
+            return_kind,
+            max_lag,
+            returns,
+        )
+        lag, peak = peak_lag(lags, corr)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("最大相関の時差", "-" if np.isnan(lag) else f"{lag:+.0f}{bar_unit}")
+    col2.metric("その時差の相関", f"{peak:.3f}")
+    col3.metric("同時点の相関", f"{corr[lags == 0][0]:.3f}")
+    if np.isnan(lag) or lag == 0:
+        st.caption("時差をずらしても同時点より強い相関はありません。")
+    else:
+        leader, follower = (company1, company2) if lag > 0 else (company2, company1)
+        st.caption(
+            f"{leader}が{follower}に{abs(lag):.0f}{bar_unit}先行する関係が最も強く出ています"
+            f"（時差 k は {company1} の t 時点と {company2} の t+k 時点の相関）。"
+        )
+
+    with span("figure.lead_lag"):
+        colors = [
+            current_theme["primary"] if value == lag else "rgba(128, 128, 128, 0.6)"
+            for value in lags
+        ]
+        fig_lag = go.Figure(
+            go.Bar(
+                x=lags,
+                y=corr,
+                marker_color=colors,
+                hovertemplate=f"時差 %{{x}}{bar_unit}<br>相関係数: %{{y:.4f}}<extra></extra>",
+            )
+        )
+        fig_lag.update_layout(
+            title=f"時差相関（正の時差は{company1}が先行）",
+            xaxis_title=f"時差（{bar_unit}）",
+            yaxis_title="相関係数",
+            yaxis=dict(range=[-1, 1]),
+            template="plotly_white",
+            height=300,
+        )
+        fig_lag.add_hline(y=0, line_dash="dash", line_color="gray")
+    show_chart("lead_lag", fig_lag)
+
+    if len(returns) < window:
+        st.info(f"移動リードラグには{window}{bar_unit}以上のデータが必要です。")
+        return
+
+    with span("lead_lag.rolling"):
+        rolling = get_rolling_cross_correlation(
+            ticker1,
+            ticker2,
+            period,
+            align_key,
+            returns.index[-1],
+            return_kind,
+            max_lag,
+            window,
+            returns,
+        )
+        rolling_lag, _ = peak_lag(rolling.columns, rolling.to_numpy(), axis=1)
+
+    with span("figure.lead_lag_rolling"):
+        # 時点数が多いときは等間隔に間引いて送る
+        step = max(1, len(rolling) // MAX_POINTS)
+        shown = rolling.iloc[::step]
+        fig_rolling_lag = go.Figure(
+            go.Heatmap(
+                z=shown.to_numpy().T,
+                x=shown.index,
+                y=list(shown.columns),
+                zmin=-1,
+                zmax=1,
+                colorscale=correlation_colorscale(),
+                colorbar=dict(
+                    title="相関係数",
+                    tickvals=[-1, -0.7, -0.4, 0, 0.4, 0.7, 1],
+                ),
+                hovertemplate=f"%{{x|%Y-%m-%d}}<br>時差 %{{y}}{bar_unit}<br>相関係数: %{{z:.4f}}<extra></extra>",
+            )
+        )
+        fig_rolling_lag.add_trace(
+            go.Scatter(
+                x=shown.index,
+                y=rolling_lag[::step],
+                mode="lines",
+                line=dict(color="black", width=1),
+                name="最大相関の時差",
+            )
+        )
+        fig_rolling_lag.update_layout(
+            title=f"{window}{bar_unit}移動リードラグ（時差 × 日付）",
+            xaxis_title="日付",
+            yaxis_title=f"時差（{bar_unit}）",
+            template="plotly_white",
+            height=320,
+            margin=dict(l=10, r=10, t=50, b=30),
+            legend=dict(orientation="h", y=-0.2),
+        )
+    show_chart("lead_lag_rolling", fig_rolling_lag)
+
+
+@st.fragment
+def render_data_tables(df, returns, ticker1, ticker2, company1, company2, period):
+    # 統計サマリー
+    st.markdown("#### 統計サマリー")
+    col_stats1, col_stats2 = st.columns(2)
+
+    with col_stats1:
+        st.markdown(f"##### {company1} ({ticker1})")
+        stats1 = returns[ticker1].describe().to_frame().T
+        stats1.rename(index={ticker1: return_label}, inplace=True)
+        with span("table.stats1"):
+            st.dataframe(
+                stats1,
+                column_config=number_columns(stats1.columns, "%.4f"),
+                use_container_width=True,
+            )
+
+    with col_stats2:
+        st.markdown(f"##### {company2} ({ticker2})")
+        stats2 = returns[ticker2].describe().to_frame().T
+        stats2.rename(index={ticker2: return_label}, inplace=True)
+        with span("table.stats2"):
+            st.dataframe(
+                stats2,
+                column_config=number_columns(stats2.columns, "%.4f"),
+                use_container_width=True,
+            )
+
+    # データテーブル表示（開いたときだけ、1ページ分を描画する）
+    st.markdown("#### 価格データ")
+    if st.toggle("株価データを表示", key="show_price_table"):
+        with span("table.prices"):
+            render_paged_table(
+                ticker1, ticker2, period, df, "prices", [company1, company2], "%.2f"
+            )
+
+    # リターンデータテーブル
+    st.markdown("#### リターンデータ")
+    if st.toggle("リターンデータを表示", key="show_returns_table"):
+        with span("table.returns"):
+            render_paged_table(
+                ticker1,
+                ticker2,
+                period,
+                returns,
+                f"returns_{return_kind}",
+                [company1, company2],
+                "percent",
+            )
+
+
+def number_columns(columns, number_format):
+    return {
+        str(column): st.column_config.NumberColumn(format=number_format)
+        for column in columns
+    }
+
+
+@st.cache_resource(max_entries=32)
+def get_arrow_table(ticker1, ticker2, period, policy, last_date, kind, columns, _frame):
+    # 表示・ダウンロード用のArrowテーブル（ページはこのテーブルのスライス）
+    frame = _frame.copy(deep=False)
+    frame.columns = list(columns)
+    return to_arrow(frame)
+
+
+@st.cache_data(ttl=600, max_entries=32)
+def get_export(ticker1, ticker2, period, policy, last_date, kind, file_format, _table):
+    return EXPORTS[file_format][0](_table)
+
+
+def render_paged_table(ticker1, ticker2, period, frame, kind, columns, number_format):
+    last_date = frame.index[-1]
+    table = get_arrow_table(
+        ticker1, ticker2, period, align_key, last_date, kind, tuple(columns), frame
+    )
+
+    pages = page_count(table)
+    col_page, col_format, col_download = st.columns([2, 1, 1])
+    with col_page:
+        number = st.number_input(
+            f"ページ（全{pages}ページ・{table.num_rows:,}行）",
+            min_value=1,
+            max_value=pages,
+            value=1,
+            key=f"{kind}_page",
+        )
+
+    st.dataframe(
+        page(table, number),
+        column_config={
+            "日付": st.column_config.DatetimeColumn(
+                format="YYYY/MM/DD HH:mm" if is_intraday else "YYYY/MM/DD"
+            ),
+            **number_columns(columns, number_format),
+        },
+        hide_index=True,
+        use_container_width=True,
+        height=400,
+    )
+
+    # 全期間のダウンロード（書式を付けず、元の数値のまま書き出す）
+    with col_format:
+        file_format = st.selectbox("形式", list(EXPORTS), key=f"{kind}_format")
+    _, extension, mime = EXPORTS[file_format]
+    with col_download:
+        st.download_button(
+            "ダウンロード",
+            data=get_export(
+                ticker1, ticker2, period, align_key, last_date, kind, file_format, table
+            ),
+            file_name=f"{ticker1}_{ticker2}_{kind}_{period}.{extension}",
+            mime=mime,
+            on_click="ignore",
+            key=f"{kind}_download",
+        )
+
+
+def warm_pair(ticker1, ticker2, period):
+    # 2銘柄比較の既定の設定（日足・単純リターン・ピアソン・共通の取引日のみ）で
+    # 取得・日付揃え・相関・移動相関の累積和を済ませ、キャッシュに入れておく
+    # （事前取得のスレッドには ScriptRunContext が無いため、ここで呼ぶキャッシュ関数は
+    # スピナーを出さない show_spinner=False にしておく）
+    closes = load_pair(ticker1, ticker2, period)
+    if closes is None:
+        return
+    policy = ("inner", DEFAULT_MAX_STALE)
+    df = get_aligned_panel(
+        tuple(closes), period, *policy, last_bars_of(closes), closes
+    ).dropna()
+    returns = pair_returns(df, "simple")
+    if returns.empty:
+        return
+    last_date = returns.index[-1]
+    get_rolling_stats(ticker1, ticker2, period, policy, last_date, "simple", returns)
+    get_correlation(
+        ticker1,
+        ticker2,
+        period,
+        policy,
+        last_date,
+        "simple",
+        "pearson",
+        DEFAULT_HALFLIFE,
+        returns,
+    )
+
+
+@st.cache_resource
+def get_prewarmer():
+    # PREWARM_WATCHLIST を指定すると、大引け後と寄り付き前にウォッチリストを取得しておく
+    # （PREWARM_PAIRS・PREWARM_TIMES・PREWARM_RATE・PREWARM_JITTER で変えられる）
+    watchlist = parse_ticker_list(os.environ.get("PREWARM_WATCHLIST", ""))
+    if not watchlist:
+        return None
+    pairs = os.environ.get("PREWARM_PAIRS")
+    times = os.environ.get("PREWARM_TIMES")
+    prewarmer = Prewarmer(
+        watchlist,
+        load_history,
+        info_fn=data_provider.info,
+        warm_pair=warm_pair,
+        pairs=parse_pairs(pairs) if pairs else None,
+        times=parse_times(times) if times else DEFAULT_TIMES,
+        rate=float(os.environ.get("PREWARM_RATE", DEFAULT_RATE)),
+        jitter=float(os.environ.get("PREWARM_JITTER", DEFAULT_JITTER)),
+    )
+    # PREWARM_ON_START=1 なら起動直後（最初のページ表示時）にも1回実行する
+    return prewarmer.start(immediately=os.environ.get("PREWARM_ON_START") == "1")
+
+
+prewarmer = get_prewarmer()
+if prewarmer is not None:
+    with st.sidebar.expander("⏰ 事前取得"):
+        st.json(prewarmer.stats())
+
+
+if analysis_mode != "2銘柄比較":
+    if analysis_mode == "複数銘柄（相関行列）":
+        render_correlation_matrix(matrix_tickers, period, selected_period)
+    elif analysis_mode == "ペアスクリーナー":
+        render_pair_screener(matrix_tickers, period, selected_period)
+    else:
+        render_portfolio(matrix_tickers, period, selected_period)
+    st.markdown(
+        '<p class="disclaimer">注意: このアプリは情報提供のみを目的としており、投資アドバイスではありません。過去のパフォーマンスは将来の結果を保証するものではありません。投資判断は自己責任で行ってください。</p>',
+        unsafe_allow_html=True,
+    )
+    finish_rerun()
+    st.stop()
 
-current_theme = theme_colors[theme]
 
 if ticker1 and ticker2:
     try:
         # データ取得
-        with st.spinner("データを取得中..."):
-            stock1 = yf.Ticker(ticker1)
-            stock2 = yf.Ticker(ticker2)
-
-            # 選択した期間のデータを取得
-            data1 = stock1.history(period=period)
-            data2 = stock2.history(period=period)
+        with st.spinner("データを取得中..."), span("load_pair"):
+            if is_intraday:
+                df = load_intraday_pair(ticker1, ticker2, period, interval)
+            else:
+                df = load_pair(ticker1, ticker2, period)
+                if df is not None:
+                    df = aligned_closes(df, period).dropna()
+            # 会社名は共有キャッシュから毎回引く（取得に失敗していれば取り直す）
+            company_names = fetch_names([ticker1, ticker2], data_provider.info)
 
         # データが正常に取得できたか確認
-        if data1.empty or data2.empty:
+        if df is None:
             st.error(
                 f"証券コード {ticker1} または {ticker2} のデータを取得できませんでした。証券コードを確認してください。"
             )
         else:
-            # データ整形 - それぞれから終値のみ抽出
-            df = pd.DataFrame(
-                {ticker1: data1["Close"], ticker2: data2["Close"]}
-            ).dropna()
-
             if df.empty:
                 st.warning("取得したデータが空です。別の証券コードを試してください。")
             else:
                 # リターン計算
-                returns = df.pct_change().dropna()
+                with span("returns"):
+                    if is_intraday:
+                        # 昼休み・夜間をまたぐリターンは除く
+                        returns = intraday_returns(
+                            df, market_of(ticker1), interval, return_kind
+                        )
+                    else:
+                        returns = pair_returns(df, return_kind)
 
                 # データ期間の表示
-                start_date = df.index.min().strftime("%Y年%m月%d日")
-                end_date = df.index.max().strftime("%Y年%m月%d日")
+                date_format = "%Y年%m月%d日 %H:%M" if is_intraday else "%Y年%m月%d日"
+                start_date = df.index.min().strftime(date_format)
+                end_date = df.index.max().strftime(date_format)
 
-                # 会社名を取得（可能な場合）
-                try:
-                    company1 = stock1.info.get("shortName", ticker1)
-                    company2 = stock2.info.get("shortName", ticker2)
-                except:
-                    company1 = ticker1
-                    company2 = ticker2
+                # 会社名（取得できなかった場合は証券コード）
+                company1 = company_names[ticker1]
+                company2 = company_names[ticker2]
 
                 # 分析期間とデータサマリーを表示
 
@@ -344,51 +1807,16 @@ if ticker1 and ticker2:
                         unsafe_allow_html=True,
                     )
 
-                    # Plotlyで株価チャート作成
-                    fig = make_subplots(specs=[[{"secondary_y": True}]])
-
-                    fig.add_trace(
-                        go.Scatter(
-                            x=df.index,
-                            y=df[ticker1],
-                            name=company1,
-                            line=dict(color=current_theme["primary"], width=2),
-                        ),
-                        secondary_y=False,
+                    render_price_chart(
+                        df, ticker1, ticker2, company1, company2, selected_period
                     )
 
-                    fig.add_trace(
-                        go.Scatter(
-                            x=df.index,
-                            y=df[ticker2],
-                            name=company2,
-                            line=dict(color=current_theme["secondary"], width=2),
-                        ),
-                        secondary_y=True,
-                    )
-
-                    # 軸ラベル設定
-                    fig.update_layout(
-                        title=f"{company1} と {company2} の株価推移 ({selected_period})",
-                        title_font_size=20,
-                        hovermode="x unified",
-                        legend=dict(
-                            orientation="h",
-                            yanchor="bottom",
-                            y=1.02,
-                            xanchor="right",
-                            x=1,
-                        ),
-                        template="plotly_white",
-                        height=500,
-                        margin=dict(l=10, r=10, t=70, b=30),
-                    )
-
-                    fig.update_xaxes(title_text="日付", rangeslider_visible=True)
-                    fig.update_yaxes(title_text=f"{company1} (円)", secondary_y=False)
-                    fig.update_yaxes(title_text=f"{company2} (円)", secondary_y=True)
-
-                    st.plotly_chart(fig, use_container_width=True)
+                    if live_mode and len(df) > 2:
+                        st.markdown("#### ライブ更新")
+                        live = get_live_pair(df, ticker1, ticker2, period)
+                        st.fragment(run_every=live_poll)(render_live_panel)(
+                            live, company1, company2, live_poll
+                        )
                     st.markdown("</div>", unsafe_allow_html=True)
 
                 with tab2:
@@ -398,82 +1826,124 @@ if ticker1 and ticker2:
 
                     with col1:
                         # 相関係数
-                        correlation = returns[ticker1].corr(returns[ticker2])
+                        with span("correlation"):
+                            correlation = get_correlation(
+                                ticker1,
+                                ticker2,
+                                period,
+                                align_key,
+                                returns.index[-1],
+                                return_kind,
+                                estimator,
+                                halflife,
+                                returns,
+                            )
 
                         # 相関係数の強さに応じた色と説明
                         if abs(correlation) >= 0.7:
-                            corr_color = mint_green if correlation > 0 else "#F44336"
+                            corr_color = MINT_GREEN if correlation > 0 else "#F44336"
                             strength = "強い"
                         elif abs(correlation) >= 0.4:
-                            corr_color = light_mint if correlation > 0 else "#FF8A8E"
+                            corr_color = LIGHT_MINT if correlation > 0 else "#FF8A8E"
                             strength = "中程度の"
                         else:
                             corr_color = "#4682B4"  # スチールブルー
                             strength = "弱い"
 
+                        # 変数 interval は足の間隔（ライブ更新のフラグメントも参照する）
+                        # なので、信頼区間は別の名前で持つ
+                        ci_bounds = None
+                        if interval_method is not None:
+                            with span("correlation.interval"):
+                                ci_bounds = get_correlation_interval(
+                                    ticker1,
+                                    ticker2,
+                                    period,
+                                    align_key,
+                                    returns.index[-1],
+                                    return_kind,
+                                    estimator,
+                                    halflife,
+                                    interval_method,
+                                    returns,
+                                )
+
                         blue = "#4682B4"
                         red = "#F44336"
                         orange = "#FF9800"
+                        gauge_steps = [
+                            {"range": [-1, -0.7], "color": red},  # 赤（強い負の相関）
+                            {
+                                "range": [-0.7, -0.4],
+                                "color": orange,
+                            },  # 薄い赤（中程度の負の相関）
+                            {
+                                "range": [-0.4, 0.4],
+                                "color": blue,
+                            },  # スチールブルー（弱い相関）
+                            {
+                                "range": [0.4, 0.7],
+                                "color": LIGHT_MINT,
+                            },  # 薄いミントグリーン（中程度の正の相関）
+                            {
+                                "range": [0.7, 1],
+                                "color": MINT_GREEN,
+                            },  # ミントグリーン（強い正の相関）
+                        ]
+                        if ci_bounds is not None:
+                            # 信頼区間をバーの内側に半透明の帯で重ねる
+                            gauge_steps.append(
+                                {
+                                    "range": list(ci_bounds),
+                                    "color": "rgba(255, 255, 255, 0.45)",
+                                    "thickness": 0.35,
+                                }
+                            )
                         # 相関係数の視覚的表示
-                        fig_gauge = go.Figure(
-                            go.Indicator(
-                                mode="gauge+number",
-                                value=correlation,
-                                title={
-                                    "text": "相関係数 (日次リターン)",
-                                    "font": {"color": text_color},
-                                },
-                                gauge={
-                                    "axis": {
-                                        "range": [-1, 1],
-                                        "tickwidth": 1,
-                                        "tickcolor": text_color,
-                                        "tickfont": {"color": text_color},
+                        with span("figure.gauge"):
+                            fig_gauge = go.Figure(
+                                go.Indicator(
+                                    mode="gauge+number",
+                                    value=correlation,
+                                    title={
+                                        "text": f"相関係数 ({return_label}・{estimator_label})",
+                                        "font": {"color": TEXT_COLOR},
                                     },
-                                    "bar": {"color": corr_color},
-                                    "bgcolor": "rgba(30, 30, 30, 0.8)",  # 暗い背景色
-                                    "borderwidth": 2,
-                                    "bordercolor": "#333333",
-                                    "steps": [
-                                        {
-                                            "range": [-1, -0.7],
-                                            "color": red,
-                                        },  # 赤（強い負の相関）
-                                        {
-                                            "range": [-0.7, -0.4],
-                                            "color": orange,
-                                        },  # 薄い赤（中程度の負の相関）
-                                        {
-                                            "range": [-0.4, 0.4],
-                                            "color": blue,
-                                        },  # スチールブルー（弱い相関）
-                                        {
-                                            "range": [0.4, 0.7],
-                                            "color": light_mint,
-                                        },  # 薄いミントグリーン（中程度の正の相関）
-                                        {
-                                            "range": [0.7, 1],
-                                            "color": mint_green,
-                                        },  # ミントグリーン（強い正の相関）
-                                    ],
-                                },
-                                number={
-                                    "suffix": "",
-                                    "font": {"size": 26, "color": text_color},
-                                },
+                                    gauge={
+                                        "axis": {
+                                            "range": [-1, 1],
+                                            "tickwidth": 1,
+                                            "tickcolor": TEXT_COLOR,
+                                            "tickfont": {"color": TEXT_COLOR},
+                                        },
+                                        "bar": {"color": corr_color},
+                                        "bgcolor": "rgba(30, 30, 30, 0.8)",  # 暗い背景色
+                                        "borderwidth": 2,
+                                        "bordercolor": "#333333",
+                                        "steps": gauge_steps,
+                                    },
+                                    number={
+                                        "suffix": "",
+                                        "font": {"size": 26, "color": TEXT_COLOR},
+                                    },
+                                )
                             )
-                        )
 
-                        # レイアウト設定を追加
-                        fig_gauge.update_layout(
-                            height=300,
-                            margin=dict(l=10, r=10, t=60, b=10),
-                            paper_bgcolor="rgba(0,0,0,0)",  # 透明な背景
-                            plot_bgcolor="rgba(0,0,0,0)",  # 透明な背景
-                            font={"color": text_color},
-                        )
+                            # レイアウト設定を追加
+                            fig_gauge.update_layout(
+                                height=300,
+                                margin=dict(l=10, r=10, t=60, b=10),
+                                paper_bgcolor="rgba(0,0,0,0)",  # 透明な背景
+                                plot_bgcolor="rgba(0,0,0,0)",  # 透明な背景
+                                font={"color": TEXT_COLOR},
+                            )
 
-                        st.plotly_chart(fig_gauge, use_container_width=True)
+                        show_chart("gauge", fig_gauge)
+                        if ci_bounds is not None:
+                            st.caption(
+                                f"{CONFIDENCE_LEVEL:.0%}信頼区間（{ci_label}）: "
+                                f"{ci_bounds[0]:.3f} 〜 {ci_bounds[1]:.3f}"
+                            )
 
                         st.markdown(
                             f"""
@@ -485,26 +1955,10 @@ if ticker1 and ticker2:
                         )
 
                     with col2:
-                        # 散布図で相関関係を可視化
-                        fig_scatter = px.scatter(
-                            x=returns[ticker1],
-                            y=returns[ticker2],
-                            labels={
-                                "x": f"{company1} 日次リターン",
-                                "y": f"{company2} 日次リターン",
-                            },
-                            trendline="ols",
-                            title="リターン相関散布図",
+                        render_return_scatter(
+                            returns, ticker1, ticker2, company1, company2, period
                         )
 
-                        fig_scatter.update_layout(
-                            height=300,
-                            template="plotly_white",
-                            margin=dict(l=10, r=10, t=60, b=10),
-                        )
-
-                        st.plotly_chart(fig_scatter, use_container_width=True)
-
                     # 相関係数の解釈
                     st.markdown(
                         """
@@ -566,6 +2020,15 @@ if ticker1 and ticker2:
                                 unsafe_allow_html=True,
                             )
 
+                        st.caption(
+                            "複数の銘柄の配分（最小分散・リスクパリティ）は"
+                            "「ポートフォリオ構築」モードで計算できます。"
+                        )
+
+                    render_lead_lag(
+                        returns, ticker1, ticker2, company1, company2, period
+                    )
+
                 with tab3:
                     # タブ内にサブタブを作成
                     subtab1, subtab2 = st.tabs(
@@ -573,144 +2036,14 @@ if ticker1 and ticker2:
                     )
 
                     with subtab1:
-                        # リターンチャートの表示
-                        fig_returns = px.line(
-                            returns,
-                            y=[ticker1, ticker2],
-                            labels={
-                                "value": "日次リターン (%)",
-                                "variable": "銘柄",
-                                "date": "日付",
-                            },
-                            title="日次リターン比較",
-                        )
-
-                        fig_returns.update_layout(
-                            hovermode="x unified",
-                            legend_title_text="",
-                            template="plotly_white",
-                            height=400,
-                        )
-
-                        st.plotly_chart(fig_returns, use_container_width=True)
-
-                        # ヒートマップで相関の時間変化を可視化
-                        st.markdown("#### 相関係数の時間変化")
+                        render_returns_chart(returns, ticker1, ticker2)
 
-                        window_days = st.slider("移動窓サイズ（日数）", 20, 120, 60, 5)
-
-                        # 移動相関係数を計算
-                        rolling_corr = (
-                            returns[ticker1]
-                            .rolling(window=window_days)
-                            .corr(returns[ticker2])
-                        )
-                        rolling_corr = rolling_corr.dropna()
-
-                        fig_rolling = go.Figure(
-                            go.Scatter(
-                                x=rolling_corr.index,
-                                y=rolling_corr,
-                                mode="lines",
-                                line=dict(color=current_theme["primary"], width=2),
-                                fill="tozeroy",
-                                fillcolor=f"rgba({int(current_theme['primary'][1:3], 16)}, {int(current_theme['primary'][3:5], 16)}, {int(current_theme['primary'][5:7], 16)}, 0.2)",
-                            )
-                        )
-
-                        fig_rolling.update_layout(
-                            title=f"{window_days}日移動相関係数",
-                            xaxis_title="日付",
-                            yaxis_title="相関係数",
-                            yaxis=dict(range=[-1, 1]),
-                            hovermode="x unified",
-                            template="plotly_white",
-                            height=300,
-                        )
-
-                        # ゼロラインを追加
-                        fig_rolling.add_hline(y=0, line_dash="dash", line_color="gray")
-
-                        # 相関係数の強さを示す背景色を追加
-                        fig_rolling.add_hrect(
-                            y0=0.7,
-                            y1=1,
-                            line_width=0,
-                            fillcolor="rgba(76, 175, 80, 0.1)",
-                        )
-                        fig_rolling.add_hrect(
-                            y0=0.4,
-                            y1=0.7,
-                            line_width=0,
-                            fillcolor="rgba(255, 152, 0, 0.1)",
-                        )
-                        fig_rolling.add_hrect(
-                            y0=-0.4,
-                            y1=0.4,
-                            line_width=0,
-                            fillcolor="rgba(33, 150, 243, 0.1)",
-                        )
-                        fig_rolling.add_hrect(
-                            y0=-0.7,
-                            y1=-0.4,
-                            line_width=0,
-                            fillcolor="rgba(255, 152, 0, 0.1)",
-                        )
-                        fig_rolling.add_hrect(
-                            y0=-1,
-                            y1=-0.7,
-                            line_width=0,
-                            fillcolor="rgba(244, 67, 54, 0.1)",
-                        )
-
-                        st.plotly_chart(fig_rolling, use_container_width=True)
+                        render_rolling_correlation(returns, ticker1, ticker2, period)
 
                     with subtab2:
-                        # 統計サマリー
-                        st.markdown("#### 統計サマリー")
-                        col_stats1, col_stats2 = st.columns(2)
-
-                        with col_stats1:
-                            st.markdown(f"##### {company1} ({ticker1})")
-                            stats1 = returns[ticker1].describe().to_frame().T
-                            stats1.rename(index={ticker1: "日次リターン"}, inplace=True)
-                            st.dataframe(
-                                stats1.style.format("{:.4f}"), use_container_width=True
-                            )
-
-                        with col_stats2:
-                            st.markdown(f"##### {company2} ({ticker2})")
-                            stats2 = returns[ticker2].describe().to_frame().T
-                            stats2.rename(index={ticker2: "日次リターン"}, inplace=True)
-                            st.dataframe(
-                                stats2.style.format("{:.4f}"), use_container_width=True
-                            )
-
-                        # データテーブル表示
-                        st.markdown("#### 価格データ")
-
-                        # データテーブルの列名を会社名に変更
-                        df_display = df.copy()
-                        df_display.columns = [company1, company2]
-
-                        with st.expander("株価データを表示"):
-                            st.dataframe(
-                                df_display.style.format("{:.2f}"),
-                                use_container_width=True,
-                                height=400,
-                            )
-
-                        # リターンデータテーブル
-                        st.markdown("#### リターンデータ")
-                        returns_display = returns.copy()
-                        returns_display.columns = [company1, company2]
-
-                        with st.expander("リターンデータを表示"):
-                            st.dataframe(
-                                returns_display.style.format("{:.2%}"),
-                                use_container_width=True,
-                                height=400,
-                            )
+                        render_data_tables(
+                            df, returns, ticker1, ticker2, company1, company2, period
+                        )
 
                     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -737,3 +2070,6 @@ else:
         """,
         unsafe_allow_html=True,
     )
+
+# 処理時間の計測を締める
+finish_rerun()
@@ -0,0 +1,292 @@
+"""ペア指標のバッチ計算（コマンドライン）
+
+ペア一覧のCSV（ticker1, ticker2 の2列。見出しが無ければ先頭2列）を読み、
+相関・ベータ・移動相関・リードラグの要約をプロセスプールで計算してParquetに書き出す。
+
+    python batch.py pairs.csv --period 1y --output results.parquet
+    python batch.py pairs.csv --period 5y --windows 20 60 --workers 8
+
+- 株価は銘柄ごとに1回だけ取得する（取得元は環境変数 DATA_PROVIDER。
+  yfinanceの場合はアプリと同じくローカル株価ストアを経由する）
+- 計算はペアをチャンクに分けてワーカーに配り、終わったチャンクから
+  <output>.parts/ に書き出す。中断しても、再実行すれば未完了のペアだけを計算する
+  （期間・移動窓・ペア一覧・株価の取得元が前回と違えば、途中結果を捨てて最初から計算する）
+- --panel を指定すると、株価は取得せずに株価パネル（panel.py）から切り出す
+- 全ペアが終わったら1つのParquetにまとめ、途中ファイルを削除する
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from analytics import PAIR_WINDOWS, pair_metrics
+from panel import PricePanel
+from price_store import PriceStore
+from providers import provider_from_env
+
+CHUNK_SIZE = 256
+FETCH_WORKERS = 16
+
+# ワーカープロセスごとに保持する終値と取得失敗の理由（初期化時に1回だけ受け取る）
+_closes = {}
+_failures = {}
+
+
+def read_pairs(path):
+    """ペア一覧のCSVを読み、重複を除いた (ticker1, ticker2) のDataFrameを返す"""
+    pairs = pd.read_csv(path, dtype=str)
+    if not {"ticker1", "ticker2"} <= set(pairs.columns):
+        # 見出しの無いCSVは先頭2列をペアとみなす
+        pairs = pd.read_csv(path, dtype=str, header=None).iloc[:, :2]
+        pairs.columns = ["ticker1", "ticker2"]
+    pairs = pairs[["ticker1", "ticker2"]].apply(lambda column: column.str.strip())
+    pairs = pairs.dropna().drop_duplicates()
+    return pairs[pairs["ticker1"] != pairs["ticker2"]].reset_index(drop=True)
+
+
+def fetch_closes(tickers, period, log=print):
+    """全銘柄の終値を並列に取得する。取得できなかった銘柄は {ticker: エラー文} に入れる"""
+    provider = provider_from_env()
+    load_history = (
+        PriceStore(provider.history).history if provider.remote else provider.history
+    )
+
+    closes, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        futures = {
+            executor.submit(load_history, ticker, period): ticker for ticker in tickers
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            ticker = futures[future]
+            try:
+                data = future.result()
+            except Exception as e:
+                failures[ticker] = f"取得失敗: {e}"
+            else:
+                if data.empty:
+                    failures[ticker] = "データなし"
+                else:
+                    closes[ticker] = data["Close"]
+            if done % 100 == 0 or done == len(futures):
+                log(f"株価取得 {done:,}/{len(futures):,} 銘柄")
+    return closes, failures
+
+
+def panel_closes(panel, tickers, period):
+    """株価パネルから全銘柄の終値を切り出す（パネルに無い銘柄は {ticker: エラー文} に入れる）"""
+    frame = panel.closes(start=panel.period_start(period), tickers=tickers)
+    closes, failures = {}, {}
+    for ticker in tickers:
+        close = frame[ticker].dropna() if ticker in frame else None
+        if close is None or close.empty:
+            failures[ticker] = "パネルにデータなし"
+        else:
+            closes[ticker] = close
+    return closes, failures
+
+
+def _init_worker(closes, failures):
+    global _closes, _failures
+    _closes = closes
+    _failures = failures
+
+
+def _compute_chunk(pairs, windows):
+    rows = []
+    for ticker1, ticker2 in pairs:
+        row = {"ticker1": ticker1, "ticker2": ticker2, "error": None}
+        missing = [t for t in (ticker1, ticker2) if t not in _closes]
+        if missing:
+            row["error"] = "; ".join(
+                f"{t}: {_failures.get(t, 'データなし')}" for t in missing
+            )
+        else:
+            try:
+                row.update(pair_metrics(_closes[ticker1], _closes[ticker2], windows))
+            except Exception as e:
+                row["error"] = f"計算失敗: {e}"
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def parts_dir(output):
+    return f"{output}.parts"
+
+
+def run_manifest(pairs, period, windows, panel=None):
+    """途中結果を再利用できるかの判定に使う、計算の条件"""
+    digest = hashlib.sha256()
+    for ticker1, ticker2 in sorted(zip(pairs["ticker1"], pairs["ticker2"])):
+        digest.update(f"{ticker1},{ticker2}\n".encode())
+    return {
+        "period": period,
+        "windows": [int(window) for window in windows],
+        "pairs": digest.hexdigest(),
+        "source": (
+            f"panel:{os.path.abspath(panel.root)}"
+            if panel is not None
+            else os.environ.get("DATA_PROVIDER", "yfinance")
+        ),
+    }
+
+
+def _prepare_parts(output, manifest, log=print):
+    # 条件の違う（または条件の記録の無い）途中結果は捨て、今回の条件を書いておく
+    directory = parts_dir(output)
+    path = os.path.join(directory, "manifest.json")
+    if os.path.isdir(directory):
+        previous = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                previous = json.load(f)
+        if previous == manifest:
+            return
+        changed = (
+            ", ".join(k for k in manifest if previous.get(k) != manifest[k])
+            if previous is not None
+            else "条件の記録なし"
+        )
+        log(f"前回と条件が違うため、途中結果を破棄します（{changed}）")
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def completed_pairs(output):
+    """途中ファイルに書き出し済みのペア"""
+    directory = parts_dir(output)
+    if not os.path.isdir(directory):
+        return set()
+    done = set()
+    for name in os.listdir(directory):
+        if name.endswith(".parquet"):
+            part = pd.read_parquet(
+                os.path.join(directory, name), columns=["ticker1", "ticker2"]
+            )
+            done.update(zip(part["ticker1"], part["ticker2"]))
+    return done
+
+
+def _write_part(output, frame):
+    # 一時ファイルに書いてから置き換え、中断しても壊れたパートを残さない
+    directory = parts_dir(output)
+    os.makedirs(directory, exist_ok=True)
+    name = f"part-{time.time_ns()}-{os.getpid()}.parquet"
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    frame.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+
+def _finalize(output):
+    directory = parts_dir(output)
+    parts = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(".parquet")
+    )
+    results = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+    results = results.sort_values(["ticker1", "ticker2"], ignore_index=True)
+    tmp_path = f"{output}.tmp"
+    results.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, output)
+    shutil.rmtree(directory)
+    return results
+
+
+def run(
+    pairs,
+    period,
+    output,
+    windows=PAIR_WINDOWS,
+    workers=None,
+    chunk_size=CHUNK_SIZE,
+    panel=None,
+    log=print,
+):
+    """ペアの指標を計算して output に書き出し、結果のDataFrameを返す"""
+    _prepare_parts(output, run_manifest(pairs, period, windows, panel), log=log)
+    done = completed_pairs(output)
+    todo = [
+        (t1, t2)
+        for t1, t2 in zip(pairs["ticker1"], pairs["ticker2"])
+        if (t1, t2) not in done
+    ]
+    if done:
+        log(f"途中結果から再開します（完了 {len(done):,} / 残り {len(todo):,} ペア）")
+
+    if todo:
+        tickers = sorted({t for pair in todo for t in pair})
+        if panel is not None:
+            closes, failures = panel_closes(panel, tickers, period)
+        else:
+            closes, failures = fetch_closes(tickers, period, log=log)
+
+        chunks = [todo[i : i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        start = time.monotonic()
+        finished = 0
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(closes, failures)
+        ) as executor:
+            futures = [
+                executor.submit(_compute_chunk, chunk, windows) for chunk in chunks
+            ]
+            for future in as_completed(futures):
+                frame = future.result()
+                _write_part(output, frame)
+                finished += len(frame)
+                elapsed = time.monotonic() - start
+                rate = finished / elapsed if elapsed > 0 else 0.0
+                remaining = (len(todo) - finished) / rate if rate > 0 else 0.0
+                log(
+                    f"計算 {finished:,}/{len(todo):,} ペア "
+                    f"({rate:,.0f} ペア/秒, 残り約{remaining:,.0f}秒)"
+                )
+    elif not done:
+        log("計算するペアがありません。")
+        shutil.rmtree(parts_dir(output))
+        return pd.DataFrame()
+
+    results = _finalize(output)
+    log(f"結果を保存しました: {output}（{len(results):,} ペア）")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ペア指標のバッチ計算")
+    parser.add_argument("pairs", help="ペア一覧のCSV（ticker1, ticker2）")
+    parser.add_argument("--period", default="1y", help="取得期間（yfinanceの表記）")
+    parser.add_argument("--output", default="pair_metrics.parquet")
+    parser.add_argument(
+        "--windows", type=int, nargs="+", default=list(PAIR_WINDOWS), help="移動窓"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="ワーカー数（既定はCPU数）"
+    )
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--panel", help="株価パネルのディレクトリ（panel.py で作成）")
+    args = parser.parse_args(argv)
+
+    pairs = read_pairs(args.pairs)
+    run(
+        pairs,
+        args.period,
+        args.output,
+        windows=tuple(args.windows),
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        panel=PricePanel(args.panel) if args.panel else None,
+        log=lambda message: print(message, file=sys.stderr, flush=True),
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
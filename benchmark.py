@@ -0,0 +1,281 @@
+"""分析パイプラインのベンチマーク
+
+合成データ（ネットワーク不要）で各ステージの実行時間とピークメモリを計測し、
+結果をJSONに保存する。保存済みのベースラインと比較して遅くなったステージを報告する。
+
+    python benchmark.py --output bench.json
+    python benchmark.py --bars 1000 10000 --tickers 2 200 --baseline bench.json
+
+2銘柄ステージ（--bars の各本数で計測）:
+    align, returns, corr, rolling_pandas, rolling_engine, rolling_surface,
+    ols_trendline, huber_trendline, theil_sen_trendline, scatter_density,
+    spearman, kendall, ewma, rolling_spearman, rolling_kendall,
+    bootstrap_ci（直近 BOOTSTRAP_BARS 本で 10,000 回）,
+    cross_correlation, rolling_cross_correlation,
+    figure_build, figure_serialize
+多銘柄ステージ（--tickers の各銘柄数 × --universe-bars 本で計測）:
+    panel_build, corr_matrix, top_pairs, shrunk_covariance, min_variance, risk_parity
+"""
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from analytics import (
+    align_closes,
+    build_returns_panel,
+    correlation_matrix,
+    top_correlated_pairs,
+)
+from confidence import bootstrap_interval
+from downsample import density_grid
+from estimators import (
+    ewma_correlation,
+    kendall,
+    rolling_kendall,
+    rolling_spearman,
+    spearman,
+)
+from leadlag import MAX_LAG, cross_correlation, rolling_cross_correlation
+from portfolio import complete_returns, ledoit_wolf, portfolio_weights
+from providers import SyntheticProvider, synthetic_universe
+from regression import huber_fit, theil_sen_fit
+from rolling import RollingPairStats
+
+DEFAULT_BARS = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_TICKERS = [2, 20, 200, 2000]
+# ブートストラップは 本数×回数 に比例するため、本数によらず直近の一定本数で計測する
+BOOTSTRAP_BARS = 1_000
+DEFAULT_UNIVERSE_BARS = 1250
+ROLLING_WINDOW = 60
+
+# 回帰と判定する閾値（相対）と、ノイズとして無視する差（秒）
+DEFAULT_THRESHOLD = 0.25
+MIN_REGRESSION_SECONDS = 0.002
+
+
+def _synthetic_closes(tickers, n_bars):
+    # 営業日で表せない本数は分足の時刻にする（pandasの日付範囲の上限対策）
+    freq = "B" if n_bars <= 50_000 else "min"
+    provider = SyntheticProvider(n_bars=n_bars, freq=freq)
+    return {t: provider.history(t, period="max")["Close"] for t in tickers}
+
+
+def pair_stages(n_bars):
+    """2銘柄ビューのステージ（app.py の処理と同じ内容）"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    ticker1, ticker2 = synthetic_universe(2)
+    closes = _synthetic_closes([ticker1, ticker2], n_bars)
+    df = pd.DataFrame({ticker1: closes[ticker1], ticker2: closes[ticker2]}).dropna()
+    returns = df.pct_change().dropna()
+    x, y = returns[ticker1], returns[ticker2]
+
+    def figure_build():
+        fig = make_subplots(specs=[[{"secondary_y": True}]])
+        fig.add_trace(go.Scatter(x=df.index, y=df[ticker1]), secondary_y=False)
+        fig.add_trace(go.Scatter(x=df.index, y=df[ticker2]), secondary_y=True)
+        fig.update_xaxes(rangeslider_visible=True)
+        return fig
+
+    figure = figure_build()
+
+    return {
+        "align": lambda: align_closes(
+            closes[ticker1], closes[ticker2], ticker1, ticker2
+        ),
+        "returns": lambda: df.pct_change().dropna(),
+        "corr": lambda: x.corr(y),
+        "rolling_pandas": lambda: x.rolling(window=ROLLING_WINDOW).corr(y).dropna(),
+        "rolling_engine": lambda: RollingPairStats(x, y).correlation(ROLLING_WINDOW),
+        "rolling_surface": lambda: RollingPairStats(x, y).correlation_surface(),
+        "ols_trendline": lambda: RollingPairStats(x, y).regression(),
+        "huber_trendline": lambda: huber_fit(x, y),
+        "theil_sen_trendline": lambda: theil_sen_fit(x, y),
+        "scatter_density": lambda: density_grid(x, y),
+        "spearman": lambda: spearman(x, y),
+        "kendall": lambda: kendall(x, y),
+        "ewma": lambda: ewma_correlation(x, y),
+        "rolling_spearman": lambda: rolling_spearman(x, y, ROLLING_WINDOW),
+        "rolling_kendall": lambda: rolling_kendall(x, y, ROLLING_WINDOW),
+        "bootstrap_ci": lambda: bootstrap_interval(
+            x.iloc[-BOOTSTRAP_BARS:], y.iloc[-BOOTSTRAP_BARS:], seed=0
+        ),
+        "cross_correlation": lambda: cross_correlation(x, y, MAX_LAG),
+        "rolling_cross_correlation": lambda: rolling_cross_correlation(
+            x, y, ROLLING_WINDOW, MAX_LAG
+        ),
+        "figure_build": figure_build,
+        "figure_serialize": lambda: figure.to_json(),
+    }
+
+
+def universe_stages(n_tickers, n_bars):
+    """複数銘柄モード・スクリーナーのステージ"""
+    tickers = synthetic_universe(n_tickers)
+    closes = _synthetic_closes(tickers, n_bars)
+    returns = build_returns_panel(closes)
+    complete, _ = complete_returns(returns)
+    covariance, _ = ledoit_wolf(complete.to_numpy())
+
+    return {
+        "panel_build": lambda: build_returns_panel(closes),
+        "corr_matrix": lambda: correlation_matrix(returns),
+        "top_pairs": lambda: top_correlated_pairs(returns, k=20),
+        "shrunk_covariance": lambda: ledoit_wolf(complete.to_numpy()),
+        "min_variance": lambda: portfolio_weights(covariance, "min_variance"),
+        "risk_parity": lambda: portfolio_weights(covariance, "risk_parity"),
+    }
+
+
+def measure(fn, repeat):
+    """実行時間（中央値・最小）とピークメモリ（MiB）を計測する
+
+    tracemalloc は実行を遅くするため、時間の計測とは別に1回だけ実行する。
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "peak_mib": peak / 2**20,
+    }
+
+
+def run(bars, tickers, universe_bars, repeat, stages=None, log=print):
+    results = []
+
+    def record(name, fn, **size):
+        if stages and name not in stages:
+            return
+        result = {"stage": name, **size, **measure(fn, repeat)}
+        results.append(result)
+        log(
+            f"{name:<18} {_size_label(result):<22} "
+            f"{result['seconds'] * 1000:>10.2f} ms {result['peak_mib']:>9.1f} MiB"
+        )
+
+    for n_bars in bars:
+        for name, fn in pair_stages(n_bars).items():
+            record(name, fn, bars=n_bars, tickers=2)
+
+    for n_tickers in tickers:
+        for name, fn in universe_stages(n_tickers, universe_bars).items():
+            record(name, fn, bars=universe_bars, tickers=n_tickers)
+
+    return results
+
+
+def _size_label(result):
+    return f"bars={result['bars']:,} tickers={result['tickers']:,}"
+
+
+def _key(result):
+    return (result["stage"], result["bars"], result["tickers"])
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """ベースラインより threshold 以上遅くなった計測を返す"""
+    previous = {_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(_key(result))
+        if before is None:
+            continue
+        slower = result["seconds"] - before["seconds"]
+        if slower > MIN_REGRESSION_SECONDS and result["seconds"] > before["seconds"] * (
+            1 + threshold
+        ):
+            regressions.append(
+                {
+                    **result,
+                    "baseline_seconds": before["seconds"],
+                    "ratio": result["seconds"] / before["seconds"],
+                }
+            )
+    return regressions
+
+
+def metadata():
+    import plotly
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "plotly": plotly.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分析パイプラインのベンチマーク")
+    parser.add_argument("--bars", type=int, nargs="+", default=DEFAULT_BARS)
+    parser.add_argument("--tickers", type=int, nargs="+", default=DEFAULT_TICKERS)
+    parser.add_argument(
+        "--universe-bars",
+        type=int,
+        default=DEFAULT_UNIVERSE_BARS,
+        help="多銘柄ステージで使うバー数",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", help="計測するステージ（既定は全て）")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--baseline", help="比較するベースラインのJSONファイル")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.bars, args.tickers, args.universe_bars, args.repeat, stages=args.stages
+    )
+    report = {"meta": metadata(), "results": results}
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)}件の性能低下を検出しました:")
+            for r in regressions:
+                print(
+                    f"  {r['stage']:<18} {_size_label(r):<22} "
+                    f"{r['baseline_seconds'] * 1000:.2f} ms -> "
+                    f"{r['seconds'] * 1000:.2f} ms (x{r['ratio']:.2f})"
+                )
+            return 1
+        print("\n性能低下はありません。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
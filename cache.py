@@ -0,0 +1,142 @@
+"""セッション間で共有するデータキャッシュ
+
+Streamlitの全セッション（同一プロセス）で株価履歴と銘柄情報を共有する。
+データ種別ごとにTTLを変え、件数上限を超えたら古いものから捨てる（LRU）。
+同じキーへの同時リクエストは1回の取得にまとめる（シングルフライト）。
+"""
+
+import time
+from concurrent.futures import Future
+from threading import Lock
+
+from cachetools import TLRUCache
+
+# データ種別ごとの有効期間（秒）
+DEFAULT_TTLS = {
+    "intraday": 60,
+    "daily": 15 * 60,
+    "info": 24 * 60 * 60,
+}
+
+DEFAULT_MAXSIZE = 1024
+
+# 日中足として扱う取得間隔
+INTRADAY_INTERVALS = {"1m", "2m", "5m", "15m", "30m", "60m", "90m", "1h"}
+
+
+def history_kind(interval):
+    return "intraday" if interval in INTRADAY_INTERVALS else "daily"
+
+
+class _CountingCache(TLRUCache):
+    """期限切れ以外の理由（件数上限）で捨てた件数を数えるTLRUCache"""
+
+    def __init__(self, maxsize, ttu, timer):
+        super().__init__(maxsize, ttu, timer=timer)
+        self.evictions = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+
+class SharedCache:
+    """TTL付きLRUキャッシュ＋シングルフライト
+
+    キーは (種別, ...) のタプル。先頭の種別でTTLを決める（put では個別に指定できる）。
+    キャッシュした値は全セッションで共有されるため、呼び出し側で変更しないこと。
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttls=None, timer=time.monotonic):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self._entries = _CountingCache(maxsize, self._expires_at, timer)
+        self._inflight = {}
+        # put で個別に指定したTTL（保存する時点で一度だけ使う）
+        self._ttl_overrides = {}
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._errors = 0
+
+    def _expires_at(self, key, value, now):
+        ttl = self._ttl_overrides.pop(key, None)
+        return now + (self.ttls[key[0]] if ttl is None else ttl)
+
+    def get_or_fetch(self, key, fetch):
+        """キャッシュにあれば返し、無ければfetch()で取得して保存する
+
+        同じキーを取得中の呼び出しがあれば、新たに取得せずその結果を待つ。
+        fetch()が例外を出した場合は保存せず、待っていた全員に同じ例外を送る。
+        """
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                pass
+            else:
+                self._hits += 1
+                return value
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self._inflight[key] = future
+                self._misses += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._errors += 1
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._entries[key] = value
+            del self._inflight[key]
+        future.set_result(value)
+        return value
+
+    def put(self, key, value, ttl=None):
+        """値を保存する（既存の値は置き換える）。ttl を指定すると種別のTTLの代わりに使う"""
+        with self._lock:
+            if ttl is not None:
+                self._ttl_overrides[key] = ttl
+            self._entries[key] = value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """監視用のカウンタ"""
+        with self._lock:
+            self._entries.expire()
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "errors": self._errors,
+                "evictions": self._entries.evictions,
+                "entries": len(self._entries),
+                "inflight": len(self._inflight),
+                "maxsize": self._entries.maxsize,
+            }
+
+
+# プロセス全体で共有するキャッシュ
+shared_cache = SharedCache()
@@ -0,0 +1,187 @@
+"""相関係数の信頼区間
+
+- fisher_interval: Fisher の z 変換による近似区間（閉形式。時系列にもそのまま使える）。
+  標準誤差はピアソン 1/√(n-3)、スピアマン √(1.06/(n-3))、ケンドール √(0.437/(n-4))
+  （Fieller, Hartley & Pearson 1957）。EWMAは重みの有効サンプル数を n とする
+- bootstrap_interval: 移動ブロック・ブートストラップ（リターンの自己相関を壊さないよう、
+  連続した block 時点ずつ復元抽出する）。リサンプルは (回数, 時点数) の添字配列を
+  まとめて作り、estimators の推定方法に (時点数, 回数) の配列として一度に渡す
+- rolling_bootstrap_interval: 同じ抽出パターンを全ての窓に当てはめ、移動相関の各時点の区間を求める
+
+区間はパーセンタイル法。リサンプルは RESAMPLE_BLOCK 要素ずつに分けて計算し、
+workers を指定するとスレッドで並列に処理する（NumPyの計算はGILを解放する）。
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+from estimators import DEFAULT_HALFLIFE, correlation
+
+# 信頼区間の方法（表示名: 内部名）
+INTERVAL_METHODS = {
+    "なし": None,
+    "Fisher z": "fisher",
+    "ブロックブートストラップ": "bootstrap",
+}
+CONFIDENCE_LEVEL = 0.95
+# 全期間の区間のリサンプル回数と、移動相関の各時点のリサンプル回数
+BOOTSTRAP_RESAMPLES = 10_000
+ROLLING_RESAMPLES = 200
+# 一度に作るリサンプルの要素数（時点数×回数）の上限
+RESAMPLE_BLOCK = 2_000_000
+# アプリで使う並列数（チャンクが1つなら並列にしない）
+BOOTSTRAP_WORKERS = min(4, os.cpu_count() or 1)
+
+# Fisher z の標準誤差 √(scale / (n - offset))
+FISHER_SE = {
+    "pearson": (1.0, 3),
+    "spearman": (1.06, 3),
+    "kendall": (0.437, 4),
+    "ewma": (1.0, 3),
+}
+
+
+def ewma_effective_n(n, halflife=DEFAULT_HALFLIFE):
+    """EWMAの重み（直近 n 時点）の有効サンプル数 (Σw)² / Σw²"""
+    decay = 0.5 ** (1.0 / halflife)
+    n = np.asarray(n, dtype=np.float64)
+    total = (1 - decay**n) / (1 - decay)
+    squares = (1 - decay ** (2 * n)) / (1 - decay**2)
+    return total**2 / squares
+
+
+def fisher_interval(r, n, method="pearson", level=CONFIDENCE_LEVEL):
+    """Fisher z 変換による信頼区間 (下限, 上限)。r, n は配列でもよい"""
+    scale, offset = FISHER_SE[method]
+    r = np.asarray(r, dtype=np.float64)
+    n = np.asarray(n, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = np.arctanh(np.clip(r, -0.999999, 0.999999))
+        se = np.sqrt(scale / (n - offset))
+    se = np.where(n > offset, se, np.nan)
+    half = NormalDist().inv_cdf(0.5 + level / 2) * se
+    return np.tanh(z - half), np.tanh(z + half)
+
+
+def default_block(n):
+    """ブロック長の目安（n の立方根）"""
+    return max(1, int(round(n ** (1 / 3))))
+
+
+def block_indices(n, size, block, rng):
+    """移動ブロック・ブートストラップの添字 (size, n)
+
+    各リサンプルは、ランダムな開始点から block 時点ずつ連続した添字をつないで n 個にする
+    （末尾を超えたら先頭に戻る循環ブロック）。
+    """
+    blocks = -(-n // block)
+    starts = rng.integers(0, n, size=(size, blocks, 1))
+    return ((starts + np.arange(block)) % n).reshape(size, -1)[:, :n]
+
+
+def _map_chunks(function, sizes, workers):
+    if workers and workers > 1 and len(sizes) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(function, sizes))
+    return [function(size) for size in sizes]
+
+
+def _chunks(total, per_chunk):
+    per_chunk = max(1, per_chunk)
+    return [min(per_chunk, total - i) for i in range(0, total, per_chunk)]
+
+
+def bootstrap_distribution(
+    x,
+    y,
+    method="pearson",
+    n_resamples=BOOTSTRAP_RESAMPLES,
+    block=None,
+    halflife=DEFAULT_HALFLIFE,
+    seed=None,
+    workers=None,
+):
+    """移動ブロック・ブートストラップによる相関係数の分布（長さ n_resamples の配列）"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = x[valid], y[valid]
+    n = len(x)
+    block = block or default_block(n)
+    # 並列に処理するチャンクごとに独立な乱数列を使う
+    sizes = _chunks(n_resamples, RESAMPLE_BLOCK // max(n, 1))
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    def resample(chunk):
+        size, chunk_seed = chunk
+        index = block_indices(n, size, block, np.random.default_rng(chunk_seed))
+        return np.atleast_1d(
+            correlation(x[index].T, y[index].T, method, halflife=halflife)
+        )
+
+    return np.concatenate(_map_chunks(resample, list(zip(sizes, seeds)), workers))
+
+
+def bootstrap_interval(x, y, method="pearson", level=CONFIDENCE_LEVEL, **kwargs):
+    """移動ブロック・ブートストラップのパーセンタイル信頼区間 (下限, 上限)"""
+    samples = bootstrap_distribution(x, y, method, **kwargs)
+    low, high = np.nanquantile(samples, [(1 - level) / 2, (1 + level) / 2])
+    return float(low), float(high)
+
+
+def rolling_bootstrap_interval(
+    x,
+    y,
+    window,
+    method="pearson",
+    level=CONFIDENCE_LEVEL,
+    n_resamples=ROLLING_RESAMPLES,
+    block=None,
+    seed=None,
+    workers=None,
+):
+    """移動相関の各時点（window 時点の窓）のブートストラップ信頼区間 (下限の配列, 上限の配列)
+
+    窓内の相対位置の抽出パターン (回数, window) を1つ作り、全ての窓に同じものを当てはめる。
+    窓×回数 のリサンプルを (window, 窓数×回数) の配列にして推定方法にまとめて渡す。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    low = np.full(n, np.nan)
+    high = np.full(n, np.nan)
+    if n < window:
+        return low, high
+
+    block = block or default_block(window)
+    offsets = block_indices(
+        window, n_resamples, block, np.random.default_rng(seed)
+    ).ravel()
+    ends = np.arange(window - 1, n)
+    per_chunk = RESAMPLE_BLOCK // (window * n_resamples)
+    bounds = np.cumsum([0] + _chunks(len(ends), per_chunk))
+
+    def resample(chunk):
+        begin, stop = chunk
+        # 窓の先頭 + 窓内の添字 → (window, 窓数×回数)
+        index = (ends[begin:stop, None] - window + 1 + offsets).reshape(-1, window).T
+        samples = np.atleast_1d(correlation(x[index], y[index], method))
+        return np.nanquantile(
+            samples.reshape(stop - begin, n_resamples),
+            [(1 - level) / 2, (1 + level) / 2],
+            axis=1,
+        )
+
+    results = _map_chunks(resample, list(zip(bounds[:-1], bounds[1:])), workers)
+    quantiles = np.concatenate(results, axis=1)
+    low[window - 1 :], high[window - 1 :] = quantiles
+    # 欠損を含む窓は推定値もNaNなので区間も出さない
+    valid = np.isfinite(x) & np.isfinite(y)
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    incomplete = counts[window:] - counts[:-window] < window
+    low[window - 1 :][incomplete] = np.nan
+    high[window - 1 :][incomplete] = np.nan
+    return low, high
@@ -0,0 +1,69 @@
+"""長期チャート向けの間引きとトレース選択
+
+各区間の最小値・最大値を残す間引き（min/maxバケット）で、
+画面上の見た目をほぼ変えずにブラウザへ送る点数を減らす。
+点数の多い散布図は、サーバー側で集計した2次元ヒストグラム（密度）で描く。
+"""
+
+import numpy as np
+import plotly.graph_objects as go
+
+# 1トレースあたりに送る最大点数（横幅1000px程度のチャートで1pxあたり2点）
+MAX_POINTS = 2000
+# 送る点数の合計がこれを超えたらWebGL（Scattergl）で描画する
+WEBGL_THRESHOLD = 3000
+# 散布図の点数がこれを超えたら点ではなく密度で描画する
+DENSITY_THRESHOLD = 5000
+DENSITY_BINS = 80
+
+
+def minmax_indices(values, max_points=MAX_POINTS):
+    """各バケットの最小値と最大値の位置（昇順）を返す
+
+    max_points/2 個のバケットに分け、それぞれの最小・最大の2点を残す。
+    先頭と末尾の点は常に含める。NaNは無視する。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+
+    buckets = max(max_points // 2 - 1, 1)
+    size = -(-n // buckets)
+    padded = np.full(size * buckets, np.nan)
+    padded[:n] = values
+    rows = padded.reshape(buckets, size)
+
+    valid = np.isfinite(rows)
+    has_value = valid.any(axis=1)
+    offsets = np.arange(buckets) * size
+    lows = np.where(valid, rows, np.inf).argmin(axis=1) + offsets
+    highs = np.where(valid, rows, -np.inf).argmax(axis=1) + offsets
+
+    picked = np.concatenate([[0, n - 1], lows[has_value], highs[has_value]])
+    return np.unique(picked[picked < n])
+
+
+def downsample_series(series, max_points=MAX_POINTS):
+    """Seriesをmin/maxバケットで間引く（インデックスは保持）"""
+    return series.iloc[minmax_indices(series.to_numpy(), max_points)]
+
+
+def scatter_trace(total_points, **kwargs):
+    """点数に応じてSVG（Scatter）かWebGL（Scattergl）のトレースを作る"""
+    if total_points > WEBGL_THRESHOLD:
+        return go.Scattergl(**kwargs)
+    return go.Scatter(**kwargs)
+
+
+def density_grid(x, y, bins=DENSITY_BINS):
+    """散布図の点を bins×bins の格子で数える
+
+    (xの中心, yの中心, 件数[y, x]) を返す。件数0のマスはNaN（透明に描画される）。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.isfinite(x) & np.isfinite(y)
+    counts, x_edges, y_edges = np.histogram2d(x[valid], y[valid], bins=bins)
+    counts[counts == 0] = np.nan
+    return (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2, counts.T
@@ -0,0 +1,238 @@
+"""相関係数の推定方法
+
+ピアソン（積率相関）は外れ値の日に引きずられやすいため、順位にもとづく
+スピアマン・ケンドールと、直近を重く見るEWMA（指数加重）の相関も計算できるようにする。
+
+- x, y には1ペアの1次元配列か、(時点数, ペア数) の2次元配列を渡す。2次元のときは
+  全ペアをまとめて計算する。欠損はペアごとに、両方の値がある時点だけを使う
+- ケンドールのτ（τ-b）は、xの順に並べたyの転倒数を regression.count_inversions の
+  マージソートで数える（O(n log n)）。移動窓版は時点差ごとの符号の積を累積和で足し込み、
+  全体の計算量を 時点数×窓幅 に抑える
+- EWMAは指数加重の和を scipy.signal.lfilter の1回の走査で求める（半減期を指定）
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from regression import count_inversions, dense_ranks
+from rolling import RollingPairStats
+
+ESTIMATORS = {
+    "ピアソン": "pearson",
+    "スピアマン": "spearman",
+    "ケンドール": "kendall",
+    "EWMA": "ewma",
+}
+# EWMAの半減期の既定値（日数・本数）
+DEFAULT_HALFLIFE = 20
+# 移動スピアマンで一度に順位を付ける窓の数（メモリ使用量の上限）
+RANK_BLOCK = 4096
+
+
+def _columns(x, y):
+    """(時点数, ペア数) の配列にそろえ、片方でも欠けている時点を両方ともNaNにする"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    single = x.ndim == 1
+    if single:
+        x, y = x[:, None], y[:, None]
+    valid = np.isfinite(x) & np.isfinite(y)
+    return np.where(valid, x, np.nan), np.where(valid, y, np.nan), valid, single
+
+
+def _result(values, single):
+    if single:
+        return float(values[0]) if np.ndim(values) == 1 else values[:, 0]
+    return values
+
+
+def _pearson_columns(x, y, valid, axis=0):
+    count = valid.sum(axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        xc = np.where(valid, x - np.nanmean(x, axis=axis, keepdims=True), 0.0)
+        yc = np.where(valid, y - np.nanmean(y, axis=axis, keepdims=True), 0.0)
+        corr = (xc * yc).sum(axis=axis) / np.sqrt(
+            (xc**2).sum(axis=axis) * (yc**2).sum(axis=axis)
+        )
+    corr = np.where(count >= 2, corr, np.nan)
+    return np.clip(corr, -1.0, 1.0)
+
+
+def _ranks(values, axis=0):
+    """平均順位（同値は順位の平均。欠損はNaNのまま）"""
+    from scipy.stats import rankdata
+
+    return rankdata(values, axis=axis, nan_policy="omit")
+
+
+def pearson(x, y):
+    """ピアソンの積率相関係数"""
+    x, y, valid, single = _columns(x, y)
+    return _result(_pearson_columns(x, y, valid), single)
+
+
+def spearman(x, y):
+    """スピアマンの順位相関係数（順位に付け替えたピアソン。同値は平均順位）"""
+    x, y, valid, single = _columns(x, y)
+    return _result(_pearson_columns(_ranks(x), _ranks(y), valid), single)
+
+
+def _tied_pairs(sorted_values, count):
+    """行ごとに昇順に並んだ値の、先頭 count 個の中の同値の組の数
+
+    連の中の位置 0, 1, 2, ... の和が、長さLの連の組の数 L(L-1)/2 の和になる。
+    """
+    index = np.arange(sorted_values.shape[1])
+    same = np.zeros(sorted_values.shape, dtype=bool)
+    same[:, 1:] = sorted_values[:, 1:] == sorted_values[:, :-1]
+    same &= index < count[:, None]
+    start = np.maximum.accumulate(np.where(same, 0, index), axis=1)
+    return (index - start).sum(axis=1)
+
+
+def kendall(x, y):
+    """ケンドールの順位相関係数 τ-b（O(n log n)）
+
+    xの昇順（同じxはyの昇順）に並べると、不一致の組はyの転倒の組になる。
+    一致・不一致の組の差は 全組 - xの同値 - yの同値 + 両方の同値 - 2×転倒数。
+    欠損はx・yとも +inf に置き換える（末尾にまとまり転倒を生まない）。
+    ペアごとに1行の連続した配列にし、x・yを整数の順位に置き換えてから並べ替える。
+    """
+    x, y, valid, single = _columns(x, y)
+    rank_x = dense_ranks(np.where(valid, x, np.inf).T)
+    rank_y = dense_ranks(np.where(valid, y, np.inf).T)
+    n = rank_x.shape[1]
+    count = valid.sum(axis=0)
+
+    joint = rank_x * n + rank_y
+    order = np.argsort(joint, axis=1)
+    discordant = count_inversions(
+        np.take_along_axis(rank_y, order, axis=1), ranked=True
+    )
+    x_ties = _tied_pairs(np.sort(rank_x, axis=1), count)
+    y_ties = _tied_pairs(np.sort(rank_y, axis=1), count)
+    joint_ties = _tied_pairs(np.take_along_axis(joint, order, axis=1), count)
+
+    total = count * (count - 1) / 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tau = (total - x_ties - y_ties + joint_ties - 2 * discordant) / np.sqrt(
+            (total - x_ties) * (total - y_ties)
+        )
+    tau = np.where(count >= 2, tau, np.nan)
+    return _result(np.clip(tau, -1.0, 1.0), single)
+
+
+def ewma_correlation(x, y, halflife=DEFAULT_HALFLIFE):
+    """指数加重の相関係数の時系列（各時点までの値。pandas の ewm(halflife).corr と同じ重み）
+
+    重み付きの Σw, Σx, Σy, Σxy, Σx², Σy² を1回の線形フィルタで同時に求める。
+    欠損の時点は重み0で、減衰は時点の位置で進める。
+    """
+    x, y, valid, single = _columns(x, y)
+    from scipy.signal import lfilter
+
+    decay = 0.5 ** (1.0 / halflife)
+    # 桁落ちを避けるため全体平均で中心化（相関は平行移動で不変）
+    with np.errstate(invalid="ignore"):
+        xc = np.where(valid, x - np.nanmean(x, axis=0), 0.0)
+        yc = np.where(valid, y - np.nanmean(y, axis=0), 0.0)
+    terms = np.stack([valid.astype(np.float64), xc, yc, xc * yc, xc**2, yc**2])
+    sw, sx, sy, sxy, sxx, syy = lfilter([1.0], [1.0, -decay], terms, axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sxy / sw - (sx / sw) * (sy / sw)
+        var_x = sxx / sw - (sx / sw) ** 2
+        var_y = syy / sw - (sy / sw) ** 2
+        corr = cov / np.sqrt(var_x * var_y)
+    corr[np.cumsum(valid, axis=0) < 2] = np.nan
+    return _result(np.clip(corr, -1.0, 1.0), single)
+
+
+def _window_count(valid, window):
+    counts = np.cumsum(np.vstack([np.zeros((1, valid.shape[1])), valid]), axis=0)
+    return counts[window:] - counts[:-window]
+
+
+def rolling_spearman(x, y, window):
+    """移動スピアマン相関（各時点までの window 時点。窓に欠損があればNaN）"""
+    x, y, valid, single = _columns(x, y)
+    result = np.full(x.shape, np.nan)
+    if len(x) >= window:
+        windows_x = sliding_window_view(x, window, axis=0)
+        windows_y = sliding_window_view(y, window, axis=0)
+        for begin in range(0, len(windows_x), RANK_BLOCK):
+            block = slice(begin, begin + RANK_BLOCK)
+            rank_x = _ranks(windows_x[block], axis=-1)
+            rank_y = _ranks(windows_y[block], axis=-1)
+            result[window - 1 + begin : window - 1 + begin + len(rank_x)] = (
+                _pearson_columns(rank_x, rank_y, np.isfinite(rank_x), axis=-1)
+            )
+        result[window - 1 :][_window_count(valid, window) < window] = np.nan
+    return _result(result, single)
+
+
+def rolling_kendall(x, y, window):
+    """移動ケンドール相関 τ-b（各時点までの window 時点。窓に欠損があればNaN）
+
+    時点差 lag ごとに、組 (t-lag, t) の符号の積と同値でない組の数を作り、
+    終点が窓に入る組の和を累積和の差でまとめて求める（lag のループは窓幅回）。
+    """
+    x, y, valid, single = _columns(x, y)
+    n = len(x)
+    result = np.full(x.shape, np.nan)
+    if n >= window:
+        concordance = np.zeros((n - window + 1, x.shape[1]), dtype=np.int64)
+        x_untied = np.zeros_like(concordance)
+        y_untied = np.zeros_like(concordance)
+        for lag in range(1, window):
+            sign_x = np.nan_to_num(np.sign(x[lag:] - x[:-lag])).astype(np.int64)
+            sign_y = np.nan_to_num(np.sign(y[lag:] - y[:-lag])).astype(np.int64)
+            # 終点 t の窓に入る組は、組の終点が [t - (window - lag) + 1, t] のもの
+            span = window - lag
+            for values, total in (
+                (sign_x * sign_y, concordance),
+                (np.abs(sign_x), x_untied),
+                (np.abs(sign_y), y_untied),
+            ):
+                prefix = np.zeros((n + 1, x.shape[1]), dtype=np.int64)
+                np.cumsum(values, axis=0, out=prefix[lag + 1 :])
+                total += prefix[window:] - prefix[window - span : n + 1 - span]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tau = concordance / np.sqrt(x_untied * y_untied)
+        tau[_window_count(valid, window) < window] = np.nan
+        result[window - 1 :] = np.clip(tau, -1.0, 1.0)
+    return _result(result, single)
+
+
+def rolling_pearson(x, y, window):
+    """移動ピアソン相関（rolling.RollingPairStats の累積和をペアごとに使う）"""
+    x, y, _, single = _columns(x, y)
+    result = np.column_stack(
+        [
+            RollingPairStats(
+                pd.Series(x[:, j]), pd.Series(y[:, j])
+            ).correlation_surface([window])[0]
+            for j in range(x.shape[1])
+        ]
+    )
+    return _result(result, single)
+
+
+def correlation(x, y, method="pearson", halflife=DEFAULT_HALFLIFE):
+    """全期間の相関係数（EWMAは最終時点の値）"""
+    if method == "ewma":
+        values = ewma_correlation(x, y, halflife)
+        return values[-1]
+    return {"pearson": pearson, "spearman": spearman, "kendall": kendall}[method](x, y)
+
+
+def rolling_correlation(x, y, method="pearson", window=60, halflife=DEFAULT_HALFLIFE):
+    """移動相関の時系列（x と同じ長さ。EWMAは窓幅ではなく半減期で重み付けする）"""
+    if method == "ewma":
+        return ewma_correlation(x, y, halflife)
+    return {
+        "pearson": rolling_pearson,
+        "spearman": rolling_spearman,
+        "kendall": rolling_kendall,
+    }[method](x, y, window)
@@ -0,0 +1,106 @@
+"""株価・銘柄情報の並列取得
+
+複数銘柄の株価履歴と銘柄情報（.info）を同時に問い合わせ、
+待ち時間を「合計」ではなく「最も遅い1件」に抑える。
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from cache import history_kind, shared_cache
+
+# 株価履歴の取得タイムアウト（秒）
+HISTORY_TIMEOUT = 20.0
+# 銘柄情報の取得タイムアウト（秒）。超えたら証券コードを表示名にする
+INFO_TIMEOUT = 3.0
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="fetch")
+
+
+def _company_name(ticker, future, deadline):
+    # タイムアウトした.infoの取得は裏で継続し、完了すれば共有キャッシュに入る
+    try:
+        info = future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except Exception:
+        # タイムアウトや取得失敗時は証券コードをそのまま表示名にする
+        return ticker
+    return (info or {}).get("shortName", ticker)
+
+
+def history_key(ticker, period, interval="1d"):
+    """共有キャッシュでの株価履歴のキー"""
+    return (history_kind(interval), "history", ticker, period, interval)
+
+
+def info_key(ticker):
+    """共有キャッシュでの銘柄情報のキー"""
+    return ("info", ticker)
+
+
+def _submit_info(ticker, info_fn, cache):
+    return _executor.submit(
+        cache.get_or_fetch, info_key(ticker), lambda: info_fn(ticker)
+    )
+
+
+def fetch_names(tickers, info_fn, info_timeout=INFO_TIMEOUT, cache=shared_cache):
+    """会社名を {ticker: 会社名} で返す（銘柄情報は cache 経由）
+
+    取得に失敗・タイムアウトした銘柄は証券コードを会社名とする。失敗は cache に
+    保存されないため、次の呼び出しで取得し直す。
+    """
+    deadline = time.monotonic() + info_timeout
+    futures = {t: _submit_info(t, info_fn, cache) for t in dict.fromkeys(tickers)}
+    return {t: _company_name(t, future, deadline) for t, future in futures.items()}
+
+
+def fetch_all(
+    tickers,
+    period,
+    history_fn,
+    info_fn=None,
+    history_timeout=HISTORY_TIMEOUT,
+    info_timeout=INFO_TIMEOUT,
+    interval="1d",
+    cache=shared_cache,
+):
+    """全銘柄の株価履歴と会社名を並列に取得する
+
+    history_fn(ticker, period) は株価のDataFrameを、info_fn(ticker) は銘柄情報の
+    辞書を返す関数。info_fnを省略すると銘柄情報は取得せず、証券コードを会社名とする。
+    取得結果はcache（セッション間共有）を経由し、同じ銘柄の同時取得は1回にまとまる。
+    戻り値は ({ticker: DataFrame}, {ticker: 会社名})。
+    """
+    unique = list(dict.fromkeys(tickers))
+    start = time.monotonic()
+
+    def cached_history(ticker):
+        return cache.get_or_fetch(
+            history_key(ticker, period, interval), lambda: history_fn(ticker, period)
+        )
+
+    history_futures = {t: _executor.submit(cached_history, t) for t in unique}
+    if info_fn is None:
+        info_futures = {}
+    else:
+        info_futures = {t: _submit_info(t, info_fn, cache) for t in unique}
+
+    histories = {}
+    history_deadline = start + history_timeout
+    for ticker, future in history_futures.items():
+        try:
+            histories[ticker] = future.result(
+                timeout=max(0.0, history_deadline - time.monotonic())
+            )
+        except FutureTimeoutError:
+            raise TimeoutError(
+                f"{ticker} の株価データ取得がタイムアウトしました（{history_timeout:.0f}秒）"
+            ) from None
+
+    info_deadline = start + info_timeout
+    names = {t: t for t in unique}
+    for ticker, future in info_futures.items():
+        names[ticker] = _company_name(ticker, future, info_deadline)
+
+    return histories, names
@@ -0,0 +1,85 @@
+"""起動時のモジュール読み込み時間のレポート
+
+新しいPythonプロセスで `python -X importtime` を使ってモジュールを読み込み、
+パッケージごとの読み込み時間を集計する。コールドスタートで何に時間が
+かかっているかの確認用。
+
+    python import_report.py                # app.py（Streamlitのベアモードで実行）
+    python import_report.py --module batch --top 10
+    python import_report.py --json imports.json
+
+再実行（rerun）ごとの処理時間は、アプリのデバッグパネル（?debug=1）で確認する。
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure_imports(module="app"):
+    """module を読み込んだときの [(モジュール名, 自身の時間, 累計時間, 深さ)]（秒）を返す"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    records = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append(
+                (name, int(self_us) / 1e6, int(cumulative_us) / 1e6, len(indent) // 2)
+            )
+    return records
+
+
+def summarize(records, top=15):
+    """合計時間と、トップレベルのパッケージごとの読み込み時間（多い順）"""
+    by_package = defaultdict(float)
+    for name, self_time, _, _ in records:
+        by_package[name.split(".")[0]] += self_time
+    packages = sorted(by_package.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "total_seconds": sum(self_time for _, self_time, _, _ in records),
+        "modules": len(records),
+        "packages": [
+            {"package": package, "seconds": seconds} for package, seconds in packages
+        ][:top],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="起動時の読み込み時間のレポート")
+    parser.add_argument("--module", default="app", help="読み込むモジュール")
+    parser.add_argument("--top", type=int, default=15, help="表示するパッケージ数")
+    parser.add_argument("--json", help="結果を保存するJSONファイル")
+    args = parser.parse_args(argv)
+
+    report = summarize(measure_imports(args.module), top=args.top)
+    print(
+        f"{args.module}: {report['total_seconds'] * 1000:.0f} ms"
+        f"（{report['modules']:,} モジュール）"
+    )
+    for row in report["packages"]:
+        print(f"  {row['package']:<24} {row['seconds'] * 1000:>9.1f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""処理時間の計測（スパン）
+
+    with span("fetch"):
+        ...
+
+で囲んだ区間の処理時間を記録する。記録は2か所に入る。
+- 実行中の再実行（rerun）のトレース: デバッグパネルのウォーターフォール表示用
+- プロセス全体の集計: ステージごとのp50/p95。ログファイルへの出力や
+  Prometheus形式のテキスト（/metrics）として取り出せる
+"""
+
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ステージごとに保持する直近の計測数
+WINDOW_SIZE = 2048
+# 集計をログファイルに書き出す最小間隔（秒）
+LOG_INTERVAL = 60.0
+
+METRIC_PREFIX = "stock_app"
+
+_local = threading.local()
+
+
+class RerunTrace:
+    """1回の再実行で記録されたスパンの一覧"""
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.spans = []
+        self.depth = 0
+
+    def add(self, name, start, duration, depth):
+        self.spans.append(
+            {
+                "name": name,
+                "start": start - self.started,
+                "duration": duration,
+                "depth": depth,
+            }
+        )
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+
+class StageTimings:
+    """ステージごとの処理時間の集計（プロセス全体で共有）"""
+
+    def __init__(self, window_size=WINDOW_SIZE):
+        self._lock = threading.Lock()
+        self._recent = {}
+        self._count = {}
+        self._sum = {}
+        self.window_size = window_size
+
+    def observe(self, name, seconds):
+        with self._lock:
+            if name not in self._recent:
+                self._recent[name] = deque(maxlen=self.window_size)
+                self._count[name] = 0
+                self._sum[name] = 0.0
+            self._recent[name].append(seconds)
+            self._count[name] += 1
+            self._sum[name] += seconds
+
+    def summary(self):
+        """{ステージ: {count, sum, p50, p95, max}}（p50/p95/maxは直近の計測から）"""
+        with self._lock:
+            snapshot = {
+                name: (sorted(values), self._count[name], self._sum[name])
+                for name, values in self._recent.items()
+            }
+        return {
+            name: {
+                "count": count,
+                "sum": total,
+                "p50": _quantile(values, 0.5),
+                "p95": _quantile(values, 0.95),
+                "max": values[-1],
+            }
+            for name, (values, count, total) in sorted(snapshot.items())
+        }
+
+
+def _quantile(sorted_values, q):
+    index = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+timings = StageTimings()
+
+
+@contextmanager
+def span(name):
+    """区間の処理時間を記録する"""
+    trace = getattr(_local, "trace", None)
+    depth = 0
+    if trace is not None:
+        depth = trace.depth
+        trace.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        timings.observe(name, duration)
+        if trace is not None:
+            trace.depth -= 1
+            trace.add(name, start, duration, depth)
+
+
+def lazy_import(name):
+    """モジュールを必要になった時点で読み込む（初回の読み込み時間を "import.<name>" に記録）"""
+    module = sys.modules.get(name)
+    if module is None:
+        with span(f"import.{name}"):
+            module = importlib.import_module(name)
+    return module
+
+
+def begin_rerun(label="rerun"):
+    """現在のスレッドで新しいトレースを開始する"""
+    _local.trace = RerunTrace(label)
+    return _local.trace
+
+
+def end_rerun():
+    """トレースを終了し、再実行全体の時間を集計に加える"""
+    trace = getattr(_local, "trace", None)
+    _local.trace = None
+    if trace is None:
+        return None
+    timings.observe(trace.label, trace.total)
+    _maybe_write_log()
+    return trace
+
+
+def prometheus_text(extra_counters=None):
+    """集計をPrometheusのテキスト形式で返す
+
+    extra_counters は {メトリクス名: 値} で、キャッシュのカウンタなどを一緒に出す。
+    """
+    name = f"{METRIC_PREFIX}_stage_seconds"
+    lines = [
+        f"# HELP {name} Wall time of app stages (quantiles over recent observations)",
+        f"# TYPE {name} summary",
+    ]
+    for stage, stats in timings.summary().items():
+        label = stage.replace("\\", "\\\\").replace('"', '\\"')
+        lines.append(f'{name}{{stage="{label}",quantile="0.5"}} {stats["p50"]:.6f}')
+        lines.append(f'{name}{{stage="{label}",quantile="0.95"}} {stats["p95"]:.6f}')
+        lines.append(f'{name}_sum{{stage="{label}"}} {stats["sum"]:.6f}')
+        lines.append(f'{name}_count{{stage="{label}"}} {stats["count"]}')
+    for metric, value in (extra_counters or {}).items():
+        lines.append(f"{METRIC_PREFIX}_{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+_log_lock = threading.Lock()
+_last_log = 0.0
+
+
+def _maybe_write_log():
+    # TIMINGS_LOG が設定されていれば、集計をJSON Linesで追記する
+    global _last_log
+    path = os.environ.get("TIMINGS_LOG")
+    if not path:
+        return
+    with _log_lock:
+        now = time.time()
+        if now - _last_log < LOG_INTERVAL:
+            return
+        _last_log = now
+        record = {"time": now, "stages": timings.summary()}
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+_server_lock = threading.Lock()
+_server = None
+
+
+def start_metrics_server(port, extra_counters=None):
+    """/metrics でPrometheus形式の集計を返すHTTPサーバーを起動する（プロセスで1回）
+
+    extra_counters は呼ばれるたびに {メトリクス名: 値} を返す関数。
+    """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                counters = extra_counters() if extra_counters else None
+                body = prometheus_text(counters).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+        threading.Thread(
+            target=_server.serve_forever, name="metrics", daemon=True
+        ).start()
+        return _server
@@ -0,0 +1,362 @@
+"""日中足（分足・時間足）の保持と整列
+
+- BarBuffer: 1銘柄・1間隔の終値を固定長のリングバッファに保持する。
+  時刻はUTCのエポック（ナノ秒, int64）、終値はfloat32で持ち、
+  上限本数を超えたら古いバーから上書きする
+- IntradayStore: 銘柄×間隔ごとのBarBufferをメモリ予算内で管理する
+  （予算を超えたら最も長く使われていないバッファを捨てる）。
+  2回目以降は保持している最終バー以降だけを上流に問い合わせる
+- 取引セッション: 東証の昼休み（11:30〜12:30）や夜間をまたぐリターンは
+  値幅が日中の連動とは性質が異なるため、セッション内のリターンだけを使う
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from alignment import MARKET_SESSIONS
+from analytics import to_returns
+from price_store import slice_period
+
+# 選択できる足の間隔（表示名: yfinanceの表記）
+INTERVAL_OPTIONS = {
+    "日足": "1d",
+    "1時間足": "1h",
+    "15分足": "15m",
+    "5分足": "5m",
+    "1分足": "1m",
+}
+
+# 間隔ごとの分数
+INTERVAL_MINUTES = {"1m": 1, "5m": 5, "15m": 15, "1h": 60}
+
+# 日中足で選べる期間（短い順）と、yfinanceで取得できる最長の期間
+INTRADAY_PERIODS = {
+    "1日": "1d",
+    "5日": "5d",
+    "1ヶ月": "1mo",
+    "3ヶ月": "3mo",
+    "6ヶ月": "6mo",
+    "1年": "1y",
+    "2年": "2y",
+}
+MAX_INTRADAY_PERIOD = {"1m": "5d", "5m": "1mo", "15m": "1mo", "1h": "2y"}
+
+# 1バッファの上限本数（1分足1週間・5分足60日分・1時間足2年分が収まる）
+MAX_BARS = 4096
+# 全バッファの合計サイズの上限（バイト）
+MEMORY_BUDGET = 64 * 2**20
+# 上流に最新バーを問い合わせる最小間隔（秒）
+REFRESH_INTERVAL = 60
+
+
+def intraday_periods(interval):
+    """間隔ごとに選べる期間（表示名: period）"""
+    limit = list(INTRADAY_PERIODS.values()).index(MAX_INTRADAY_PERIOD[interval])
+    return dict(list(INTRADAY_PERIODS.items())[: limit + 1])
+
+
+def _minutes(text):
+    hours, minutes = text.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def session_index(end, n_bars, interval, market="TSE"):
+    """end の日までの営業日について、セッション内のバー開始時刻を n_bars 本作る（合成データ用）"""
+    tz, sessions = MARKET_SESSIONS[market]
+    step = INTERVAL_MINUTES[interval]
+    offsets = np.concatenate(
+        [np.arange(_minutes(start), _minutes(stop), step) for start, stop in sessions]
+    )
+    # 現地の日付で営業日を並べる（タイムゾーン付きなら現地時刻のまま外す）
+    end = pd.Timestamp(end).tz_localize(None).normalize()
+    days = pd.bdate_range(end=end, periods=-(-n_bars // len(offsets)))
+    stamps = (
+        days.values.astype("datetime64[m]")[:, None]
+        + offsets.astype("timedelta64[m]")[None, :]
+    ).ravel()[-n_bars:]
+    return pd.DatetimeIndex(stamps).tz_localize(tz).rename("Datetime")
+
+
+def session_keys(index, market, interval):
+    """各バーが属するセッションの番号と、セッション内のバーかどうかを返す
+
+    市場が分かる場合は取引時間表から（東証は前場・後場を別セッションにする）、
+    分からない場合は間隔の2倍を超える時刻の空きでセッションを区切る。
+    """
+    if market in MARKET_SESSIONS:
+        tz, sessions = MARKET_SESSIONS[market]
+        local = index.tz_convert(tz)
+        minute = local.hour * 60 + local.minute
+        starts = np.array([_minutes(start) for start, _ in sessions])
+        stops = np.array([_minutes(stop) for _, stop in sessions])
+        number = np.searchsorted(starts, minute, side="right") - 1
+        inside = (number >= 0) & (minute < stops[np.maximum(number, 0)])
+        day = local.normalize().as_unit("ns").asi8 // (24 * 3600 * 10**9)
+        return day * len(sessions) + number, inside
+
+    seconds = index.as_unit("ns").asi8 // 10**9
+    gap = np.diff(seconds, prepend=seconds[:1]) > 2 * INTERVAL_MINUTES[interval] * 60
+    return np.cumsum(gap), np.ones(len(index), dtype=bool)
+
+
+def align_intraday(close1, close2, ticker1, ticker2):
+    """2銘柄の日中足を同じ時刻のバーだけに揃える
+
+    取得元によって秒単位のずれがあるため、分単位に切り捨ててから結合する。
+    タイムゾーンは銘柄1に合わせる。
+    """
+    tz = close1.index.tz
+
+    def snap(close):
+        close = close.tz_convert(tz) if tz is not None else close
+        close = close.set_axis(close.index.floor("min"))
+        return close[~close.index.duplicated(keep="last")]
+
+    return pd.DataFrame({ticker1: snap(close1), ticker2: snap(close2)}).dropna()
+
+
+def intraday_returns(prices, market, interval, kind="simple"):
+    """揃えた日中足の終値から、セッション内のリターンだけを返す
+
+    取引時間外のバーは捨て、各セッション最初のバー（昼休み・夜間をまたぐ値動き）
+    のリターンは使わない。kind は analytics.to_returns と同じ（"simple" / "log"）。
+    """
+    keys, inside = session_keys(prices.index, market, interval)
+    prices, keys = prices[inside], keys[inside]
+    returns = to_returns(prices, kind)
+    first = np.r_[True, keys[1:] != keys[:-1]]
+    return returns[~first].dropna()
+
+
+def slice_intraday(data, period):
+    """最終バーを基準に period 分を切り出す（"1d"/"5d" は直近の取引日数）"""
+    if data.empty:
+        return data
+    if period in ("1d", "5d"):
+        dates = data.index.normalize()
+        recent = dates.unique()[-int(period[:-1]) :]
+        return data[dates.isin(recent)]
+    return slice_period(data, period, now=data.index.max())
+
+
+class BarBuffer:
+    """1銘柄・1間隔の終値のリングバッファ（int64のUTCエポックナノ秒 + float32）"""
+
+    def __init__(self, capacity=MAX_BARS, tz="UTC"):
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.closes = np.zeros(capacity, dtype=np.float32)
+        self.tz = tz
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self.timestamps)
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.closes.nbytes
+
+    @property
+    def last_timestamp(self):
+        if self.size == 0:
+            return None
+        return self.timestamps[(self.start + self.size - 1) % self.capacity]
+
+    def extend(self, timestamps, closes):
+        """時刻の昇順のバーを追加する
+
+        最終バーと同じ時刻のバーは値を更新し（形成中のバー）、それより古いバーは無視する。
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        closes = np.asarray(closes, dtype=np.float32)
+        last = self.last_timestamp
+        if last is not None:
+            same = timestamps == last
+            if same.any():
+                position = (self.start + self.size - 1) % self.capacity
+                self.closes[position] = closes[same][-1]
+            newer = timestamps > last
+            timestamps, closes = timestamps[newer], closes[newer]
+
+        # 上限を超える分は古いバーから捨てる
+        timestamps = timestamps[-self.capacity :]
+        closes = closes[-self.capacity :]
+        count = len(timestamps)
+        if count == 0:
+            return
+        positions = (self.start + self.size + np.arange(count)) % self.capacity
+        self.timestamps[positions] = timestamps
+        self.closes[positions] = closes
+        overflow = max(self.size + count - self.capacity, 0)
+        self.start = (self.start + overflow) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def extend_frame(self, data):
+        """yfinanceのhistory()と同じ形のDataFrameから終値を追加する"""
+        if data.empty:
+            return
+        index = data.index
+        if index.tz is None:
+            index = index.tz_localize(self.tz)
+        self.extend(
+            index.tz_convert("UTC").as_unit("ns").asi8, data["Close"].to_numpy()
+        )
+
+    def _frame(self, order):
+        index = pd.DatetimeIndex(
+            pd.to_datetime(self.timestamps[order], utc=True), name="Datetime"
+        ).tz_convert(self.tz)
+        return pd.DataFrame(
+            {"Close": self.closes[order].astype(np.float64)}, index=index
+        )
+
+    def to_frame(self):
+        """保持しているバーを時刻順のDataFrame（Close列、float64）で返す"""
+        return self._frame((self.start + np.arange(self.size)) % self.capacity)
+
+    def since(self, timestamp):
+        """timestamp（UTCエポックナノ秒）より後のバーだけを返す
+
+        リングの前半（start〜末尾）と後半（先頭〜）はそれぞれ昇順なので、
+        二分探索で位置を求め、該当するバーだけを取り出す。
+        """
+        first_end = min(self.start + self.size, self.capacity)
+        second_end = self.start + self.size - first_end
+        first = np.searchsorted(
+            self.timestamps[self.start : first_end], timestamp, side="right"
+        )
+        second = np.searchsorted(self.timestamps[:second_end], timestamp, side="right")
+        order = np.concatenate(
+            [np.arange(self.start + first, first_end), np.arange(second, second_end)]
+        )
+        return self._frame(order)
+
+
+class IntradayStore:
+    """銘柄×間隔ごとのBarBufferを、合計サイズの上限内で保持する
+
+    fetch_history(ticker, period=..., start=..., interval=...) は上流から取得する関数。
+    """
+
+    def __init__(
+        self,
+        fetch_history,
+        max_bars=MAX_BARS,
+        memory_budget=MEMORY_BUDGET,
+        refresh_interval=REFRESH_INTERVAL,
+    ):
+        self.fetch_history = fetch_history
+        self.max_bars = max_bars
+        self.memory_budget = memory_budget
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        # (ticker, interval) -> [BarBuffer, 取得済みの最長期間, 最終取得時刻]
+        # （bars_since で持ち直した分は期間を満たさないため、最長期間は None）
+        self._entries = OrderedDict()
+        self.evictions = 0
+
+    def _covers(self, covered, period):
+        if covered is None:
+            return False
+        periods = list(INTRADAY_PERIODS.values())
+        return periods.index(covered) >= periods.index(period)
+
+    def history(self, ticker, period, interval):
+        """period 分の日中足（Close列）を返す。不足・古い分だけ上流から取得する"""
+        key = (ticker, interval)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        now = time.time()
+        if entry is None or not self._covers(entry[1], period):
+            entry = self._load(ticker, interval, period, period=period)
+            if entry is None:
+                return pd.DataFrame(columns=["Close"])
+        elif now - entry[2] >= self.refresh_interval:
+            self._refresh(ticker, interval, entry, now)
+
+        with self._lock:
+            frame = entry[0].to_frame()
+        return slice_intraday(frame, period)
+
+    def bars_since(self, ticker, interval, timestamp, max_age=None):
+        """保持しているバーのうち timestamp（UTCエポックナノ秒）より後のものを返す
+
+        保持分が max_age 秒（省略時は refresh_interval）より古ければ、先に最終バー以降を
+        上流から取得する。ライブ更新用で、計算量は新しいバーの数に比例する。
+        保持していない（メモリの上限で捨てられた）銘柄は timestamp 以降を取得して持ち直す。
+        """
+        with self._lock:
+            entry = self._entries.get((ticker, interval))
+        if entry is None:
+            start = pd.Timestamp(timestamp, tz="UTC")
+            entry = self._load(ticker, interval, None, start=start)
+            if entry is None:
+                return pd.DataFrame(columns=["Close"])
+            with self._lock:
+                return entry[0].since(timestamp)
+        max_age = self.refresh_interval if max_age is None else max_age
+        now = time.time()
+        if now - entry[2] >= max_age:
+            self._refresh(ticker, interval, entry, now)
+        with self._lock:
+            return entry[0].since(timestamp)
+
+    def _load(self, ticker, interval, covered, **fetch_args):
+        # 上流から取得して新しいバッファに入れる（該当なしなら保持せず None）
+        now = time.time()
+        data = self.fetch_history(ticker, interval=interval, **fetch_args)
+        if data.empty:
+            # 該当なしの空のDataFrameは日時のインデックスとは限らない
+            return None
+        buffer = BarBuffer(self.max_bars, tz=getattr(data.index, "tz", None) or "UTC")
+        buffer.extend_frame(data)
+        entry = [buffer, covered, now]
+        with self._lock:
+            self._entries[(ticker, interval)] = entry
+            self._entries.move_to_end((ticker, interval))
+            self._enforce_budget()
+        return entry
+
+    def _refresh(self, ticker, interval, entry, now):
+        # 最終バー（形成中の可能性がある）以降だけを取得して追記する
+        buffer = entry[0]
+        if not len(buffer):
+            return
+        last = pd.Timestamp(buffer.last_timestamp, tz="UTC")
+        data = self.fetch_history(
+            ticker, start=last.tz_convert(buffer.tz), interval=interval
+        )
+        with self._lock:
+            buffer.extend_frame(data)
+            entry[2] = now
+
+    def _enforce_budget(self):
+        # 直前に使ったバッファは残し、古いものから捨てる
+        while len(self._entries) > 1 and self.nbytes > self.memory_budget:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def nbytes(self):
+        return sum(entry[0].nbytes for entry in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffers": len(self._entries),
+                "bars": sum(len(entry[0]) for entry in self._entries.values()),
+                "bytes": self.nbytes,
+                "budget": self.memory_budget,
+                "evictions": self.evictions,
+            }
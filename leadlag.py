@@ -0,0 +1,168 @@
+"""リードラグ（時差相関）
+
+lag = k の相関は、銘柄1の t 時点と銘柄2の t+k 時点のリターンの相関
+（pandas の x.corr(y.shift(-k)) と同じ。k > 0 なら銘柄1が k 本先行）。
+
+- cross_correlation: -max_lag..max_lag の全ての時差の相関を FFT でまとめて求める。
+  時差ごとに重なる時点の 件数・Σx・Σy・Σxy・Σx²・Σy² を6つの相互相関として
+  1回の FFT で計算するため、全体で O(n log n)。(時点数, ペア数) の配列なら全ペアを一度に計算する
+- rolling_cross_correlation: window 本の窓ごとの時差相関。時差ごとの積の累積和の差をとる
+  （計算量は 時点数×時差の数。窓に欠損があればNaN）
+- lead_lag_pairs: ペア一覧の最大相関の時差をまとめて求める（スクリーナー・バッチ用）
+"""
+
+import numpy as np
+import pandas as pd
+
+# 既定の最大時差（本数）と、選択できる最大時差の上限
+MAX_LAG = 10
+MAX_LAG_LIMIT = 30
+# 相関に必要な重なりの最小件数
+MIN_OVERLAP = 3
+# lead_lag_pairs で一度に FFT にかけるペアの数
+PAIR_BLOCK = 256
+
+
+def _columns(x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    single = x.ndim == 1
+    if single:
+        x, y = x[:, None], y[:, None]
+    return x, y, single
+
+
+def lags_for(max_lag):
+    """時差の配列 -max_lag..max_lag"""
+    return np.arange(-max_lag, max_lag + 1)
+
+
+def _lagged_sums(a, b, max_lag):
+    """Σ_t a[t]·b[t+k]（k = -max_lag..max_lag）を FFT で求める
+
+    a, b は (項目数, 時点数, 列数)。巡回の折り返しが起きないよう
+    時点数 + max_lag 以上の長さにゼロ詰めする。
+    """
+    from scipy.fft import irfft, next_fast_len, rfft
+
+    size = next_fast_len(a.shape[1] + max_lag, real=True)
+    spectrum = np.conj(rfft(a, size, axis=1)) * rfft(b, size, axis=1)
+    full = irfft(spectrum, size, axis=1)
+    # 負の時差は末尾に折り返されている
+    return np.concatenate([full[:, size - max_lag :], full[:, : max_lag + 1]], axis=1)
+
+
+def _correlation_from_sums(count, sx, sy, sxy, sxx, syy):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sxy - sx * sy / count
+        var_x = sxx - sx**2 / count
+        var_y = syy - sy**2 / count
+        corr = cov / np.sqrt(var_x * var_y)
+    corr = np.where((count >= MIN_OVERLAP) & (var_x > 0) & (var_y > 0), corr, np.nan)
+    return np.clip(corr, -1.0, 1.0)
+
+
+def cross_correlation(x, y, max_lag=MAX_LAG):
+    """時差 -max_lag..max_lag の相関 (時差の配列, 相関)
+
+    相関は1ペアなら (時差数,)、(時点数, ペア数) の配列なら (時差数, ペア数)。
+    各時差で両方の値がある時点だけを使う。
+    """
+    x, y, single = _columns(x, y)
+    max_lag = max(0, min(max_lag, len(x) - 1))
+    mask_x = np.isfinite(x)
+    mask_y = np.isfinite(y)
+    # 桁落ちを避けるため全体平均で中心化（相関は平行移動で不変）
+    with np.errstate(invalid="ignore"):
+        xc = np.where(mask_x, x - np.nanmean(x, axis=0), 0.0)
+        yc = np.where(mask_y, y - np.nanmean(y, axis=0), 0.0)
+    mask_x = mask_x.astype(np.float64)
+    mask_y = mask_y.astype(np.float64)
+
+    # 件数, Σx, Σy, Σxy, Σx², Σy²（x側の項 × 時差をずらした y側の項）
+    left = np.stack([mask_x, xc, mask_x, xc, xc**2, mask_x])
+    right = np.stack([mask_y, mask_y, yc, yc, mask_y, yc**2])
+    count, sx, sy, sxy, sxx, syy = _lagged_sums(left, right, max_lag)
+    corr = _correlation_from_sums(np.rint(count), sx, sy, sxy, sxx, syy)
+    return lags_for(max_lag), corr[:, 0] if single else corr
+
+
+def rolling_cross_correlation(x, y, window, max_lag=MAX_LAG):
+    """移動窓ごとの時差相関 (時差の配列, 相関)
+
+    相関は1ペアなら (時点数, 時差数)、(時点数, ペア数) の配列なら (時点数, 時差数, ペア数)。
+    各時点の値はその時点までの window 本の中の組だけを使う（窓に欠損があればNaN）。
+    """
+    x, y, single = _columns(x, y)
+    n, pairs = x.shape
+    lags = lags_for(max_lag)
+    result = np.full((n, len(lags), pairs), np.nan)
+    if n >= window:
+        valid = np.isfinite(x) & np.isfinite(y)
+        with np.errstate(invalid="ignore"):
+            xc = np.where(valid, x - np.nanmean(x, axis=0), 0.0)
+            yc = np.where(valid, y - np.nanmean(y, axis=0), 0.0)
+        ends = np.arange(window - 1, n)
+        for i, lag in enumerate(lags):
+            shift = abs(lag)
+            count = window - shift
+            if count < MIN_OVERLAP:
+                continue
+            # 組を後ろ側の時点 e で並べる（a[e - shift], b[e - shift] が組の値）
+            a = xc[: n - shift] if lag >= 0 else xc[shift:]
+            b = yc[shift:] if lag >= 0 else yc[: n - shift]
+            prefix = np.zeros((5, n - shift + 1, pairs))
+            np.cumsum(np.stack([a, b, a * b, a * a, b * b]), axis=1, out=prefix[:, 1:])
+            # 終点 t の窓に入る組は e が [t - window + 1 + shift, t] のもの
+            sums = prefix[:, ends - shift + 1] - prefix[:, ends - window + 1]
+            result[window - 1 :, i] = _correlation_from_sums(count, *sums)
+        counts = np.concatenate([np.zeros((1, pairs)), np.cumsum(valid, axis=0)])
+        incomplete = counts[window:] - counts[:-window] < window
+        result[window - 1 :] = np.where(
+            incomplete[:, None, :], np.nan, result[window - 1 :]
+        )
+    return lags, result[:, :, 0] if single else result
+
+
+def peak_lag(lags, corr, axis=0):
+    """相関の絶対値が最大の時差と、その時差の相関 (時差, 相関)
+
+    axis は時差の軸。全てNaNのときは (NaN, NaN)。
+    """
+    corr = np.asarray(corr, dtype=np.float64)
+    strength = np.where(np.isfinite(corr), np.abs(corr), -1.0)
+    index = np.expand_dims(np.argmax(strength, axis=axis), axis)
+    peak = np.take_along_axis(corr, index, axis=axis).squeeze(axis)
+    lag = np.where(np.isfinite(peak), np.asarray(lags)[index.squeeze(axis)], np.nan)
+    if np.ndim(peak) == 0:
+        return float(lag), float(peak)
+    return lag, peak
+
+
+def lead_lag_pairs(returns, pairs, max_lag=MAX_LAG):
+    """ペア一覧（ticker1, ticker2 列）の最大相関の時差と相関・同時点の相関を列に加える
+
+    PAIR_BLOCK ペアずつ (時点数, ペア数) の配列にして FFT にまとめてかける。
+    """
+    lags, peaks, same_day = [], [], []
+    for begin in range(0, len(pairs), PAIR_BLOCK):
+        block = pairs.iloc[begin : begin + PAIR_BLOCK]
+        lag_values, corr = cross_correlation(
+            returns[block["ticker1"]].to_numpy(),
+            returns[block["ticker2"]].to_numpy(),
+            max_lag,
+        )
+        lag, peak = peak_lag(lag_values, corr)
+        lags.append(lag)
+        peaks.append(peak)
+        same_day.append(corr[lag_values == 0][0])
+    result = pairs.copy()
+    if len(pairs):
+        result["lead_lag"] = np.concatenate(lags)
+        result["lead_lag_correlation"] = np.concatenate(peaks)
+        result["lag0_correlation"] = np.concatenate(same_day)
+    else:
+        result["lead_lag"] = pd.Series(dtype=np.float64)
+        result["lead_lag_correlation"] = pd.Series(dtype=np.float64)
+        result["lag0_correlation"] = pd.Series(dtype=np.float64)
+    return result
@@ -0,0 +1,105 @@
+"""ライブ更新（日中足）
+
+表示中のペアについて、保持している最終バー以降のバーだけを取り込み、
+相関・移動相関を累積和の延長で更新する。1回の更新の計算量は履歴の長さではなく
+新しいバーの数で決まる。
+
+チャートは点の追記ではなく、毎回直近 LIVE_POINTS 本の図を作り直して送る
+（st.plotly_chart には既存のトレースに点を足す手段が無いため）。送信量は
+履歴の長さによらず一定になる。
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from intraday import align_intraday, intraday_returns
+from rolling import RollingPairStats
+
+# ライブチャートに表示する直近の本数
+LIVE_POINTS = 300
+# ライブ表示の移動相関の窓幅（本数）
+LIVE_WINDOW = 60
+# 選択できる更新間隔（秒）
+POLL_INTERVALS = [5, 10, 30, 60]
+
+
+class LivePair:
+    """ライブ更新中の2銘柄の状態
+
+    prices は揃えた日中足の終値（2列）。最終バーは形成中の可能性があるため取り込まず、
+    次のバーが届いた時点で確定したものとして扱う。
+    """
+
+    def __init__(self, prices, ticker1, ticker2, market, interval, kind="simple"):
+        self.ticker1 = ticker1
+        self.ticker2 = ticker2
+        self.market = market
+        self.interval = interval
+        self.kind = kind
+
+        confirmed = prices.iloc[:-1]
+        returns = intraday_returns(confirmed, market, interval, kind)
+        self.stats = RollingPairStats(returns[ticker1], returns[ticker2])
+        self.last_prices = confirmed.iloc[-1:]
+
+        # チャート用の直近の値（時刻, 終値1, 終値2, 移動相関）
+        tail = confirmed.iloc[-LIVE_POINTS:]
+        rolling = self.stats.latest_correlation(LIVE_WINDOW, LIVE_POINTS)
+        rolling = pd.Series(rolling, index=self.stats.index[-len(rolling) :])
+        rolling = rolling.reindex(tail.index)
+        self.points = deque(
+            zip(tail.index, tail[ticker1], tail[ticker2], rolling),
+            maxlen=LIVE_POINTS,
+        )
+        self.last_update_bars = 0
+
+    @property
+    def last_timestamp(self):
+        """取り込み済みの最終バーの時刻（UTCエポックナノ秒）"""
+        return self.last_prices.index[-1].as_unit("ns").value
+
+    def update(self, new1, new2):
+        """各銘柄の新しいバー（last_timestamp より後）を取り込み、取り込んだ本数を返す
+
+        両銘柄にバーがある時刻のうち、どちらかの最新バーより前のもの（確定済み）だけを使う。
+        """
+        if new1.empty or new2.empty:
+            self.last_update_bars = 0
+            return 0
+        prices = align_intraday(
+            new1["Close"], new2["Close"], self.ticker1, self.ticker2
+        )
+        cutoff = min(new1.index[-1], new2.index[-1])
+        last = self.last_prices.index[-1]
+        prices = prices[(prices.index > last) & (prices.index < cutoff)]
+        if prices.empty:
+            self.last_update_bars = 0
+            return 0
+
+        # 直前のバーを先頭に付けて、新しいバーのリターンだけを計算する
+        combined = pd.concat([self.last_prices, prices])
+        returns = intraday_returns(combined, self.market, self.interval, self.kind)
+        self.stats.append(returns[self.ticker1], returns[self.ticker2])
+        self.last_prices = prices.iloc[-1:]
+
+        rolling = pd.Series(
+            self.stats.latest_correlation(LIVE_WINDOW, len(returns)),
+            index=returns.index,
+        ).reindex(prices.index)
+        self.points.extend(
+            zip(prices.index, prices[self.ticker1], prices[self.ticker2], rolling)
+        )
+        self.last_update_bars = len(prices)
+        return len(prices)
+
+    def chart_data(self):
+        """直近 LIVE_POINTS 本の (時刻, 終値1, 終値2, 移動相関)"""
+        times, close1, close2, rolling = zip(*self.points)
+        return (
+            pd.DatetimeIndex(times),
+            np.array(close1),
+            np.array(close2),
+            np.array(rolling, dtype=np.float64),
+        )
@@ -0,0 +1,462 @@
+"""同時セッションの負荷試験
+
+オフラインの取得元（合成データ）で app.py を streamlit のサーバーとして起動し、
+模擬セッションを WebSocket でつないで、ブラウザと同じ再実行の要求（BackMsg）を送る。
+サーバー1プロセスが何セッションまで再実行の遅延を保てるかを、セッション数ごとに測る。
+
+    python loadtest.py --sessions 1 4 16 --duration 30
+    python loadtest.py --sessions 8 --latency 0.05 --output load.json
+
+- 各セッションは2銘柄比較の画面で、銘柄の変更・分析期間（select_slider）・
+  移動窓サイズのスライダー・データテーブルの表示切り替えをランダムに繰り返す
+  （操作の間に平均 --think 秒の待ち時間を入れる）。フラグメント内のウィジェットは
+  ブラウザと同じくフラグメントだけの再実行を要求する
+- 遅延は要求を送ってから script_finished を受け取るまで（表示内容の送信を含む）。
+  接続直後の初回表示は別に集計する
+- セッション数ごとにサーバーを起動し直し、/proc からサーバーの CPU 使用率と
+  RSS（最大・終了時）を読む（Linux のみ）
+- 取得元は SYNTHETIC_LATENCY で1回の取得ごとに待ち時間を入れられる（--latency）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from instrumentation import lazy_import
+
+websockets = lazy_import("websockets")
+
+DEFAULT_SESSIONS = [1, 4, 16]
+DEFAULT_DURATION = 30.0
+DEFAULT_THINK = 1.0
+# 操作に使う証券コード（合成データなので任意のコードでよい）
+DEFAULT_TICKERS = [
+    "7203.T",
+    "7267.T",
+    "7201.T",
+    "6758.T",
+    "6752.T",
+    "6501.T",
+    "8306.T",
+    "8316.T",
+    "8411.T",
+    "9984.T",
+]
+# 操作の種類と選ばれる重み
+ACTIONS = {"tickers": 1, "period": 2, "window": 3, "tables": 1}
+# サーバーのCPU・メモリを読む間隔（秒）
+SAMPLE_INTERVAL = 0.5
+# 1回の再実行を待つ上限（秒）
+RERUN_TIMEOUT = 120.0
+SERVER_START_TIMEOUT = 60.0
+
+# ウィジェットの要素の種類 → WidgetState に入れる値の欄
+VALUE_FIELDS = {
+    "text_input": "string_value",
+    "text_area": "string_value",
+    "selectbox": "string_value",
+    "radio": "int_value",
+    "checkbox": "bool_value",
+    "slider": "double_array_value",
+}
+
+
+class Widget:
+    """セッションが把握しているウィジェット（要素の内容と現在の値）"""
+
+    def __init__(self, kind, element, fragment_id):
+        self.kind = kind
+        self.id = element.id
+        self.label = element.label
+        self.key = element.id.rsplit("-", 1)[-1]
+        self.fragment_id = fragment_id
+        self.options = list(getattr(element, "options", []))
+        self.min = getattr(element, "min", None)
+        self.max = getattr(element, "max", None)
+        self.step = getattr(element, "step", None)
+        if kind == "selectbox":
+            index = element.value if element.set_value else element.default
+            self.value = self.options[index] if self.options else ""
+        elif kind == "slider":
+            self.value = list(element.value if element.set_value else element.default)
+        else:
+            self.value = element.value if element.set_value else element.default
+
+    def state(self, proto):
+        field = VALUE_FIELDS[self.kind]
+        if field == "double_array_value":
+            proto.double_array_value.data[:] = self.value
+        else:
+            setattr(proto, field, self.value)
+
+
+class Session:
+    """WebSocket でつないだ模擬セッション（ブラウザ1タブ分）"""
+
+    def __init__(self, url, rng):
+        self.url = url
+        self.rng = rng
+        self.widgets = {}
+        self.socket = None
+        self.errors = 0
+        # フラグメントの再実行にはページのハッシュが必要（初回表示の new_session で受け取る）
+        self.page_script_hash = ""
+
+    async def connect(self):
+        self.socket = await websockets.connect(
+            f"{self.url}/_stcore/stream", max_size=None, open_timeout=RERUN_TIMEOUT
+        )
+
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.close()
+
+    def find(self, key=None, label=None):
+        for widget in self.widgets.values():
+            if key is not None and widget.key == key:
+                return widget
+            if label is not None and widget.label.startswith(label):
+                if widget.key == "None":
+                    return widget
+        return None
+
+    async def rerun(self, widget=None):
+        """現在のウィジェットの値で再実行を要求し、終わるまでの秒数を返す
+
+        widget を指定すると、そのウィジェットがフラグメント内ならフラグメントだけを再実行する。
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        message = BackMsg()
+        client = message.rerun_script
+        client.query_string = ""
+        client.page_script_hash = self.page_script_hash
+        if widget is not None and widget.fragment_id:
+            client.fragment_id = widget.fragment_id
+        for known in self.widgets.values():
+            known.state(client.widget_states.widgets.add(id=known.id))
+
+        start = time.perf_counter()
+        await self.socket.send(message.SerializeToString())
+        await asyncio.wait_for(self._receive_until_finished(), RERUN_TIMEOUT)
+        return time.perf_counter() - start
+
+    async def _receive_until_finished(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        while True:
+            message = ForwardMsg()
+            message.ParseFromString(await self.socket.recv())
+            kind = message.WhichOneof("type")
+            if kind == "script_finished":
+                return
+            if kind == "new_session":
+                self.page_script_hash = message.new_session.page_script_hash
+            if kind == "delta" and message.delta.WhichOneof("type") == "new_element":
+                self._observe(message.delta.new_element, message.delta.fragment_id)
+
+    def _observe(self, element, fragment_id):
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.errors += 1
+        if kind not in VALUE_FIELDS:
+            return
+        widget = getattr(element, kind)
+        # 既に知っているウィジェットは、こちらで設定した値を保つ
+        # （フラグメントのIDは全体の再実行ごとに変わるため、最新のものに更新する）
+        if widget.id in self.widgets:
+            self.widgets[widget.id].fragment_id = fragment_id
+        else:
+            self.widgets[widget.id] = Widget(kind, widget, fragment_id)
+
+    def choose_action(self, tickers):
+        """ランダムに1つ操作を選んでウィジェットの値を変え、(操作名, ウィジェット) を返す"""
+        action = self.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+        if action == "tickers":
+            ticker1, ticker2 = self.rng.sample(tickers, 2)
+            self.find(key="ticker1").value = ticker1
+            widget = self.find(key="ticker2")
+            widget.value = ticker2
+            return action, widget
+        if action == "period":
+            widget = self.find(label="分析期間を選択")
+            widget.value = [float(self.rng.randrange(len(widget.options)))]
+            return action, widget
+        if action == "window":
+            widget = self.find(key="rolling_window")
+            steps = int((widget.max - widget.min) // widget.step)
+            widget.value = [widget.min + widget.step * self.rng.randint(0, steps)]
+            return action, widget
+        widget = self.find(
+            key=self.rng.choice(["show_price_table", "show_returns_table"])
+        )
+        widget.value = not widget.value
+        return action, widget
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, latency=0.0, bars=None):
+    """合成データの取得元で app.py のサーバーを起動し、応答するまで待つ"""
+    env = {
+        **os.environ,
+        "DATA_PROVIDER": "synthetic",
+        "SYNTHETIC_LATENCY": str(latency),
+    }
+    if bars:
+        env["SYNTHETIC_BARS"] = str(bars)
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "streamlit",
+            "run",
+            app,
+            "--server.headless=true",
+            f"--server.port={port}",
+            "--server.address=127.0.0.1",
+            "--browser.gatherUsageStats=false",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("サーバーが起動直後に終了しました")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("サーバーが時間内に起動しませんでした")
+
+
+def process_usage(pid):
+    """プロセスの CPU 時間（秒）と RSS（バイト）を /proc から読む"""
+    with open(f"/proc/{pid}/stat") as f:
+        # コマンド名に空白が入りうるため、閉じ括弧より後ろを分割する
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+
+async def _sample_usage(pid, samples, stop):
+    while not stop.is_set():
+        samples.append((time.perf_counter(), *process_usage(pid)))
+        try:
+            await asyncio.wait_for(stop.wait(), SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    samples.append((time.perf_counter(), *process_usage(pid)))
+
+
+def quantile(values, q):
+    """線形補間のパーセンタイル（values は昇順）"""
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _summary(latencies):
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50": quantile(values, 0.50),
+        "p95": quantile(values, 0.95),
+        "p99": quantile(values, 0.99),
+    }
+
+
+async def _drive(session, deadline, think, tickers, records):
+    while True:
+        delay = session.rng.expovariate(1 / think) if think > 0 else 0.0
+        if time.perf_counter() + delay >= deadline:
+            return
+        await asyncio.sleep(delay)
+        action, widget = session.choose_action(tickers)
+        try:
+            records.append((action, await session.rerun(widget)))
+        except TimeoutError:
+            # 応答のない再実行は誤りとして数え、そのセッションの操作を打ち切る
+            session.errors += 1
+            return
+
+
+async def run_step(url, pid, n_sessions, duration, think, tickers, seed):
+    """n_sessions のセッションを duration 秒動かし、遅延・CPU・RSS の集計を返す"""
+    sessions = [Session(url, random.Random(seed * 1000 + i)) for i in range(n_sessions)]
+    samples = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_usage(pid, samples, stop))
+    try:
+        # 接続と初回表示（全セッションが同時にページを開く）
+        await asyncio.gather(*(session.connect() for session in sessions))
+        initial = await asyncio.gather(*(session.rerun() for session in sessions))
+
+        records = [[] for _ in sessions]
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                _drive(session, start + duration, think, tickers, record)
+                for session, record in zip(sessions, records)
+            )
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        stop.set()
+        await sampler
+        await asyncio.gather(*(session.close() for session in sessions))
+
+    latencies = [latency for record in records for _, latency in record]
+    by_action = {}
+    for record in records:
+        for action, latency in record:
+            by_action.setdefault(action, []).append(latency)
+    wall = samples[-1][0] - samples[0][0]
+    return {
+        "sessions": n_sessions,
+        "seconds": elapsed,
+        "reruns": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latency": _summary(latencies),
+        "initial": _summary(initial),
+        "actions": {name: _summary(values) for name, values in by_action.items()},
+        "errors": sum(session.errors for session in sessions),
+        "cpu_percent": 100 * (samples[-1][1] - samples[0][1]) / wall if wall else 0.0,
+        "rss_peak_mib": max(sample[2] for sample in samples) / 2**20,
+        "rss_end_mib": samples[-1][2] / 2**20,
+    }
+
+
+def _ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def format_result(result):
+    latency = result["latency"]
+    return (
+        f"{result['sessions']:>8} {result['reruns']:>7} {result['throughput']:>8.2f} "
+        f"{_ms(latency['p50']):>7} {_ms(latency['p95']):>7} {_ms(latency['p99']):>7} "
+        f"{_ms(result['initial']['p50']):>7} {result['cpu_percent']:>6.0f} "
+        f"{result['rss_peak_mib']:>8.0f} {result['errors']:>6}"
+    )
+
+
+HEADER = (
+    f"{'sessions':>8} {'reruns':>7} {'rerun/s':>8} {'p50ms':>7} {'p95ms':>7} "
+    f"{'p99ms':>7} {'init':>7} {'cpu%':>6} {'rss_MiB':>8} {'errors':>6}"
+)
+
+
+def run(
+    session_counts,
+    duration=DEFAULT_DURATION,
+    think=DEFAULT_THINK,
+    tickers=DEFAULT_TICKERS,
+    latency=0.0,
+    bars=None,
+    seed=0,
+    log=print,
+):
+    results = []
+    log(HEADER)
+    for n_sessions in session_counts:
+        port = _free_port()
+        server = start_server(port, latency=latency, bars=bars)
+        try:
+            result = asyncio.run(
+                run_step(
+                    f"ws://127.0.0.1:{port}",
+                    server.pid,
+                    n_sessions,
+                    duration,
+                    think,
+                    tickers,
+                    seed,
+                )
+            )
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        results.append(result)
+        log(format_result(result))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="同時セッションの負荷試験")
+    parser.add_argument(
+        "--sessions", type=int, nargs="+", default=DEFAULT_SESSIONS, help="セッション数"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=DEFAULT_DURATION,
+        help="セッション数ごとの計測時間（秒）",
+    )
+    parser.add_argument(
+        "--think",
+        type=float,
+        default=DEFAULT_THINK,
+        help="操作の間の平均待ち時間（秒）",
+    )
+    parser.add_argument("--tickers", nargs="+", default=DEFAULT_TICKERS)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="取得1回ごとの待ち時間（秒）"
+    )
+    parser.add_argument("--bars", type=int, help="合成データの本数（SYNTHETIC_BARS）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    args = parser.parse_args(argv)
+
+    if len(args.tickers) < 2:
+        parser.error("--tickers には2つ以上の証券コードが必要です")
+
+    results = run(
+        args.sessions,
+        duration=args.duration,
+        think=args.think,
+        tickers=args.tickers,
+        latency=args.latency,
+        bars=args.bars,
+        seed=args.seed,
+    )
+    if args.output:
+        from benchmark import metadata
+
+        report = {
+            "meta": {
+                **metadata(),
+                "duration": args.duration,
+                "think": args.think,
+                "latency": args.latency,
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
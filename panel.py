@@ -0,0 +1,390 @@
+"""列指向の株価パネル（日付×銘柄の終値をディスクに保持する）
+
+ユニバース全体（数千銘柄×数十年の日足）を銘柄ごとのDataFrameから組み立てると遅く、
+メモリも二重に使う。パネルは1つのディレクトリに次のファイルを置き、numpy.memmap で開く。
+
+    meta.json   銘柄の並び・列の容量・行数・ブロックの行数・dtype
+    dates.i8    取引日（タイムゾーンを外した日付のエポックナノ秒、int64、昇順）
+    closes.bin  終値。BLOCK_ROWS 日ずつのブロックに分け、ブロックの中は列優先
+                （銘柄ごとに BLOCK_ROWS 日分が連続する）。欠損・未使用の列はNaN
+
+- 開くときはマップするだけで読み込まない。銘柄を絞ると、各ブロックのその銘柄の連続した
+  範囲だけを読む（float32 なら1ブロック1銘柄が4KiB＝1ページ）。日付範囲が1ブロックに
+  収まり銘柄を絞らなければ、終値はマップしたファイルの転置ビュー（コピーなし）
+- 日の追加は最後のブロックの空き行への書き込み（足りなければブロックを1つ足す）と、
+  dates.i8 の末尾への書き足しと meta.json の置き換えだけで、既存の行は書き直さない
+- 銘柄の追加は予備の列を使う。予備が尽きたときだけ列の容量を倍にして作り直す
+- 読み手は meta.json の行数までしか見ないため、追記の途中の行は見えない
+
+    python panel.py build tickers.txt --root universe --period max
+    python panel.py update --root universe
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from alignment import trading_dates
+from analytics import build_returns_panel
+from price_store import period_start
+
+# 銘柄の列の最小容量（追加に備えた予備を含む）
+MIN_CAPACITY = 64
+# 1ブロックの日数（約4年。float32 の1銘柄分がちょうど1ページになる）
+BLOCK_ROWS = 1024
+# update で取り直す直近の期間（遡及修正された直近の終値も上書きする）
+UPDATE_PERIOD = "1mo"
+
+
+def _frame(closes):
+    """{銘柄: 終値Series} または DataFrame を、取引日×銘柄のDataFrameにする"""
+    if not isinstance(closes, pd.DataFrame):
+        series = {}
+        for ticker, close in closes.items():
+            close = close.set_axis(trading_dates(close.index))
+            series[ticker] = close[~close.index.duplicated(keep="last")]
+        closes = pd.DataFrame(series)
+    else:
+        closes = closes.set_axis(trading_dates(closes.index))
+        closes = closes[~closes.index.duplicated(keep="last")]
+    return closes.sort_index().dropna(how="all")
+
+
+class PricePanel:
+    """ディスク上の日付×銘柄の終値パネル（root はパネルのディレクトリ）"""
+
+    def __init__(self, root):
+        self.root = root
+        with open(self._path("meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if "block_rows" not in meta:
+            raise ValueError(
+                f"{root} は古い形式（行優先）のパネルです。build で作り直してください"
+            )
+        self.tickers = meta["tickers"]
+        self.capacity = meta["capacity"]
+        self.rows = meta["rows"]
+        self.block_rows = meta["block_rows"]
+        self.dtype = np.dtype(meta["dtype"])
+        self._columns = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self._map()
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _map(self):
+        # 空のファイルはマップできないため、行が無いときは空の配列にする
+        if self.rows == 0:
+            self._dates = np.empty(0, dtype=np.int64)
+            self._closes = np.empty(
+                (0, self.capacity, self.block_rows), dtype=self.dtype
+            )
+            return
+        self._dates = np.memmap(
+            self._path("dates.i8"), dtype=np.int64, mode="r", shape=(self.rows,)
+        )
+        self._closes = self._map_closes("r")
+
+    def _map_closes(self, mode, rows=None):
+        # (ブロック, 列, ブロック内の行) の3次元でマップする
+        blocks = _blocks(self.rows if rows is None else rows, self.block_rows)
+        return np.memmap(
+            self._path("closes.bin"),
+            dtype=self.dtype,
+            mode=mode,
+            shape=(blocks, self.capacity, self.block_rows),
+        )
+
+    @classmethod
+    def create(cls, root, closes, dtype="float32", capacity=None):
+        """終値からパネルを作る（既存のパネルは置き換える）
+
+        一時ディレクトリに書いてから入れ替えるため、作り直している間も読み手は古いパネルを使える。
+        """
+        frame = _frame(closes)
+        capacity = capacity or max(MIN_CAPACITY, 2 * len(frame.columns))
+        tmp_root = f"{root.rstrip(os.sep)}.{os.getpid()}.tmp"
+        os.makedirs(tmp_root, exist_ok=True)
+
+        blocks = _blocks(len(frame), BLOCK_ROWS)
+        values = np.full((blocks * BLOCK_ROWS, capacity), np.nan, dtype=dtype)
+        values[: len(frame), : len(frame.columns)] = frame.to_numpy(dtype=dtype)
+        values = values.reshape(blocks, BLOCK_ROWS, capacity).transpose(0, 2, 1)
+        np.ascontiguousarray(values).tofile(os.path.join(tmp_root, "closes.bin"))
+        frame.index.as_unit("ns").asi8.tofile(os.path.join(tmp_root, "dates.i8"))
+        _write_meta(
+            tmp_root, list(frame.columns), capacity, len(frame), BLOCK_ROWS, dtype
+        )
+
+        if os.path.isdir(root):
+            old_root = f"{root.rstrip(os.sep)}.{os.getpid()}.old"
+            os.replace(root, old_root)
+            os.replace(tmp_root, root)
+            for name in os.listdir(old_root):
+                os.remove(os.path.join(old_root, name))
+            os.rmdir(old_root)
+        else:
+            os.replace(tmp_root, root)
+        return cls(root)
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, ticker):
+        return ticker in self._columns
+
+    @property
+    def dates(self):
+        return pd.DatetimeIndex(self._dates.astype("datetime64[ns]"), name="日付")
+
+    @property
+    def nbytes(self):
+        """マップしているファイルの合計サイズ（メモリに載るのは触れたページだけ）"""
+        return self._dates.nbytes + self._closes.nbytes
+
+    def _rows(self, start, end):
+        # 日付は昇順なので二分探索で行の範囲を求める
+        begin = 0
+        stop = self.rows
+        if start is not None:
+            start = trading_dates([pd.Timestamp(start)])[0].value
+            begin = int(np.searchsorted(self._dates, start, side="left"))
+        if end is not None:
+            end = trading_dates([pd.Timestamp(end)])[0].value
+            stop = int(np.searchsorted(self._dates, end, side="right"))
+        return slice(begin, stop)
+
+    def _gather(self, rows, columns, count):
+        # 行の範囲が掛かるブロックごとに、列ごとに連続した範囲を読んでつなぐ
+        if rows.start >= rows.stop:
+            return np.empty((0, count), dtype=self.dtype)
+        parts = []
+        for block in range(
+            rows.start // self.block_rows, (rows.stop - 1) // self.block_rows + 1
+        ):
+            offset = block * self.block_rows
+            begin = max(rows.start - offset, 0)
+            stop = min(rows.stop - offset, self.block_rows)
+            parts.append(self._closes[block, columns, begin:stop])
+        if len(parts) == 1:
+            return parts[0].T
+        return np.concatenate(parts, axis=1).T
+
+    def values(self, start=None, end=None, tickers=None):
+        """(取引日のint64配列, 終値の2次元配列, 銘柄) を返す
+
+        銘柄を指定すると、読むのはその銘柄の列だけ。銘柄を指定せず日付範囲が
+        1ブロックに収まれば、終値はマップしたファイルの転置ビュー（コピーなし）。
+        """
+        rows = self._rows(start, end)
+        if tickers is None:
+            tickers = self.tickers
+            values = self._gather(rows, slice(0, len(tickers)), len(tickers))
+        else:
+            tickers = [t for t in tickers if t in self._columns]
+            columns = [self._columns[t] for t in tickers]
+            values = self._gather(rows, columns, len(tickers))
+        return self._dates[rows], values, tickers
+
+    def closes(self, start=None, end=None, tickers=None):
+        """日付範囲・銘柄で絞った終値のDataFrame（パネルに無い銘柄は除く）"""
+        dates, values, tickers = self.values(start, end, tickers)
+        index = pd.DatetimeIndex(dates.astype("datetime64[ns]"), name="日付")
+        return pd.DataFrame(values, index=index, columns=tickers, copy=False)
+
+    def returns(self, start=None, end=None, tickers=None, kind="simple"):
+        """日次リターンの表（analytics.build_returns_panel と同じ形。相関行列・スクリーナーにそのまま渡せる）"""
+        return build_returns_panel(self.closes(start, end, tickers), kind)
+
+    def period_start(self, period):
+        """yfinanceのperiod表記の期間の開始日（パネルの最終日を基準にする）"""
+        if self.rows == 0:
+            return None
+        return period_start(period, now=pd.Timestamp(self._dates[-1]))
+
+    def period_returns(self, period, tickers=None, kind="simple"):
+        """yfinanceのperiod表記の期間の日次リターン"""
+        return self.returns(start=self.period_start(period), tickers=tickers, kind=kind)
+
+    def append(self, closes):
+        """終値を追加する（{銘柄: 終値Series} または DataFrame）
+
+        最終日より後の日付は末尾に書き足し、既にある日付は与えられた値だけをその場で上書きする。
+        新しい銘柄は予備の列に入れる。既存の日付の間に無い日付を挟むことはできない。
+        """
+        frame = _frame(closes)
+        if frame.empty:
+            return 0
+        dates = frame.index.as_unit("ns").asi8
+        last = self._dates[-1] if self.rows else np.iinfo(np.int64).min
+        old = dates <= last
+        positions = np.searchsorted(self._dates, dates[old])
+        if old.any() and not np.array_equal(self._dates[positions], dates[old]):
+            raise ValueError(
+                "パネルの既存の日付の間に日付を追加することはできません（create で作り直してください）"
+            )
+
+        new_tickers = [t for t in frame.columns if t not in self._columns]
+        if len(self.tickers) + len(new_tickers) > self.capacity:
+            self._grow(2 * max(self.capacity, len(self.tickers) + len(new_tickers)))
+        tickers = self.tickers + new_tickers
+        columns = [tickers.index(t) for t in frame.columns]
+        values = frame.to_numpy(dtype=self.dtype)
+
+        count = int((~old).sum())
+        if old.any() or count:
+            # ブロックが足りなければファイルを伸ばす（前回の追記が途中で止まっていれば、
+            # meta.json の行数に必要な分で切り詰める。伸ばした分は下で全列を書く）
+            path = self._path("closes.bin")
+            block_bytes = self.capacity * self.block_rows * self.dtype.itemsize
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.truncate(_blocks(self.rows + count, self.block_rows) * block_bytes)
+            closes_map = self._map_closes("r+", self.rows + count)
+            blocks, offsets = np.divmod(positions, self.block_rows)
+            # 既存の行はその列の値だけを書き換える（ファイル全体は書き直さない）
+            updates = values[old]
+            for j, column in enumerate(columns):
+                present = ~np.isnan(updates[:, j])
+                closes_map[blocks[present], column, offsets[present]] = updates[
+                    present, j
+                ]
+            if count:
+                # 新しい行は未使用の列も含めて全列を書く
+                rows = np.full((count, self.capacity), np.nan, dtype=self.dtype)
+                rows[:, columns] = values[~old]
+                blocks, offsets = np.divmod(
+                    np.arange(self.rows, self.rows + count), self.block_rows
+                )
+                closes_map[blocks, :, offsets] = rows
+            closes_map.flush()
+            del closes_map
+        if count:
+            _append_bytes(self._path("dates.i8"), self.rows * 8, dates[~old])
+
+        _write_meta(
+            self.root,
+            tickers,
+            self.capacity,
+            self.rows + count,
+            self.block_rows,
+            self.dtype.name,
+        )
+        self.tickers = tickers
+        self._columns = {ticker: i for i, ticker in enumerate(tickers)}
+        self.rows += count
+        self._map()
+        return count
+
+    def _grow(self, capacity):
+        # 列の容量を増やすときだけ終値のファイルを作り直す（ブロックごとに書き写す）
+        path = self._path("closes.bin")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            for block in self._closes:
+                grown = np.full((capacity, self.block_rows), np.nan, dtype=self.dtype)
+                grown[: self.capacity] = block
+                grown.tofile(f)
+        os.replace(tmp_path, path)
+        _write_meta(
+            self.root,
+            self.tickers,
+            capacity,
+            self.rows,
+            self.block_rows,
+            self.dtype.name,
+        )
+        self.capacity = capacity
+        self._map()
+
+
+def _blocks(rows, block_rows):
+    return -(-rows // block_rows)
+
+
+def _append_bytes(path, offset, values):
+    mode = "r+b" if os.path.exists(path) else "wb"
+    with open(path, mode) as f:
+        f.truncate(offset)
+        f.seek(offset)
+        np.ascontiguousarray(values).tofile(f)
+
+
+def _write_meta(root, tickers, capacity, rows, block_rows, dtype):
+    # データを書き終えてから置き換える（読み手はこの行数までしか読まない）
+    path = os.path.join(root, "meta.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "tickers": list(tickers),
+                "capacity": int(capacity),
+                "rows": int(rows),
+                "block_rows": int(block_rows),
+                "dtype": np.dtype(dtype).name,
+            },
+            f,
+            ensure_ascii=False,
+        )
+    os.replace(tmp_path, path)
+
+
+def open_panel(root):
+    """パネルを開く（無ければNone）"""
+    if not os.path.exists(os.path.join(root, "meta.json")):
+        return None
+    return PricePanel(root)
+
+
+def read_tickers(path):
+    """1行1銘柄（CSVなら先頭列）の一覧を読む"""
+    with open(path, encoding="utf-8") as f:
+        tickers = [line.split(",")[0].strip() for line in f]
+    return list(dict.fromkeys(t for t in tickers if t and t != "ticker"))
+
+
+def main(argv=None):
+    from batch import fetch_closes
+
+    parser = argparse.ArgumentParser(description="株価パネルの作成・更新")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="銘柄一覧からパネルを作る")
+    build.add_argument("tickers", help="銘柄一覧（1行1銘柄）")
+    build.add_argument("--period", default="max", help="取得期間（yfinanceの表記）")
+    build.add_argument("--dtype", choices=["float32", "float64"], default="float32")
+    update = subparsers.add_parser("update", help="全銘柄の直近の日を追加する")
+    update.add_argument("--period", default=UPDATE_PERIOD, help="取り直す期間")
+    for subparser in (build, update):
+        subparser.add_argument("--root", required=True, help="パネルのディレクトリ")
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr, flush=True)
+
+    if args.command == "build":
+        closes, failures = fetch_closes(read_tickers(args.tickers), args.period, log)
+        panel = PricePanel.create(args.root, closes, dtype=args.dtype)
+    else:
+        panel = PricePanel(args.root)
+        last = panel.dates[-1] if len(panel) else None
+        closes, failures = fetch_closes(panel.tickers, args.period, log)
+        frame = _frame(closes)
+        # 遡って追加できないため、パネルの最終日より前で欠けている日は捨てる
+        if last is not None:
+            frame = frame[frame.index.isin(panel.dates) | (frame.index > last)]
+        log(f"{panel.append(frame):,} 日を追加しました")
+
+    for ticker, reason in failures.items():
+        log(f"{ticker}: {reason}")
+    log(
+        f"{args.root}: {len(panel):,} 日 × {len(panel.tickers):,} 銘柄"
+        f"（{panel.nbytes / 2**20:,.1f} MiB）"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
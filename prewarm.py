@@ -0,0 +1,343 @@
+"""ウォッチリストの事前取得（キャッシュの温め）
+
+朝いちばんにペアを開いた人が、株価履歴と銘柄情報（.info）の取得を待たずに済むよう、
+東証の大引け後と寄り付き前に、ウォッチリストの銘柄を裏で取得しておく。
+
+- 株価履歴は毎回取得し直し、アプリと同じ共有キャッシュのキー（fetcher.history_key）で
+  保存する（日足はローカル株価ストアにも保存される）。取引時間外に取得したものは
+  日足が変わらないため、種別のTTLではなくその市場の次の寄り付きまで残す
+- 銘柄情報は共有キャッシュに無いときだけ取得する（TTLは1日）
+- 上流への問い合わせはトークンバケットで毎秒 rate 件（最大 burst 件の連続）に抑える
+- 銘柄の順番はランダムにし、各銘柄の開始時刻を 0〜jitter 秒ずらして散らす
+- 全銘柄の取得後、ペアごとの計算（相関・移動相関の累積和など）を warm_pair で済ませておく。
+  アプリのペア単位のキャッシュ（TTL 10分）が切れても、残っている株価履歴から
+  上流に問い合わせずに計算し直せる
+
+アプリでは PREWARM_WATCHLIST を指定するとサーバープロセス内のスレッドとして動く。
+別のワーカーとして動かす場合（ローカル株価ストアだけを温める）:
+
+    python prewarm.py --watchlist 7203.T 6758.T 9984.T
+    python prewarm.py --watchlist 7203.T 6758.T --once
+"""
+
+import argparse
+import itertools
+import random
+import threading
+import time
+
+import pandas as pd
+
+from alignment import MARKET_SESSIONS, market_of
+from cache import history_kind, shared_cache
+from fetcher import history_key, info_key
+from price_store import PERIOD_ORDER, PriceStore
+from providers import provider_from_env
+
+# 実行する時刻（東京時間、平日のみ）。大引け（15:30）の後と寄り付き（9:00）の前
+# （寄り付き前は、夜間の訂正や権利落ちの調整を取り込むため取得し直す）
+DEFAULT_TIMES = ("15:45", "08:45")
+TIMEZONE = "Asia/Tokyo"
+# 温める期間（アプリの既定の分析期間）
+DEFAULT_PERIODS = ("1y",)
+# 上流への問い合わせの上限（毎秒の件数と、連続して出せる件数）
+DEFAULT_RATE = 1.0
+DEFAULT_BURST = 5
+# 各銘柄の開始時刻をずらす幅（秒）
+DEFAULT_JITTER = 120.0
+# ペアの計算結果を持つキャッシュの件数上限を超えないよう、温めるペア数を抑える
+MAX_PAIRS = 16
+
+
+def parse_times(text):
+    """カンマ区切りの時刻（例: 15:45,08:45）を時刻の一覧にする"""
+    return tuple(t.strip() for t in text.split(",") if t.strip())
+
+
+def parse_pairs(text):
+    """カンマ区切りのペア（例: 7203.T:7267.T,6758.T:6752.T）をペアの一覧にする"""
+    pairs = []
+    for item in text.replace(" ", "").split(","):
+        if item:
+            ticker1, ticker2 = item.split(":")
+            pairs.append((ticker1, ticker2))
+    return pairs
+
+
+def watchlist_pairs(watchlist, max_pairs=MAX_PAIRS):
+    """ウォッチリストの先頭から順に組み合わせたペア（max_pairs 件まで）"""
+    return list(itertools.islice(itertools.combinations(watchlist, 2), max_pairs))
+
+
+def seconds_until_open(now, market):
+    """market の次の寄り付きまでの秒数（取引時間中、または市場が不明なら None）"""
+    if market not in MARKET_SESSIONS:
+        return None
+    tz, sessions = MARKET_SESSIONS[market]
+    now = pd.Timestamp(now)
+    now = now.tz_localize(tz) if now.tz is None else now.tz_convert(tz)
+    day = now.normalize()
+    open_time = pd.Timedelta(f"{sessions[0][0]}:00")
+    close_time = pd.Timedelta(f"{sessions[-1][1]}:00")
+    if now.weekday() < 5 and day + open_time <= now < day + close_time:
+        return None
+    for offset in range(8):
+        date = day + pd.Timedelta(days=offset)
+        if date.weekday() < 5 and date + open_time > now:
+            return (date + open_time - now).total_seconds()
+
+
+def next_run(now, times=DEFAULT_TIMES, tz=TIMEZONE):
+    """now より後で最初の実行時刻（平日の times のいずれか）"""
+    now = pd.Timestamp(now)
+    now = now.tz_localize(tz) if now.tz is None else now.tz_convert(tz)
+    day = now.normalize()
+    for offset in range(8):
+        date = day + pd.Timedelta(days=offset)
+        if date.weekday() >= 5:
+            continue
+        candidates = sorted(date + pd.Timedelta(f"{t}:00") for t in times)
+        for candidate in candidates:
+            if candidate > now:
+                return candidate
+    raise ValueError("実行時刻が指定されていません")
+
+
+class RateLimiter:
+    """トークンバケット（毎秒 rate 件、最大 burst 件まで貯まる）。複数スレッドから使える"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop=None):
+        """トークンを1つ使う。足りなければ貯まるまで待つ（stop がセットされたら False）"""
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if stop is None:
+                time.sleep(wait)
+            elif stop.wait(wait):
+                return False
+
+
+class Prewarmer:
+    """ウォッチリストを決まった時刻に取得してキャッシュを温めるスケジューラー
+
+    history_fn(ticker, period) と info_fn(ticker) は上流（またはローカル株価ストア）から
+    取得する関数で、レート制限をかけて呼ばれる（info_fn は cache に無いときだけ）。
+    warm_pair(ticker1, ticker2, period) はペアの計算を済ませる関数（省略可）。
+    """
+
+    def __init__(
+        self,
+        watchlist,
+        history_fn,
+        info_fn=None,
+        warm_pair=None,
+        pairs=None,
+        periods=DEFAULT_PERIODS,
+        times=DEFAULT_TIMES,
+        rate=DEFAULT_RATE,
+        burst=DEFAULT_BURST,
+        jitter=DEFAULT_JITTER,
+        seed=None,
+        log=print,
+        cache=shared_cache,
+    ):
+        self.watchlist = list(dict.fromkeys(watchlist))
+        self.pairs = watchlist_pairs(self.watchlist) if pairs is None else list(pairs)
+        # 長い期間から取得し、短い期間はローカル株価ストアから切り出させる
+        self.periods = tuple(sorted(periods, key=PERIOD_ORDER.index, reverse=True))
+        self.times = tuple(times)
+        self.jitter = jitter
+        self.warm_pair = warm_pair
+        self.cache = cache
+        self.limiter = RateLimiter(rate, burst)
+        self.log = log
+        self._rng = random.Random(seed)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._stats = {
+            "runs": 0,
+            "last_run": None,
+            "last_seconds": None,
+            "failures": [],
+            "next_run": None,
+        }
+        self.history_fn = self._limited(history_fn)
+        self.info_fn = None if info_fn is None else self._limited(info_fn)
+
+    def _limited(self, fn):
+        # 上流に問い合わせるときだけトークンを使う
+        def limited(*args, **kwargs):
+            if not self.limiter.acquire(self._stop):
+                raise InterruptedError("事前取得を中止しました")
+            with self._lock:
+                self._requests += 1
+            return fn(*args, **kwargs)
+
+        return limited
+
+    def _warm_history(self, ticker, period):
+        # 取得し直して共有キャッシュに置く。取引時間外なら次の寄り付きまで残す
+        data = self.history_fn(ticker, period)
+        ttl = seconds_until_open(pd.Timestamp.now(tz=TIMEZONE), market_of(ticker))
+        if ttl is not None:
+            ttl = max(ttl, self.cache.ttls[history_kind("1d")])
+        self.cache.put(history_key(ticker, period), data, ttl=ttl)
+
+    def run_once(self):
+        """全銘柄・全期間を取得し、ペアの計算を済ませる。失敗した (項目, エラー) の一覧を返す"""
+        start = time.monotonic()
+        failures = []
+        order = self._rng.sample(self.watchlist, len(self.watchlist))
+        # 各銘柄の開始時刻を 0〜jitter 秒の一様乱数でずらす
+        offsets = sorted(self._rng.uniform(0, self.jitter) for _ in order)
+        for ticker, offset in zip(order, offsets):
+            if self._stop.wait(max(0.0, start + offset - time.monotonic())):
+                break
+            for period in self.periods:
+                try:
+                    self._warm_history(ticker, period)
+                except Exception as e:
+                    failures.append((f"{ticker} {period}", repr(e)))
+            if self.info_fn is not None:
+                try:
+                    self.cache.get_or_fetch(
+                        info_key(ticker), lambda: self.info_fn(ticker)
+                    )
+                except Exception as e:
+                    failures.append((f"{ticker} info", repr(e)))
+
+        if self.warm_pair is not None:
+            for (ticker1, ticker2), period in itertools.product(
+                self.pairs, self.periods
+            ):
+                if self._stop.is_set():
+                    break
+                try:
+                    self.warm_pair(ticker1, ticker2, period)
+                except Exception as e:
+                    failures.append((f"{ticker1}:{ticker2} {period}", repr(e)))
+
+        seconds = time.monotonic() - start
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["last_run"] = pd.Timestamp.now(tz=TIMEZONE).isoformat()
+            self._stats["last_seconds"] = round(seconds, 1)
+            self._stats["failures"] = failures
+        self.log(
+            f"事前取得: {len(self.watchlist)}銘柄・{len(self.pairs)}ペア "
+            f"{seconds:.1f}秒（失敗 {len(failures)}件）"
+        )
+        return failures
+
+    def _loop(self):
+        while not self._stop.is_set():
+            scheduled = next_run(pd.Timestamp.now(tz=TIMEZONE), self.times)
+            with self._lock:
+                self._stats["next_run"] = scheduled.isoformat()
+            wait = (scheduled - pd.Timestamp.now(tz=TIMEZONE)).total_seconds()
+            if self._stop.wait(max(0.0, wait)):
+                return
+            try:
+                self.run_once()
+            except Exception as e:
+                self.log(f"事前取得に失敗しました: {e!r}")
+
+    def start(self, immediately=False):
+        """スケジューラーのスレッドを起動する（immediately なら起動時に1回実行する）"""
+        if self._thread is not None:
+            return self
+
+        def target():
+            if immediately:
+                self.run_once()
+            self._loop()
+
+        self._thread = threading.Thread(target=target, name="prewarm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        """監視用の状態（実行回数・最終実行・次回予定・上流への問い合わせ件数など）"""
+        with self._lock:
+            return {
+                **self._stats,
+                "tickers": len(self.watchlist),
+                "pairs": len(self.pairs),
+                "requests": self._requests,
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ウォッチリストの事前取得")
+    parser.add_argument("--watchlist", nargs="+", required=True, help="証券コード")
+    parser.add_argument(
+        "--periods", nargs="+", default=list(DEFAULT_PERIODS), help="取得期間"
+    )
+    parser.add_argument(
+        "--times",
+        type=parse_times,
+        default=DEFAULT_TIMES,
+        help="実行時刻（東京時間、カンマ区切り）",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=DEFAULT_RATE, help="上流への毎秒の問い合わせ数"
+    )
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST)
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER)
+    parser.add_argument("--once", action="store_true", help="1回だけ実行して終了する")
+    args = parser.parse_args(argv)
+
+    # 別プロセスではメモリ上のキャッシュを共有できないため、ローカル株価ストアだけを温める
+    provider = provider_from_env()
+    history_fn = provider.history
+    if provider.remote:
+        history_fn = PriceStore(provider.history).history
+    prewarmer = Prewarmer(
+        args.watchlist,
+        history_fn,
+        periods=args.periods,
+        times=args.times,
+        rate=args.rate,
+        burst=args.burst,
+        jitter=args.jitter,
+    )
+    if args.once:
+        failures = prewarmer.run_once()
+        for item, error in failures:
+            print(f"  {item}: {error}")
+        return 1 if failures else 0
+
+    prewarmer.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        prewarmer.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,182 @@
+"""ローカル株価ストア
+
+銘柄ごとの日足をParquetファイルとしてディスクに保存し、
+期間スライスはディスクから返す。上流（yfinance）へは保存済みの
+最終日以降のバーだけを問い合わせる。
+上流はネットワーク越しの取得元（providers.YFinanceProvider など）を想定する。
+"""
+
+import os
+import re
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_STORE_DIR = os.environ.get(
+    "PRICE_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".price_store"),
+)
+
+# 上流に最新バーを問い合わせる最小間隔（秒）
+DEFAULT_REFRESH_INTERVAL = 15 * 60
+
+# yfinanceのperiod指定を、短い順に並べたもの
+PERIOD_ORDER = ["1mo", "3mo", "6mo", "1y", "2y", "5y", "max"]
+
+PERIOD_OFFSETS = {
+    "1mo": pd.DateOffset(months=1),
+    "3mo": pd.DateOffset(months=3),
+    "6mo": pd.DateOffset(months=6),
+    "1y": pd.DateOffset(years=1),
+    "2y": pd.DateOffset(years=2),
+    "5y": pd.DateOffset(years=5),
+    "max": None,
+}
+
+# 分割・配当による遡及修正を検出する際の許容誤差（相対）
+ADJUSTMENT_TOLERANCE = 1e-6
+
+_COVERAGE_KEY = b"price_store.period"
+
+
+def period_start(period, now=None, tz=None):
+    """periodが指す期間の開始時刻を返す（"max"はNone）"""
+    offset = PERIOD_OFFSETS[period]
+    if offset is None:
+        return None
+    now = pd.Timestamp.now(tz=tz) if now is None else now
+    return now.normalize() - offset
+
+
+def slice_period(data, period, now=None):
+    """保存済みの全履歴からperiod分を切り出す"""
+    start = period_start(period, now=now, tz=data.index.tz)
+    if start is None or data.empty:
+        return data
+    return data[data.index >= start]
+
+
+class PriceStore:
+    """銘柄ごとの日足をParquetで保持するストア
+
+    fetch_history(ticker, period=..., start=...) は上流から日足を取得する関数。
+    """
+
+    def __init__(
+        self,
+        fetch_history,
+        root=DEFAULT_STORE_DIR,
+        refresh_interval=DEFAULT_REFRESH_INTERVAL,
+    ):
+        self.root = root
+        self.fetch_history = fetch_history
+        self.refresh_interval = refresh_interval
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, ticker):
+        safe = re.sub(r"[^0-9A-Za-z._^=-]", "_", ticker)
+        return os.path.join(self.root, f"{safe}.parquet")
+
+    def read(self, ticker):
+        """保存済みデータとカバー済みperiodを返す（未保存なら(None, None)）"""
+        path = self.path_for(ticker)
+        if not os.path.exists(path):
+            return None, None
+        table = pq.read_table(path)
+        metadata = table.schema.metadata or {}
+        coverage = metadata.get(_COVERAGE_KEY, b"max").decode()
+        return table.to_pandas(), coverage
+
+    def write(self, ticker, data, coverage):
+        """一時ファイルに書いてから置き換える（同時書き込み対策）"""
+        table = pa.Table.from_pandas(data, preserve_index=True)
+        metadata = dict(table.schema.metadata or {})
+        metadata[_COVERAGE_KEY] = coverage.encode()
+        table = table.replace_schema_metadata(metadata)
+
+        # 同じプロセスの複数スレッド（セッション・取得スレッド・事前取得）が同じ銘柄を
+        # 書くこともあるため、一時ファイルは書き込みごとに別の名前にする
+        path = self.path_for(ticker)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path),
+            prefix=f".{os.path.basename(path)}.",
+            suffix=".tmp",
+        )
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def is_fresh(self, ticker):
+        """最後に上流を確認してからrefresh_interval以内か"""
+        path = self.path_for(ticker)
+        if not os.path.exists(path):
+            return False
+        return time.time() - os.path.getmtime(path) < self.refresh_interval
+
+    def history(self, ticker, period):
+        """period分の日足を返す。必要な場合だけ上流に問い合わせる"""
+        stored, coverage = self.read(ticker)
+
+        if stored is None or PERIOD_ORDER.index(coverage) < PERIOD_ORDER.index(period):
+            # 未保存、または保存済みより長い期間が要求された場合は全期間を取得
+            data = self.fetch_history(ticker, period=period)
+            if data.empty:
+                return data
+            if stored is not None:
+                data = _merge(stored, data)
+            self.write(ticker, data, period)
+            return slice_period(data, period)
+
+        if not self.is_fresh(ticker):
+            stored = self.update(ticker, stored, coverage)
+
+        return slice_period(stored, period)
+
+    def update(self, ticker, stored, coverage):
+        """保存済みの最終日以降のバーだけを取得して追記する"""
+        if stored.empty:
+            return stored
+
+        last = stored.index.max()
+        # 最終バーは取引中の暫定値の可能性があるため、最終日から取り直す
+        new = self.fetch_history(ticker, start=last.strftime("%Y-%m-%d"))
+        if new.empty:
+            os.utime(self.path_for(ticker))
+            return stored
+
+        if last in new.index and _was_adjusted(stored.loc[last], new.loc[last]):
+            # 分割・配当で過去の調整後価格が変わったため全期間を取り直す
+            data = self.fetch_history(ticker, period=coverage)
+            if data.empty:
+                return stored
+        else:
+            data = _merge(stored, new)
+
+        self.write(ticker, data, coverage)
+        return data
+
+
+def _merge(stored, new):
+    """新しいバーを優先して結合する"""
+    data = pd.concat([stored[~stored.index.isin(new.index)], new])
+    return data.sort_index()
+
+
+def _was_adjusted(stored_bar, new_bar):
+    """重複したバーの始値が変わっていれば遡及修正があったとみなす
+
+    取引中の当日バーは終値・高値・安値が動くが、始値は確定しているため
+    始値の差で分割・配当による調整を判定する。
+    """
+    old_open = stored_bar["Open"]
+    new_open = new_bar["Open"]
+    if pd.isna(old_open) or pd.isna(new_open):
+        return False
+    return abs(new_open - old_open) > ADJUSTMENT_TOLERANCE * abs(old_open)
@@ -0,0 +1,281 @@
+"""株価データの取得元（プロバイダー）
+
+アプリ・計算処理は DataProvider のインターフェース（history / info /
+batch_history）だけを使い、取得元を差し替えられるようにする。
+
+- YFinanceProvider: yfinance（既定）
+- FixtureProvider: 記録済みのCSV/Parquetファイルを読む（オフライン）
+- SyntheticProvider: 相関を持つランダムウォークを生成する（オフライン・再現可能）
+
+アプリでは環境変数 DATA_PROVIDER で切り替える（provider_from_env を参照）。
+"""
+
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import lazy_import
+from intraday import INTERVAL_MINUTES, session_index, slice_intraday
+from price_store import slice_period
+
+HISTORY_COLUMNS = [
+    "Open",
+    "High",
+    "Low",
+    "Close",
+    "Volume",
+    "Dividends",
+    "Stock Splits",
+]
+
+
+class DataProvider:
+    """株価データ取得元の基底クラス"""
+
+    # ネットワーク越しに取得するか（ローカル株価ストアを挟むかの判断に使う）
+    remote = False
+
+    def history(self, ticker, period=None, start=None, interval="1d"):
+        """株価履歴（yfinanceのhistory()と同じ列構成のDataFrame）を返す
+
+        periodかstartのどちらかを指定する。該当が無ければ空のDataFrame。
+        """
+        raise NotImplementedError
+
+    def info(self, ticker):
+        """銘柄情報の辞書を返す（少なくとも "shortName" を含むことが望ましい）"""
+        return {"shortName": ticker}
+
+    def batch_history(self, tickers, period=None, start=None, interval="1d"):
+        """複数銘柄の株価履歴を {ticker: DataFrame} で返す"""
+        return {
+            ticker: self.history(ticker, period=period, start=start, interval=interval)
+            for ticker in dict.fromkeys(tickers)
+        }
+
+
+class YFinanceProvider(DataProvider):
+    """yfinanceから取得するプロバイダー（yfinanceは最初の取得時に読み込む）"""
+
+    remote = True
+
+    def history(self, ticker, period=None, start=None, interval="1d"):
+        stock = lazy_import("yfinance").Ticker(ticker)
+        if start is not None:
+            return stock.history(start=start, interval=interval)
+        return stock.history(period=period, interval=interval)
+
+    def info(self, ticker):
+        return lazy_import("yfinance").Ticker(ticker).info
+
+    def batch_history(self, tickers, period=None, start=None, interval="1d"):
+        tickers = list(dict.fromkeys(tickers))
+        data = lazy_import("yfinance").download(
+            tickers,
+            period=None if start is not None else period,
+            start=start,
+            interval=interval,
+            group_by="ticker",
+            auto_adjust=True,
+            actions=True,
+            threads=True,
+            progress=False,
+        )
+        histories = {}
+        for ticker in tickers:
+            if data.empty or ticker not in data.columns.get_level_values(0):
+                histories[ticker] = pd.DataFrame(columns=HISTORY_COLUMNS)
+                continue
+            frame = data[ticker].dropna(how="all")
+            histories[ticker] = frame[[c for c in HISTORY_COLUMNS if c in frame]]
+        return histories
+
+
+def _slice(data, period=None, start=None):
+    """期間の切り出し。オフラインのデータは最終バーを基準にする（実行日に依存しない）"""
+    if data.empty:
+        return data
+    if start is not None:
+        start = pd.Timestamp(start)
+        if start.tzinfo is None and data.index.tz is not None:
+            start = start.tz_localize(data.index.tz)
+        return data[data.index >= start]
+    if period is None:
+        return data
+    return slice_period(data, period, now=data.index.max())
+
+
+class FixtureProvider(DataProvider):
+    """記録済みファイルを読むプロバイダー
+
+    root/<ticker>.parquet または root/<ticker>.csv を日足の株価履歴として読む。
+    日中足は間隔ごとのファイル root/<ticker>.<interval>.parquet（または .csv）を読み、
+    無ければ空のDataFrameを返す（日足で代用しない）。
+    root/info.json（{ticker: 銘柄情報}）があれば銘柄情報として使う。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._frames = {}
+        info_path = os.path.join(root, "info.json")
+        if os.path.exists(info_path):
+            with open(info_path, encoding="utf-8") as f:
+                self._info = json.load(f)
+        else:
+            self._info = {}
+
+    def _load(self, ticker, interval="1d"):
+        key = (ticker, interval)
+        if key not in self._frames:
+            name = (
+                ticker if interval not in INTERVAL_MINUTES else f"{ticker}.{interval}"
+            )
+            parquet_path = os.path.join(self.root, f"{name}.parquet")
+            csv_path = os.path.join(self.root, f"{name}.csv")
+            if os.path.exists(parquet_path):
+                data = pd.read_parquet(parquet_path)
+            elif os.path.exists(csv_path):
+                data = pd.read_csv(csv_path, index_col=0, parse_dates=True)
+            else:
+                data = pd.DataFrame(columns=HISTORY_COLUMNS)
+            self._frames[key] = data.sort_index()
+        return self._frames[key]
+
+    def history(self, ticker, period=None, start=None, interval="1d"):
+        data = self._load(ticker, interval)
+        if interval in INTERVAL_MINUTES and start is None and period:
+            return slice_intraday(data, period)
+        return _slice(data, period=period, start=start)
+
+    def info(self, ticker):
+        return self._info.get(ticker, {"shortName": ticker})
+
+
+def record_fixtures(provider, tickers, root, period="max", interval="1d"):
+    """providerから取得したデータをFixtureProvider用のファイルとして保存する"""
+    os.makedirs(root, exist_ok=True)
+    info = {}
+    suffix = f".{interval}" if interval in INTERVAL_MINUTES else ""
+    histories = provider.batch_history(tickers, period=period, interval=interval)
+    for ticker, data in histories.items():
+        data.to_parquet(os.path.join(root, f"{ticker}{suffix}.parquet"))
+        info[ticker] = {"shortName": provider.info(ticker).get("shortName", ticker)}
+    with open(os.path.join(root, "info.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+
+
+class SyntheticProvider(DataProvider):
+    """相関を持つランダムウォークを生成するプロバイダー
+
+    全銘柄に共通のマーケットファクターと銘柄固有のノイズからリターンを作る。
+    銘柄ごとのファクター感応度は証券コードから決まるため、
+    同じ seed・証券コードなら常に同じ系列になる。
+    """
+
+    def __init__(
+        self,
+        n_bars=5000,
+        seed=0,
+        end="2024-12-30",
+        tz="Asia/Tokyo",
+        freq="B",
+        market_volatility=0.01,
+        idiosyncratic_volatility=0.015,
+        latency=0.0,
+    ):
+        self.n_bars = n_bars
+        # 1回の取得ごとに待つ秒数（上流の応答時間の模擬。負荷試験用）
+        self.latency = latency
+        self.seed = seed
+        # 営業日（"B"）以外に分足（"min"）なども指定できる（100万本規模の系列用）
+        self.index = pd.date_range(
+            end=end, periods=n_bars, freq=freq, tz=tz, name="Date"
+        )
+        self.market_volatility = market_volatility
+        self.idiosyncratic_volatility = idiosyncratic_volatility
+        self._intraday_index = {}
+        market_rng = np.random.default_rng(seed)
+        self._market = market_rng.normal(0.0, market_volatility, n_bars)
+
+    def _rng(self, ticker, stream):
+        return np.random.default_rng([self.seed, zlib.crc32(ticker.encode()), stream])
+
+    def returns(self, ticker):
+        """銘柄の日次対数リターン（全期間）"""
+        rng = self._rng(ticker, 0)
+        # ファクター感応度は -0.5〜1.5（負の相関を持つ銘柄も混ざる）
+        loading = rng.uniform(-0.5, 1.5)
+        noise = rng.normal(0.0, self.idiosyncratic_volatility, self.n_bars)
+        return loading * self._market + noise
+
+    def returns_panel(self, tickers):
+        """複数銘柄の日次対数リターンを (バー数 × 銘柄数) の配列で返す"""
+        return np.column_stack([self.returns(t) for t in tickers])
+
+    def _index_for(self, interval):
+        # 日中足は東証の取引時間内の時刻にする（最終バーは end の日の大引け前）
+        if interval not in INTERVAL_MINUTES:
+            return self.index
+        if interval not in self._intraday_index:
+            self._intraday_index[interval] = session_index(
+                self.index[-1], self.n_bars, interval, "TSE"
+            )
+        return self._intraday_index[interval]
+
+    def history(self, ticker, period=None, start=None, interval="1d"):
+        if self.latency:
+            time.sleep(self.latency)
+        rng = self._rng(ticker, 1)
+        close = rng.uniform(500, 5000) * np.exp(np.cumsum(self.returns(ticker)))
+        data = pd.DataFrame(
+            {
+                "Open": close,
+                "High": close,
+                "Low": close,
+                "Close": close,
+                "Volume": np.full(self.n_bars, 1_000_000, dtype=np.int64),
+                "Dividends": 0.0,
+                "Stock Splits": 0.0,
+            },
+            index=self._index_for(interval),
+        )
+        if interval in INTERVAL_MINUTES:
+            if start is not None:
+                return _slice(data, start=start)
+            return slice_intraday(data, period) if period else data
+        return _slice(data, period=period, start=start)
+
+    def info(self, ticker):
+        if self.latency:
+            time.sleep(self.latency)
+        return {"shortName": f"Synthetic {ticker}"}
+
+
+def synthetic_universe(n_tickers):
+    """合成データ用の証券コード一覧"""
+    return [f"SYN{i:04d}.T" for i in range(n_tickers)]
+
+
+def provider_from_env(environ=os.environ):
+    """環境変数から取得元を決める
+
+    DATA_PROVIDER=yfinance（既定）| fixture | synthetic
+    fixture の場合は FIXTURE_DIR、synthetic の場合は SYNTHETIC_BARS /
+    SYNTHETIC_SEED / SYNTHETIC_LATENCY（1回の取得の待ち秒数）で設定する。
+    """
+    name = environ.get("DATA_PROVIDER", "yfinance")
+    if name == "yfinance":
+        return YFinanceProvider()
+    if name == "fixture":
+        return FixtureProvider(environ.get("FIXTURE_DIR", "fixtures"))
+    if name == "synthetic":
+        return SyntheticProvider(
+            n_bars=int(environ.get("SYNTHETIC_BARS", 5000)),
+            seed=int(environ.get("SYNTHETIC_SEED", 0)),
+            latency=float(environ.get("SYNTHETIC_LATENCY", 0.0)),
+        )
+    raise ValueError(f"不明なDATA_PROVIDERです: {name}")
@@ -0,0 +1,300 @@
+"""リターン散布図の回帰直線
+
+- ols_from_sums: 最小二乗法。n, Σx, Σy, Σxy, Σx², Σy² の十分統計量から閉形式で求める
+  （相関係数と同じ累積和を使うため、データの再走査もstatsmodelsも不要）
+- huber_fit: Huber損失によるロバスト回帰（IRLS。各反復は重み付き和の閉形式）
+- theil_sen_fit: Theil-Sen推定（全ペアの傾きの中央値）。傾きを列挙せず、
+  「ある値より小さい傾きの数」を転倒数として O(n log n) で数えて探索する
+
+いずれも同じキーの辞書（slope, intercept, r_squared, slope_se, intercept_se, n）を返す。
+標準誤差を閉形式で出せない推定法では slope_se / intercept_se は None。
+"""
+
+import numpy as np
+
+# Huber損失の閾値（正規分布のもとで効率95%になる値。statsmodelsの既定と同じ）
+HUBER_T = 1.345
+# Theil-Senの探索開始区間を決めるために抽出するペア数
+THEIL_SEN_SAMPLE = 20_000
+
+
+def ols_from_sums(n, sx, sy, sxy, sxx, syy, x_offset=0.0, y_offset=0.0):
+    """十分統計量から最小二乗法の回帰直線 y = intercept + slope * x を求める
+
+    x_offset / y_offset は和を取る前に x, y から引いた値（中心化した場合の平均）。
+    slope はxに対するyのベータと同じ。
+    """
+    x_mean = sx / n
+    y_mean = sy / n
+    # 平均まわりの平方和・積和
+    s_xx = sxx - sx * x_mean
+    s_yy = syy - sy * y_mean
+    s_xy = sxy - sx * y_mean
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = s_xy / s_xx
+        intercept = (y_mean + y_offset) - slope * (x_mean + x_offset)
+        r_squared = s_xy**2 / (s_xx * s_yy)
+        # 残差分散（自由度 n-2）から傾き・切片の標準誤差
+        residual = max(s_yy - slope * s_xy, 0.0) / (n - 2)
+        slope_se = np.sqrt(residual / s_xx)
+        intercept_se = np.sqrt(residual * (1 / n + (x_mean + x_offset) ** 2 / s_xx))
+
+    return {
+        "slope": float(slope),
+        "intercept": float(intercept),
+        "r_squared": float(r_squared),
+        "slope_se": float(slope_se),
+        "intercept_se": float(intercept_se),
+        "n": int(n),
+    }
+
+
+def _finite_pairs(x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.isfinite(x) & np.isfinite(y)
+    return x[valid], y[valid]
+
+
+def _r_squared(x, y, slope, intercept):
+    residual = y - (intercept + slope * x)
+    total = np.sum((y - y.mean()) ** 2)
+    if total == 0:
+        return float("nan")
+    return float(1 - np.sum(residual**2) / total)
+
+
+def ols_fit(x, y):
+    """配列から最小二乗法の回帰直線を求める"""
+    x, y = _finite_pairs(x, y)
+    x_offset, y_offset = x.mean(), y.mean()
+    xc, yc = x - x_offset, y - y_offset
+    return ols_from_sums(
+        len(x),
+        xc.sum(),
+        yc.sum(),
+        xc @ yc,
+        xc @ xc,
+        yc @ yc,
+        x_offset=x_offset,
+        y_offset=y_offset,
+    )
+
+
+def huber_fit(x, y, t=HUBER_T, max_iter=50, tol=1e-8):
+    """Huber損失によるロバスト回帰（反復重み付き最小二乗法）
+
+    尺度は各反復で残差のMAD（0まわり・正規分布換算）から推定する（statsmodelsのRLMと同じ）。
+    """
+    x, y = _finite_pairs(x, y)
+    fit = ols_fit(x, y)
+    slope, intercept = fit["slope"], fit["intercept"]
+
+    for _ in range(max_iter):
+        residual = y - (intercept + slope * x)
+        scale = np.median(np.abs(residual)) / 0.6745
+        if not scale > 0:
+            break
+        # |残差| が t×尺度 以内なら重み1、超えた分は反比例で小さくする
+        weight = np.minimum(1.0, t * scale / np.maximum(np.abs(residual), 1e-300))
+
+        sw = weight.sum()
+        x_mean = weight @ x / sw
+        y_mean = weight @ y / sw
+        xc = x - x_mean
+        new_slope = (weight * xc) @ (y - y_mean) / ((weight * xc) @ xc)
+        new_intercept = y_mean - new_slope * x_mean
+
+        converged = abs(new_slope - slope) <= tol * max(1.0, abs(slope)) and abs(
+            new_intercept - intercept
+        ) <= tol * max(1.0, abs(intercept))
+        slope, intercept = new_slope, new_intercept
+        if converged:
+            break
+
+    return {
+        "slope": float(slope),
+        "intercept": float(intercept),
+        "r_squared": _r_squared(x, y, slope, intercept),
+        "slope_se": None,
+        "intercept_se": None,
+        "n": len(x),
+    }
+
+
+def dense_ranks(values):
+    """行ごとに、同値が同じ順位になる 0 始まりの整数の順位"""
+    order = np.argsort(values, axis=1)
+    ordered = np.take_along_axis(values, order, axis=1)
+    distinct = np.zeros(values.shape, dtype=np.int64)
+    distinct[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    # 並べ替えの逆置換（order の argsort）で元の位置に戻す
+    return np.take_along_axis(
+        np.cumsum(distinct, axis=1), np.argsort(order, axis=1), axis=1
+    )
+
+
+def count_inversions(values, ranked=False):
+    """i < j かつ values[i] > values[j] となる組の数（同値は数えない）
+
+    ボトムアップのマージソート。各段で隣り合う2ブロックを併合し（キーを
+    (ブロック, 順位, 左右) にした行ごとのソート）、右ブロックの各要素より
+    大きい左ブロックの要素数を、併合後の位置から一括で求める。全体で O(n log n)。
+    2次元配列を渡すと行ごとの転倒数の配列を返す（全行を同じ段でまとめて併合する）。
+    ranked=True のときは values を dense_ranks の順位として扱い、順位付けを省く。
+    """
+    values = np.asarray(values)
+    single = values.ndim == 1
+    values = np.atleast_2d(values)
+    ranks = values if ranked else dense_ranks(values)
+    n = ranks.shape[1]
+    # キーが収まる範囲で小さい整数型を使う（短い行を大量に扱うときの読み書きを減らす）
+    dtype = np.int32 if 2 * (n + 1) * n < 2**31 else np.int64
+    ranks = ranks.astype(dtype)
+    positions = np.arange(n, dtype=dtype)
+    totals = np.zeros(len(ranks), dtype=np.int64)
+    width = 1
+    while width < n:
+        chunk_start = positions // (2 * width) * (2 * width)
+        right = (positions // width) % 2
+        left_size = np.clip(n - chunk_start, 0, width)
+        # 同じ順位なら左ブロックを先に並べる（同値を転倒として数えない）。
+        # キーが同じ要素は入れ替わっても区別がないため、キーの値だけを並べ替え、
+        # 併合後の順位と左右はキーから復元する
+        key = np.sort((chunk_start * n + ranks) * 2 + right, axis=1)
+
+        # 併合後の右の要素の位置 = チャンク先頭 + 前にある右の要素数 + それ以下の左の要素数。
+        # 右の要素より大きい左の要素数の合計は、併合前の位置から決まる定数から
+        # 併合後の右の要素の位置の和を引いたものになる
+        constant = np.sum(right * (left_size + positions - width), dtype=np.int64)
+        totals += constant - (key & 1).astype(np.int64) @ positions.astype(np.int64)
+        ranks = (key >> 1) % n
+        width *= 2
+    return int(totals[0]) if single else totals
+
+
+def _count_slopes_below(x, y, t):
+    """xの昇順に並べた点について、傾きが t 未満のペア数（xが同じペアは除く）"""
+    z = y - t * x
+    # xが同じ点どうしは z の昇順に並べて転倒にならないようにする
+    order = np.lexsort((z, x))
+    return count_inversions(z[order])
+
+
+def theil_sen_fit(x, y, tol=1e-6, max_iter=60, seed=0):
+    """Theil-Sen推定（xが異なる全ペアの傾きの中央値と、残差の中央値による切片）
+
+    傾きが t 未満のペア数を転倒数として O(n log n) で数え、中央値の傾きを区間縮小で探す。
+    探索区間はランダムに抽出したペアの傾きの分位点から始め、区間幅が抽出した傾きの
+    四分位範囲の tol 倍以下になったら打ち切る。ペア数が偶数のときは下側の中央値。
+    """
+    x, y = _finite_pairs(x, y)
+    order = np.argsort(x, kind="stable")
+    x, y = x[order], y[order]
+    n = len(x)
+
+    _, tie_counts = np.unique(x, return_counts=True)
+    n_pairs = n * (n - 1) // 2 - int(np.sum(tie_counts * (tie_counts - 1) // 2))
+    if n_pairs == 0:
+        nan = float("nan")
+        return {
+            "slope": nan,
+            "intercept": nan,
+            "r_squared": nan,
+            "slope_se": None,
+            "intercept_se": None,
+            "n": n,
+        }
+    # 小さい方から k 番目（0始まり）の傾きを求める
+    k = (n_pairs - 1) // 2
+
+    if n_pairs <= THEIL_SEN_SAMPLE:
+        # ペアが少なければ全ての傾きを列挙する
+        i, j = np.triu_indices(n, 1)
+        distinct = x[i] != x[j]
+        slopes = (y[j] - y[i])[distinct] / (x[j] - x[i])[distinct]
+        slope = float(np.partition(slopes, k)[k])
+        intercept = float(np.median(y - slope * x))
+        return {
+            "slope": slope,
+            "intercept": intercept,
+            "r_squared": _r_squared(x, y, slope, intercept),
+            "slope_se": None,
+            "intercept_se": None,
+            "n": n,
+        }
+
+    # 抽出したペアの傾きで探索区間の初期値を決める
+    rng = np.random.default_rng(seed)
+    i = rng.integers(0, n, THEIL_SEN_SAMPLE)
+    j = rng.integers(0, n, THEIL_SEN_SAMPLE)
+    distinct = x[i] != x[j]
+    sample = np.sort((y[j] - y[i])[distinct] / (x[j] - x[i])[distinct])
+    q = k / n_pairs
+    margin = 3 * np.sqrt(q * (1 - q) / len(sample))
+    lo = np.quantile(sample, max(q - margin, 0.0))
+    hi = np.quantile(sample, min(q + margin, 1.0))
+    spread = np.subtract(*np.quantile(sample, [0.75, 0.25]))
+    step = max(spread, abs(hi - lo), 1e-12)
+
+    # 不変条件: (lo未満の傾きの数) <= k < (hi未満の傾きの数)
+    below_lo = _count_slopes_below(x, y, lo)
+    while below_lo > k:
+        lo -= step
+        step *= 2
+        below_lo = _count_slopes_below(x, y, lo)
+    step = max(spread, abs(hi - lo), 1e-12)
+    below_hi = _count_slopes_below(x, y, hi)
+    while below_hi <= k:
+        hi += step
+        step *= 2
+        below_hi = _count_slopes_below(x, y, hi)
+
+    # 傾きの数は中央値付近でほぼ線形に増えるので、数の線形補間で次の点を選ぶ
+    # （Illinois法。同じ側が続けて残ったら、その端の重みを半分にして停滞を防ぐ）
+    target = k + 0.5
+    f_lo, f_hi = below_lo - target, below_hi - target
+    side = 0
+    for _ in range(max_iter):
+        if hi - lo <= tol * max(spread, 1e-300) or below_hi - below_lo <= 1:
+            break
+        mid = lo + (hi - lo) * f_lo / (f_lo - f_hi)
+        if not lo < mid < hi:
+            mid = (lo + hi) / 2
+        count = _count_slopes_below(x, y, mid)
+        if count <= k:
+            lo, below_lo, f_lo = mid, count, count - target
+            if side == -1:
+                f_hi /= 2
+            side = -1
+        else:
+            hi, below_hi, f_hi = mid, count, count - target
+            if side == 1:
+                f_lo /= 2
+            side = 1
+
+    slope = (lo + hi) / 2
+    intercept = float(np.median(y - slope * x))
+    return {
+        "slope": float(slope),
+        "intercept": intercept,
+        "r_squared": _r_squared(x, y, slope, intercept),
+        "slope_se": None,
+        "intercept_se": None,
+        "n": n,
+    }
+
+
+FITS = {
+    "ols": ols_fit,
+    "huber": huber_fit,
+    "theil_sen": theil_sen_fit,
+}
+
+
+def fit_line(x, y, method="ols"):
+    """method（"ols" / "huber" / "theil_sen"）で回帰直線を求める"""
+    if method not in FITS:
+        raise ValueError(f"不明な回帰手法です: {method}")
+    return FITS[method](x, y)
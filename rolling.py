@@ -0,0 +1,173 @@
+"""累積和による移動統計量
+
+2銘柄のリターン系列について Σx, Σy, Σxy, Σx², Σy² の累積和を一度だけ作り、
+任意の窓幅の移動相関・共分散・ベータを累積和の差分（O(n)）で求める。
+全期間の回帰直線も同じ累積和の最終値から閉形式で求める。
+新しいバーは append で末尾に足せる（累積和を追加分だけ延長し、全体は再計算しない）。
+"""
+
+import numpy as np
+import pandas as pd
+
+from regression import ols_from_sums
+
+# 相関サーフェスで使う窓幅（移動窓スライダーと同じ範囲）
+SURFACE_WINDOWS = tuple(range(20, 121, 5))
+
+
+class RollingPairStats:
+    """2銘柄の移動統計量を累積和から計算する
+
+    x, y は同じ日付インデックスを持つリターンのSeries。
+    欠損は両方の値がある日だけを数える（pandasのrollingと同じ扱い）。
+    """
+
+    def __init__(self, x, y):
+        x, y = x.align(y, join="inner")
+        self._index_parts = [x.index]
+
+        x_values = x.to_numpy(dtype=np.float64)
+        y_values = y.to_numpy(dtype=np.float64)
+        valid = np.isfinite(x_values) & np.isfinite(y_values)
+
+        # 桁落ちを避けるため全体平均で中心化（共分散・相関・ベータは平行移動で不変）
+        # 追加するバーも同じ値で中心化する
+        self.x_mean = float(np.mean(x_values[valid])) if valid.any() else 0.0
+        self.y_mean = float(np.mean(y_values[valid])) if valid.any() else 0.0
+
+        # 先頭に0を置いた累積和。窓 (t-w, t] の和は prefix[t+1] - prefix[t+1-w]
+        # 追加に備えて列に余裕を持たせ、使っている長さは _length で管理する
+        columns = self._columns(x_values, y_values)
+        self._length = columns.shape[1]
+        self._prefix = np.zeros((columns.shape[0], self._length + 1))
+        np.cumsum(columns, axis=1, out=self._prefix[:, 1:])
+
+    def _columns(self, x_values, y_values):
+        valid = np.isfinite(x_values) & np.isfinite(y_values)
+        x_values = np.where(valid, x_values - self.x_mean, 0.0)
+        y_values = np.where(valid, y_values - self.y_mean, 0.0)
+        return np.stack(
+            [
+                valid.astype(np.float64),
+                x_values,
+                y_values,
+                x_values * y_values,
+                x_values**2,
+                y_values**2,
+            ]
+        )
+
+    @property
+    def prefix(self):
+        return self._prefix[:, : self._length + 1]
+
+    @property
+    def index(self):
+        # 追加した分のインデックスは必要になったときに1つにまとめる
+        if len(self._index_parts) > 1:
+            self._index_parts = [self._index_parts[0].append(self._index_parts[1:])]
+        return self._index_parts[0]
+
+    def __len__(self):
+        return self._length
+
+    def append(self, x, y):
+        """新しいバーのリターンを末尾に追加する（計算量は追加分に比例）"""
+        x, y = x.align(y, join="inner")
+        columns = self._columns(
+            x.to_numpy(dtype=np.float64), y.to_numpy(dtype=np.float64)
+        )
+        count = columns.shape[1]
+        if count == 0:
+            return
+        end = self._length + 1 + count
+        if end > self._prefix.shape[1]:
+            # 容量を倍にして確保し直す（追加1回あたりの複製は償却で定数）
+            grown = np.zeros(
+                (self._prefix.shape[0], max(end, 2 * self._prefix.shape[1]))
+            )
+            grown[:, : self._length + 1] = self.prefix
+            self._prefix = grown
+        tail = self._prefix[:, self._length + 1 : end]
+        np.cumsum(columns, axis=1, out=tail)
+        tail += self._prefix[:, self._length, None]
+        self._length += count
+        self._index_parts.append(x.index)
+
+    def _window_sums(self, windows, start=0):
+        """各窓幅・各時点の (n, Σx, Σy, Σxy, Σx², Σy²) を返す（形状: 6×窓数×時点数）
+
+        start 以降の時点だけを計算する（直近の値だけが必要な場合）。
+        """
+        windows = np.asarray(windows, dtype=np.int64).reshape(-1, 1)
+        end = np.arange(start + 1, len(self) + 1)
+        begin = end - windows
+        prefix = self.prefix
+        sums = prefix[:, None, end] - prefix[:, np.maximum(begin, 0)]
+        # 窓が系列の先頭からはみ出す時点は計算しない
+        sums[:, begin < 0] = np.nan
+        return sums
+
+    def _moments(self, windows, start=0):
+        n, sx, sy, sxy, sxx, syy = self._window_sums(windows, start)
+        windows = np.asarray(windows).reshape(-1, 1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # 不偏推定（ddof=1）。pandasのrolling().cov()と同じ定義
+            cov = (sxy - sx * sy / n) / (n - 1)
+            var_x = (sxx - sx**2 / n) / (n - 1)
+            var_y = (syy - sy**2 / n) / (n - 1)
+        # pandasのrolling()と同じく、窓内の有効日数が窓幅に満たない時点はNaN
+        insufficient = ~(n >= windows)
+        for values in (cov, var_x, var_y):
+            values[insufficient] = np.nan
+        return cov, var_x, var_y
+
+    def _series(self, values, window):
+        return pd.Series(values[0], index=self.index, name=window).dropna()
+
+    def correlation(self, window):
+        """window日の移動相関係数"""
+        return self._series(self.correlation_surface([window]), window)
+
+    def covariance(self, window):
+        """window日の移動共分散"""
+        cov, _, _ = self._moments([window])
+        return self._series(cov, window)
+
+    def beta(self, window):
+        """window日の移動ベータ（yのxに対する感応度 Cov(x, y) / Var(x)）"""
+        cov, var_x, _ = self._moments([window])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._series(cov / var_x, window)
+
+    def beta_surface(self, windows=SURFACE_WINDOWS):
+        """複数の窓幅の移動ベータを一度に計算する（形状: 窓数×時点数）"""
+        cov, var_x, _ = self._moments(windows)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return cov / var_x
+
+    def latest_correlation(self, window, count=1):
+        """直近 count 時点の window 日移動相関（配列。計算量は count に比例）"""
+        start = max(len(self) - count, 0)
+        return self.correlation_surface([window], start=start)[0]
+
+    def overall_correlation(self):
+        """全期間の相関係数（累積和の最終値から O(1)）"""
+        fit = self.regression()
+        return float(np.sign(fit["slope"]) * np.sqrt(fit["r_squared"]))
+
+    def regression(self):
+        """全期間の最小二乗回帰 y = intercept + slope * x（regression.ols_from_sums を参照）"""
+        return ols_from_sums(
+            *self.prefix[:, -1], x_offset=self.x_mean, y_offset=self.y_mean
+        )
+
+    def correlation_surface(self, windows=SURFACE_WINDOWS, start=0):
+        """複数の窓幅の移動相関を一度に計算する（形状: 窓数×時点数）
+
+        start を指定すると、その時点以降だけを計算する。
+        """
+        cov, var_x, var_y = self._moments(windows, start)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = cov / np.sqrt(var_x * var_y)
+        return np.clip(corr, -1.0, 1.0)
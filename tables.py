@@ -0,0 +1,50 @@
+"""データテーブルのページ分割とダウンロード
+
+表示・ダウンロードはArrowのテーブルを1つだけ作って使い回す。
+ページはテーブルのスライス（コピーなし）で切り出し、書式は表示側（column_config）
+で指定するため、書式付きの文字列のコピーは作らない。
+"""
+
+import io
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+# 1ページに表示する行数
+PAGE_SIZE = 250
+
+
+def to_arrow(frame, index_name="日付"):
+    """DataFrameをインデックスを列に含めたArrowテーブルに変換する"""
+    return pa.Table.from_pandas(
+        frame.rename_axis(index_name).reset_index(), preserve_index=False
+    )
+
+
+def page_count(table, page_size=PAGE_SIZE):
+    return max(-(-table.num_rows // page_size), 1)
+
+
+def page(table, number, page_size=PAGE_SIZE):
+    """number ページ目（1始まり）の行（ゼロコピーのスライス）"""
+    return table.slice((number - 1) * page_size, page_size)
+
+
+def csv_bytes(table):
+    """CSVに変換する（pyarrowがレコードバッチ単位で書き出す）"""
+    buffer = io.BytesIO()
+    pa_csv.write_csv(table, buffer)
+    return buffer.getvalue()
+
+
+def parquet_bytes(table):
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    return buffer.getvalue()
+
+
+EXPORTS = {
+    "CSV": (csv_bytes, "csv", "text/csv"),
+    "Parquet": (parquet_bytes, "parquet", "application/vnd.apache.parquet"),
+}
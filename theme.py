@@ -0,0 +1,203 @@
+"""画面の配色とカスタムCSS
+
+アプリの再実行ごとに作り直さないよう、定数としてモジュールにまとめる
+（モジュールはプロセスで1回だけ読み込まれる）。
+"""
+
+# 黒とミントグリーンを基調としたスタイル設定
+MINT_GREEN = "#3EB489"
+DARK_BG = "#121212"
+LIGHT_MINT = "#8ED3B5"
+TEXT_COLOR = "#FFFFFF"
+
+# 相関係数の強さ区分ごとの色（強い負の相関 → 強い正の相関）
+CORRELATION_BAND_COLORS = ["#F44336", "#FF9800", "#4682B4", LIGHT_MINT, MINT_GREEN]
+
+# チャートのテーマ
+THEME_COLORS = {
+    "ブルー": {
+        "primary": "#4361ee",
+        "secondary": "#3f37c9",
+        "accent": "#4895ef",
+        "divergent": "RdBu",
+    },
+    "グリーン": {
+        "primary": "#2D936C",
+        "secondary": "#1F6E54",
+        "accent": "#38B09D",
+        "divergent": "BrBG",
+    },
+    "レッド": {
+        "primary": "#FF5A5F",
+        "secondary": "#C73E42",
+        "accent": "#FF8A8E",
+        "divergent": "RdGy",
+    },
+    "ダーク": {
+        "primary": "#374151",
+        "secondary": "#1F2937",
+        "accent": "#4B5563",
+        "divergent": "inferno",
+    },
+}
+
+# モダンなデザインのカスタムCSS - 黒とミントグリーンのテーマ
+CUSTOM_CSS = """
+<style>
+    /* 全体のテーマカラー - 黒とミントグリーン */
+    :root {
+        --primary: #3EB489;
+        --secondary: #2D8E6E;
+        --accent: #8ED3B5;
+        --background: #121212;
+        --text: #FFFFFF;
+        --light-text: #AAAAAA;
+        --card-bg: #1E1E1E;
+        --positive: #4CAF50;
+        --negative: #F44336;
+        --neutral: #8ED3B5;
+    }
+    
+    /* 全体の背景色を黒に */
+    .stApp {
+        background-color: var(--background);
+    }
+    
+    /* メインヘッダー */
+    .main-header {
+        font-size: 2.8rem;
+        font-weight: 700;
+        color: var(--primary);
+        text-align: center;
+        margin-bottom: 1rem;
+        background: linear-gradient(90deg, var(--primary), var(--accent));
+        -webkit-background-clip: text;
+        -webkit-text-fill-color: transparent;
+        padding: 1.5rem 0;
+    }
+    
+    /* サブヘッダー */
+    .sub-header {
+        font-size: 1.8rem;
+        font-weight: 600;
+        color: var(--secondary);
+        margin: 1.5rem 0 1rem 0;
+        border-left: 5px solid var(--accent);
+        padding-left: 0.8rem;
+    }
+    
+    /* カードスタイル */
+    .card {
+        padding: 1.8rem;
+        border-radius: 12px;
+        background-color: var(--card-bg);
+        box-shadow: 0 6px 16px rgba(0,0,0,0.3);
+        margin-bottom: 1.8rem;
+        border: 1px solid rgba(255,255,255,0.1);
+        transition: transform 0.3s ease, box-shadow 0.3s ease;
+    }
+    
+    .card:hover {
+        transform: translateY(-5px);
+        box-shadow: 0 12px 20px rgba(0,0,0,0.4);
+    }
+    
+    /* 相関ガイド */
+    .correlation-guide {
+        background-color: rgba(62, 180, 137, 0.1);
+        padding: 1.2rem;
+        border-radius: 10px;
+        margin-top: 1rem;
+        border-left: 4px solid var(--accent);
+    }
+    
+    /* 免責事項 */
+    .disclaimer {
+        font-size: 0.8rem;
+        color: var(--light-text);
+        font-style: italic;
+        text-align: center;
+        margin-top: 2rem;
+        padding: 1rem;
+        background-color: rgba(30, 30, 30, 0.7);
+        border-radius: 8px;
+    }
+    
+    /* ボタンスタイル */
+    .stButton>button {
+        background-color: var(--primary);
+        color: white;
+        border-radius: 8px;
+        border: none;
+        padding: 0.5rem 1rem;
+        transition: all 0.3s ease;
+    }
+    
+    .stButton>button:hover {
+        background-color: var(--secondary);
+        transform: translateY(-2px);
+        box-shadow: 0 4px 8px rgba(0,0,0,0.2);
+    }
+    
+    /* タブスタイル */
+    .stTabs [data-baseweb="tab-list"] {
+        gap: 10px;
+    }
+    
+    .stTabs [data-baseweb="tab"] {
+        border-radius: 6px 6px 0px 0px;
+        padding: 10px 16px;
+        background-color: #2A2A2A;
+        color: var(--text);
+    }
+    
+    .stTabs [aria-selected="true"] {
+        background-color: var(--accent) !important;
+        color: black !important;
+    }
+    
+    /* テキストインプットスタイル */
+    .stTextInput input {
+        border-radius: 8px;
+        border: 1px solid #444444;
+        padding: 10px;
+        background-color: #2A2A2A;
+        color: var(--text);
+    }
+    
+    .stTextInput input:focus {
+        border-color: var(--primary);
+        box-shadow: 0 0 0 2px rgba(62, 180, 137, 0.3);
+    }
+    
+    /* リスト項目と目安の表示改善 */
+    .correlation-scale {
+        display: flex;
+        align-items: center;
+        margin-bottom: 0.5rem;
+        color: var(--text);
+    }
+    
+    .scale-indicator {
+        width: 12px;
+        height: 12px;
+        border-radius: 50%;
+        margin-right: 8px;
+    }
+    
+    /* Streamlit要素のテキスト色調整 */
+    .stMarkdown, h1, h2, h3, h4, h5, p, span, label {
+        color: var(--text) !important;
+    }
+    
+    /* レスポンシブ調整 */
+    @media only screen and (max-width: 768px) {
+        .main-header {
+            font-size: 2rem;
+        }
+        .sub-header {
+            font-size: 1.5rem;
+        }
+    }
+</style>
+"""